@@ -0,0 +1,129 @@
+# Startup time of the scripts of a team folder (every one with a main() entry point, or the ones named): the
+# `python -X importtime` import time of the script and of the heaviest modules it imports, and the wall time of
+# running it with --help, which starts the interpreter, imports the script and exits after parsing the arguments.
+# Short-lived cron runs pay this on every start, so heavy dependencies are imported where they are first used.
+#
+#     python benchmark_startup.py gamma/arbitrage --out before.json
+#     # ... change something ...
+#     python benchmark_startup.py gamma/arbitrage --baseline before.json --target 0.5   # fails past half of before
+#     python benchmark_startup.py gamma/arbitrage driver scan --runs 20
+#     python benchmark_startup.py theta
+#     python benchmark_startup.py delta/data_ingestion main
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# import time: self [us] | cumulative | imported package
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+
+# Gets the scripts of `folder` with a main() entry point.
+def find_scripts(folder):
+    scripts = []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(folder, name)) as f:
+            source = f.read()
+        if '\ndef main(' in source and '__main__' in source:
+            scripts.append(name[:-len('.py')])
+    return scripts
+
+
+# Imports a script in a new interpreter with -X importtime. Returns its import time in ms and the `top` modules it
+# imports directly with the longest (cumulative) import times, or the error if it can not be imported.
+def import_time(script, folder, top=5):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {script}'], cwd=folder,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1]}
+    total, children = None, []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        cumulative, depth, name = int(match.group(2)), (len(match.group(3)) - 1) // 2, match.group(4)
+        if depth == 0 and name == script:
+            total = cumulative
+        elif depth == 1:
+            children.append((cumulative, name))
+        elif depth == 0:
+            # Modules imported before the script (site and what it loads) are not part of its import time.
+            children = []
+    return {
+        'import_ms': total / 1000,
+        'top': {name: cumulative / 1000 for cumulative, name in sorted(children, reverse=True)[:top]},
+    }
+
+
+# Gets the median wall time in ms of running `command` in `folder`, after one run to warm the file cache.
+def wall_time(command, folder, runs=10):
+    times = []
+    for i in range(runs + 1):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=folder, capture_output=True)
+        if i:
+            times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def run(folder, scripts, runs=10):
+    results = {'python': {'help_ms': wall_time([sys.executable, '-c', 'pass'], folder, runs)}}
+    for script in scripts:
+        results[script] = import_time(script, folder)
+        if 'error' not in results[script]:
+            results[script]['help_ms'] = wall_time([sys.executable, f'{script}.py', '--help'], folder, runs)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', help='folder of the scripts, e.g. theta, gamma/arbitrage or delta/data_ingestion')
+    parser.add_argument('scripts', nargs='*', help='scripts to time, every one with a main() by default')
+    parser.add_argument('--runs', type=int, default=10, help='runs of --help per script')
+    parser.add_argument('--out', help='JSON file to save the results to')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare to')
+    parser.add_argument('--target', type=float, default=0.5,
+                        help='largest import time allowed, as a fraction of the baseline')
+    args = parser.parse_args(argv)
+
+    assert os.path.isdir(args.folder), f"no folder {args.folder}"
+    results = run(args.folder, args.scripts or find_scripts(args.folder), args.runs)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'script':<16} {'import ms':>10} {'--help ms':>10} {'baseline':>10}  heaviest imports")
+    print(f"{'(python)':<16} {'':>10} {results['python']['help_ms']:>10.1f}")
+    failed = []
+    for script, result in results.items():
+        if script == 'python':
+            continue
+        if 'error' in result:
+            print(f"{script:<16} {result['error']}")
+            continue
+        ratio = ''
+        before = baseline.get(script, {}).get('import_ms')
+        if before:
+            ratio = f"{result['import_ms'] / before:.2f}x"
+            if result['import_ms'] > args.target * before:
+                failed.append(script)
+        top = ', '.join(f'{name} {ms:.0f}' for name, ms in result['top'].items())
+        print(f"{script:<16} {result['import_ms']:>10.1f} {result['help_ms']:>10.1f} {ratio:>10}  {top}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        print(f"import time above {args.target:.0%} of the baseline: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+Benchmark suite for FeatureTransform and the DataClient read path, on synthetic long format panels.
+
+Every FeatureTransform method (and the pipeline, incremental and compact variants) is timed and memory profiled
+at each panel size, as are DataClient.get_prices against a local SQLite copy of the prices table, uncached and
+through a warm PriceCache, and a PriceLoader upsert into it. Results are written as JSON, and `compare` flags cases that got slower or use more
+memory than a saved baseline (exit code 1 if any did):
+
+    python benchmark.py run --sizes 100x5y 1000x5y --out baseline.json
+    python benchmark.py run --sizes 100x5y 1000x5y --out current.json
+    python benchmark.py compare baseline.json current.json --threshold 0.25
+
+`speedups` times the batched methods against the per-group or pandas code they replace (the pandas and numpy
+engines, rolling_beta_matrix against rolling_beta per ticker, percent_from_trailing_extremes and moving_averages
+against a grouped call per window, a ShardedFeaturePipeline over --workers processes against the pipeline it
+shards), checks that both give the same features, and reports the peak memory and result size of rolling_zscore
+with the panel as is and in compact mode:
+
+    python benchmark.py speedups --sizes 1000x5y --workers 8
+
+Peak memory is measured with tracemalloc, which sees numpy and Python allocations but not Arrow buffers.
+"""
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+import numpy as np
+import pandas as pd
+
+from data.cache import PriceCache
+from data.constants import CLOSE, DATA_DATE, TICKER, VOLUME
+from data.data import PRICE_COLUMNS, DataClient
+from data.loader import PriceLoader, connect_sqlite
+from feature_transform import FeaturePipeline, FeatureTransform, IncrementalFeatureTransform, ShardedFeaturePipeline
+
+# Panel sizes: (tickers, years of 252 trading days)
+SIZES = {
+    '100x5y': (100, 5),
+    '1000x5y': (1000, 5),
+    '1000x25y': (1000, 25),
+    '5000x5y': (5000, 5),
+    '5000x25y': (5000, 25),
+}
+WINDOW = 60
+DATA_CASES = [
+    'DataClient.get_prices[all]', 'DataClient.get_prices[50 ids, 1y]', 'DataClient.get_prices[cached]',
+    'PriceLoader.load[upsert 1y]',
+]
+
+
+def make_panel(n_tickers: int, n_years: int, seed: int = 0) -> pd.DataFrame:
+    """Builds a long format panel shaped like `DataClient.get_prices` output: sorted by date, with every price
+    column, some missing closes, and a tenth of the tickers only listed from a third of the way in."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2000-01-03", periods=252 * n_years, name=DATA_DATE)
+    n = len(dates) * n_tickers
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (len(dates), n_tickers)), axis=0)).ravel()
+    spread = np.abs(rng.normal(0, 0.01, n))
+    panel = pd.DataFrame({
+        TICKER: np.tile([f"T{i:05d}" for i in range(n_tickers)], len(dates)),
+        'o': close * (1 + rng.normal(0, 0.005, n)),
+        'h': close * (1 + spread),
+        'l': close * (1 - spread),
+        CLOSE: close,
+        'vwap': close * (1 + rng.normal(0, 0.002, n)),
+        VOLUME: rng.integers(10_000, 10_000_000, n).astype(np.float64),
+        'transactions': rng.integers(100, 100_000, n).astype(np.float64),
+    }, index=np.repeat(dates, n_tickers))
+    panel.loc[rng.random(n) < 0.02, CLOSE] = np.nan
+    listed = rng.random(n_tickers) < 0.1
+    first_row = np.repeat(np.arange(len(dates)), n_tickers) < np.tile(np.where(listed, len(dates) // 3, 0), len(dates))
+    return panel[~first_row]
+
+
+############################################
+# Cases
+############################################
+
+def feature_cases(panel: pd.DataFrame) -> Dict[str, Callable]:
+    """Gets a no-argument function per FeatureTransform case on `panel`."""
+    features = panel[[TICKER, CLOSE, VOLUME]]
+    grouped = features.groupby(TICKER)[CLOSE]
+    prices = features.reset_index().pivot(index=DATA_DATE, columns=TICKER, values=CLOSE)
+    benchmark = prices.mean(axis=1)
+    features = features.assign(benchmark=benchmark.reindex(features.index).to_numpy())
+    compact = FeatureTransform.compact(features)
+    last_date = features.index.max()
+    history, today = features[features.index < last_date], features[features.index == last_date]
+    momentum = [(col, 'ema', span) for col in (CLOSE, VOLUME) for span in (12, 26, 50, 200)]
+    momentum += [(col, 'sma', window) for col in (CLOSE, VOLUME) for window in (20, 50, 200)]
+    pipeline = (
+        FeaturePipeline()
+        .sma(CLOSE, 20).sma(CLOSE, 50).ema(CLOSE, 12).ema(CLOSE, 26)
+        .rolling_zscore([CLOSE, VOLUME], WINDOW)
+        .rolling_beta(CLOSE, 'benchmark', 252)
+        .percent_from_trailing_max(CLOSE, 21).percent_from_trailing_max(CLOSE, 252).percent_from_trailing_min(CLOSE, 252)
+    )
+
+    def incremental_update():
+        stream = IncrementalFeatureTransform().sma(CLOSE, 20).ema(CLOSE, 12).rolling_beta(CLOSE, 'benchmark', WINDOW)
+        stream.update(history)
+        start = time.perf_counter()
+        stream.update(today)
+        return time.perf_counter() - start
+
+    return {
+        'rolling_beta': lambda: [FeatureTransform.rolling_beta(prices[col], benchmark, WINDOW) for col in prices],
+        'rolling_beta_matrix': lambda: FeatureTransform.rolling_beta_matrix(prices, benchmark, WINDOW),
+        'percent_from_trailing_max': lambda: grouped.transform(FeatureTransform.percent_from_trailing_max, WINDOW),
+        'percent_from_trailing_min': lambda: grouped.transform(FeatureTransform.percent_from_trailing_min, WINDOW),
+        'percent_from_trailing_extremes': lambda: FeatureTransform.percent_from_trailing_extremes(
+            features, [21, 63, 126, 252], columns=[CLOSE], inplace=False
+        ),
+        'sma': lambda: grouped.transform(FeatureTransform.sma, WINDOW),
+        'ema': lambda: grouped.transform(FeatureTransform.ema, WINDOW),
+        'moving_averages': lambda: FeatureTransform.moving_averages(features, momentum, inplace=False),
+        'moving_averages[per call]': lambda: [
+            features.groupby(TICKER)[col].transform(getattr(FeatureTransform, kind), window)
+            for col, kind, window in momentum
+        ],
+        'rolling_zscore': lambda: FeatureTransform.rolling_zscore(features, WINDOW, inplace=False),
+        'rolling_zscore[pandas]': lambda: FeatureTransform.rolling_zscore(features, WINDOW, inplace=False, engine='pandas'),
+        'rolling_zscore[compact]': lambda: FeatureTransform.rolling_zscore(compact, WINDOW, inplace=False, dtype=np.float32),
+        'cross_sectional_zscore': lambda: FeatureTransform.cross_sectional_zscore(features, inplace=False),
+        'cross_sectional_zscore[pandas]': lambda: FeatureTransform.cross_sectional_zscore(
+            features, inplace=False, engine='pandas'
+        ),
+        'FeaturePipeline.run': lambda: pipeline.run(features),
+        # Only the last day's update is timed, after the history is loaded
+        'IncrementalFeatureTransform.update': incremental_update,
+    }
+
+
+def speedup_cases(panel: pd.DataFrame, workers: int) -> Dict[str, tuple]:
+    """Gets, per batched FeatureTransform method, a (baseline name, baseline, name, function, check) tuple: no-argument
+    functions for the code it replaces and for the method, and an assertion that their results agree."""
+    features = panel[[TICKER, CLOSE, VOLUME]]
+    grouped = features.groupby(TICKER)[CLOSE]
+    prices = features.reset_index().pivot(index=DATA_DATE, columns=TICKER, values=CLOSE)
+    benchmark = prices.mean(axis=1)
+    features = features.assign(benchmark=benchmark.reindex(features.index).to_numpy())
+    windows = [21, 63, 126, 252]
+    momentum = [(col, kind, window) for col in (CLOSE, VOLUME) for kind, window in
+                [('ema', 12), ('ema', 26), ('ema', 50), ('ema', 200), ('sma', 20), ('sma', 50), ('sma', 200)]]
+    pipeline = FeaturePipeline()
+    for col in (CLOSE, VOLUME):
+        pipeline.sma(col, WINDOW).ema(col, WINDOW).percent_from_trailing_max(col, WINDOW).rolling_beta(col, 'benchmark', WINDOW)
+    pipeline.rolling_zscore([CLOSE, VOLUME], WINDOW)
+
+    def per_window():
+        expected = {}
+        for window in windows:
+            expected[f'{CLOSE}_pct_from_max_{window}'] = grouped.transform(FeatureTransform.percent_from_trailing_max, window)
+            expected[f'{CLOSE}_pct_from_min_{window}'] = grouped.transform(FeatureTransform.percent_from_trailing_min, window)
+        return pd.DataFrame(expected)
+
+    def per_call():
+        return pd.DataFrame({
+            f'{col}_{kind}_{window}': features.groupby(TICKER)[col].transform(getattr(FeatureTransform, kind), window)
+            for col, kind, window in momentum
+        })
+
+    def close(**kwargs):
+        return lambda result, expected: pd.testing.assert_frame_equal(result, expected, rtol=1e-7, **kwargs)
+
+    def same_columns(result, expected):
+        pd.testing.assert_frame_equal(result[expected.columns], expected, rtol=1e-7)
+
+    def exact(result, expected):
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+    return {
+        'rolling_zscore': (
+            'pandas', lambda: FeatureTransform.rolling_zscore(features, WINDOW, inplace=False, engine='pandas'),
+            'numpy', lambda: FeatureTransform.rolling_zscore(features, WINDOW, inplace=False), close()
+        ),
+        'cross_sectional_zscore': (
+            'pandas', lambda: FeatureTransform.cross_sectional_zscore(features, inplace=False, engine='pandas'),
+            'numpy', lambda: FeatureTransform.cross_sectional_zscore(features, inplace=False), close()
+        ),
+        'rolling_beta_matrix': (
+            'series', lambda: pd.DataFrame({col: FeatureTransform.rolling_beta(prices[col], benchmark, WINDOW) for col in prices}),
+            'matrix', lambda: FeatureTransform.rolling_beta_matrix(prices, benchmark, WINDOW), close(check_names=False)
+        ),
+        'percent_from_trailing_extremes': (
+            'window', per_window,
+            'sweep', lambda: FeatureTransform.percent_from_trailing_extremes(features, windows, columns=[CLOSE], inplace=False),
+            same_columns
+        ),
+        'moving_averages': (
+            'call', per_call, 'batch', lambda: FeatureTransform.moving_averages(features, momentum, inplace=False), same_columns
+        ),
+        # The shards are the same groups run apart, so the features are the same bit for bit.
+        'ShardedFeaturePipeline.run': (
+            'single', lambda: pipeline.run(features),
+            f'{workers} workers', lambda: ShardedFeaturePipeline(pipeline, workers=workers).run(features),
+            exact
+        ),
+    }
+
+
+def create_prices_db(panel: pd.DataFrame, path: str) -> None:
+    """Writes `panel` to a SQLite file with the layout of the prices table."""
+    loader = PriceLoader(lambda: connect_sqlite(path), paramstyle="qmark", method="values", workers=1, verbose=False)
+    loader.load([('panel', lambda: panel)])
+
+
+def data_cases(panel: pd.DataFrame, tmp_dir: str) -> Dict[str, Callable]:
+    """Gets a no-argument function per DataClient.get_prices case, against a SQLite copy of `panel`."""
+    path = os.path.join(tmp_dir, 'prices.db')
+    create_prices_db(panel, path)
+    client = DataClient(connect_sqlite(path), paramstyle="qmark")
+    cached_client = DataClient(connect_sqlite(path), paramstyle="qmark", cache=PriceCache(os.path.join(tmp_dir, 'cache')))
+
+    dates = panel.index.unique()
+    start, end = dates[0].date(), dates[-1].date()
+    last_year = dates[-252].date()
+    ids = sorted(panel[TICKER].unique())[:50]
+    # Warm the cache, so its case times reads
+    cached_client.get_prices(None, start, end, PRICE_COLUMNS)
+    # Rewrites the last year, which is all conflicts, so every repeat does the same work
+    loader = PriceLoader(lambda: connect_sqlite(path), paramstyle="qmark", method="values", workers=1, verbose=False)
+    last_year_panel = panel[panel.index >= pd.Timestamp(last_year)]
+
+    return dict(zip(DATA_CASES, [
+        lambda: client.get_prices(None, start, end, [CLOSE, VOLUME]),
+        lambda: client.get_prices(ids, last_year, end, PRICE_COLUMNS),
+        lambda: cached_client.get_prices(None, start, end, [CLOSE, VOLUME]),
+        lambda: loader.load([('last year', lambda: last_year_panel)]),
+    ]))
+
+
+############################################
+# Measurement
+############################################
+
+def measure(function: Callable, repeat: int) -> dict:
+    """Times `function` `repeat` times, then runs it once more under tracemalloc for its peak memory. A function
+    that returns a float reports its own time (for cases with a setup that is not timed)."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        times.append(result if isinstance(result, float) else elapsed)
+        del result
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'seconds': min(times),
+        'median_seconds': statistics.median(times),
+        'peak_mb': peak / 2 ** 20,
+    }
+
+
+def is_selected(name: str, patterns: List[str]) -> bool:
+    # Names are matched literally too, since fnmatch reads the brackets of e.g. "rolling_zscore[pandas]" as a set.
+    return any(name == pattern or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def run(sizes: List[str], cases: List[str], repeat: int) -> dict:
+    results = []
+    for size in sizes:
+        n_tickers, n_years = SIZES[size]
+        panel = make_panel(n_tickers, n_years)
+        print(f"{size}: {len(panel):,} rows", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            all_cases = feature_cases(panel)
+            if any(is_selected(name, cases) for name in DATA_CASES):
+                all_cases.update(data_cases(panel, tmp_dir))
+            for name, function in all_cases.items():
+                if not is_selected(name, cases):
+                    continue
+                result = {'size': size, 'case': name, 'rows': len(panel), **measure(function, repeat)}
+                print(f"  {name:<38} {result['seconds']:9.4f}s {result['peak_mb']:9.1f}MB", file=sys.stderr)
+                results.append(result)
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def speedups(sizes: List[str], workers: int) -> dict:
+    results = []
+    for size in sizes:
+        n_tickers, n_years = SIZES[size]
+        panel = make_panel(n_tickers, n_years)
+        print(f"{size}: {len(panel):,} rows", file=sys.stderr)
+        for name, (baseline_name, baseline, method_name, method, check) in speedup_cases(panel, workers).items():
+            start = time.perf_counter()
+            expected = baseline()
+            baseline_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            result = method()
+            seconds = time.perf_counter() - start
+            check(result, expected)
+            print(
+                f"  {name:<32} {baseline_name} {baseline_seconds:8.3f}s   {method_name} {seconds:8.3f}s   "
+                f"speedup {baseline_seconds / seconds:6.1f}x", file=sys.stderr
+            )
+            results.append({'size': size, 'case': name, 'rows': len(panel), 'baseline_seconds': baseline_seconds,
+                            'seconds': seconds, 'speedup': baseline_seconds / seconds})
+
+        # tracemalloc sees the numpy buffers, but not the Arrow buffers of string columns, which memory_usage does.
+        features = panel[[TICKER, CLOSE, VOLUME]]
+        for name, data, dtype in [('rolling_zscore', features, np.float64),
+                                  ('rolling_zscore[compact]', FeatureTransform.compact(features), np.float32)]:
+            tracemalloc.start()
+            result = FeatureTransform.rolling_zscore(data, WINDOW, inplace=False, dtype=dtype)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            frame_mb = result.memory_usage(deep=True).sum() / 2 ** 20
+            print(f"  {name:<32} peak {peak / 2 ** 20:9.1f}MB   frame {frame_mb:9.1f}MB", file=sys.stderr)
+            results.append({'size': size, 'case': name, 'rows': len(panel), 'peak_mb': peak / 2 ** 20,
+                            'frame_mb': frame_mb})
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'workers': workers,
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_seconds: float, min_mb: float) -> List[dict]:
+    """Matches the cases of two runs by (size, case), and gets the ones whose time or peak memory grew by more than
+    `threshold` (a fraction) and by more than `min_seconds` / `min_mb`, so that noise on tiny cases is ignored."""
+    base = {(r['size'], r['case']): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        before = base.get((result['size'], result['case']))
+        if before is None:
+            continue
+        for metric, floor in [('seconds', min_seconds), ('peak_mb', min_mb)]:
+            old, new = before[metric], result[metric]
+            change = new / old - 1 if old > 0 else float('inf') if new > 0 else 0.0
+            result[f'{metric}_change'] = change
+            if change > threshold and new - old > floor:
+                regressions.append({'size': result['size'], 'case': result['case'], 'metric': metric,
+                                    'baseline': old, 'current': new, 'change': change})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write their results as JSON')
+    run_parser.add_argument('--sizes', nargs='+', default=['100x5y', '1000x5y'], choices=list(SIZES))
+    run_parser.add_argument('--cases', nargs='+', default=['*'], help='case name patterns, e.g. "rolling_zscore*"')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--out', help='JSON file to write, stdout by default')
+
+    speedups_parser = commands.add_parser('speedups', help='time the batched methods against the code they replace')
+    speedups_parser.add_argument('--sizes', nargs='+', default=['100x5y'], choices=list(SIZES))
+    speedups_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes of the sharded pipeline')
+    speedups_parser.add_argument('--out', help='JSON file to write, stdout by default')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions of a run against a baseline run')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative increase')
+    compare_parser.add_argument('--min-seconds', type=float, default=0.01, help='ignore time increases below this')
+    compare_parser.add_argument('--min-mb', type=float, default=1.0, help='ignore memory increases below this')
+    args = parser.parse_args()
+
+    if args.command == 'speedups' and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.command != 'compare':
+        results = run(args.sizes, args.cases, args.repeat) if args.command == 'run' else speedups(args.sizes, args.workers)
+        output = json.dumps(results, indent=2)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(output)
+        else:
+            print(output)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold, args.min_seconds, args.min_mb)
+        for result in current['results']:
+            print(
+                f"{result['size']:<10} {result['case']:<38} {result['seconds']:9.4f}s {result.get('seconds_change', 0):+7.1%}"
+                f" {result['peak_mb']:9.1f}MB {result.get('peak_mb_change', 0):+7.1%}"
+            )
+        for r in regressions:
+            print(f"REGRESSION {r['size']} {r['case']} {r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g} ({r['change']:+.1%})")
+        sys.exit(1 if regressions else 0)
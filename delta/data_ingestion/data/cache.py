@@ -0,0 +1,350 @@
+"""
+This file contains a local on-disk cache of the prices table, so that repeated research pulls are served
+from disk and only missing date ranges are read from the database.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from instrumentation import instrumented
+from data.constants import DATA_DATE, TICKER
+
+# A closed date interval [start, end].
+Interval = Tuple[datetime.date, datetime.date]
+
+_ONE_DAY = datetime.timedelta(days=1)
+_METADATA_FILE = "_metadata.json"
+
+
+class PriceCache:
+    """
+    Caches rows of the prices table as Arrow IPC files, partitioned by month (and optionally by ticker):
+
+    root/2023-01.arrow              (partition_by_ticker=False)
+    root/2023-01/AAPL.arrow         (partition_by_ticker=True)
+
+    Files are uncompressed and opened memory-mapped, so reading a few columns only pages in those columns.
+    `_metadata.json` records which date ranges are cached for which tickers ("coverage"), so a request
+    that is partly cached only fetches the missing ranges. A date range fetched for every ticker is
+    recorded as universe coverage. Whole partitions are evicted, least recently used first, once the
+    cache is larger than `max_bytes`.
+
+    Usage:
+    ```
+    client = DataClient(connection, cache=PriceCache("~/.cache/prices", max_bytes=20 * 2**30))
+    client.get_prices(["AAPL"], start_date, end_date, [CLOSE, VOLUME])
+    ```
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None, partition_by_ticker: bool = False):
+        assert max_bytes is None or max_bytes > 0
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        self.partition_by_ticker = partition_by_ticker
+        os.makedirs(self.root, exist_ok=True)
+        self._load_metadata()
+
+    @instrumented()
+    def get_prices(
+        self,
+        fetch: Callable[[Optional[List[str]], datetime.date, datetime.date], pd.DataFrame],
+        ids: Optional[List[str]],
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: List[str],
+        dtype=np.float64,
+    ) -> pd.DataFrame:
+        """Gets prices from the cache, first filling the ranges it does not cover yet with `fetch`.
+
+        Args:
+            fetch (Callable): gets every price column of `(ids, start_date, end_date)` from the database.
+            ids (Optional[List[str]]): tickers to get, or None for every ticker.
+            start_date (datetime.date): first date to get (inclusive).
+            end_date (datetime.date): last date to get (inclusive).
+            columns (List[str]): price columns to get.
+            dtype (optional): dtype of the price columns. Defaults to np.float64.
+
+        Returns:
+            pd.DataFrame: long format dataframe indexed by date, sorted by date and ticker.
+        """
+        assert start_date <= end_date
+        if ids is not None:
+            ids = list(dict.fromkeys(ids))
+            if len(ids) == 0:
+                return self._empty_frame(columns, dtype)
+
+        written = set()
+        for missing_ids, (start, end) in self._get_missing(ids, start_date, end_date):
+            written |= self._write(fetch(missing_ids, start, end))
+            self._add_coverage(missing_ids, start, end)
+        self._save_metadata()
+
+        prices = self._read(ids, start_date, end_date, columns, dtype)
+        if written:
+            # Evicting after the read, and never a partition of this request, so the result is complete.
+            self._evict(keep=written | set(self._overlapping(ids, start_date, end_date)))
+            self._save_metadata()
+        return prices
+
+    def invalidate(
+        self, start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None,
+        ids: Optional[List[str]] = None
+    ) -> None:
+        """Deletes cached data so that it is fetched again on the next request.
+
+        Every partition that overlaps [start_date, end_date] is deleted (open ended if None). With
+        `partition_by_ticker`, only the partitions of `ids` are deleted if it is given; otherwise whole
+        months are deleted for every ticker.
+        """
+        for key in list(self._partitions):
+            month, ticker = self._parse_partition_key(key)
+            first, last = self._month_range(month)
+            if start_date is not None and last < start_date:
+                continue
+            if end_date is not None and first > end_date:
+                continue
+            if ids is not None and ticker is not None and ticker not in ids:
+                continue
+            self._delete_partition(key)
+        self._save_metadata()
+
+    def clear(self) -> None:
+        """Deletes everything in the cache."""
+        self.invalidate()
+
+    @property
+    def size_bytes(self) -> int:
+        """Total size of the cached files."""
+        return sum(partition['bytes'] for partition in self._partitions.values())
+
+    ############################################
+    # Private Methods
+    ############################################
+
+    def _get_missing(
+        self, ids: Optional[List[str]], start_date: datetime.date, end_date: datetime.date
+    ) -> List[Tuple[Optional[List[str]], Interval]]:
+        """Gets the (tickers, date range) pairs that have to be fetched to cover a request. Tickers that
+        miss the same ranges are fetched together."""
+        requested = [(start_date, end_date)]
+        if ids is None:
+            return [(None, interval) for interval in _subtract(requested, self._universe)]
+
+        missing_by_ranges: Dict[Tuple[Interval, ...], List[str]] = {}
+        for ticker in ids:
+            covered = _union(self._coverage.get(ticker, []) + self._universe)
+            missing = tuple(_subtract(requested, covered))
+            if missing:
+                missing_by_ranges.setdefault(missing, []).append(ticker)
+        return [(tickers, interval) for missing, tickers in missing_by_ranges.items() for interval in missing]
+
+    def _add_coverage(self, ids: Optional[List[str]], start: datetime.date, end: datetime.date) -> None:
+        if ids is None:
+            self._universe = _union(self._universe + [(start, end)])
+            return
+        for ticker in ids:
+            self._coverage[ticker] = _union(self._coverage.get(ticker, []) + [(start, end)])
+
+    def _remove_coverage(self, ticker: Optional[str], start: datetime.date, end: datetime.date) -> None:
+        """Removes a date range from the coverage of one ticker, or every ticker if None. The universe
+        coverage always loses it, since the universe is no longer complete over that range."""
+        self._universe = _subtract(self._universe, [(start, end)])
+        tickers = list(self._coverage) if ticker is None else [ticker]
+        for t in tickers:
+            remaining = _subtract(self._coverage.get(t, []), [(start, end)])
+            if remaining:
+                self._coverage[t] = remaining
+            else:
+                self._coverage.pop(t, None)
+
+    def _write(self, prices: pd.DataFrame) -> set:
+        """Adds fetched prices to their partitions and returns the keys of the partitions written."""
+        prices = self._drop_cached_rows(prices)
+        if len(prices) == 0:
+            return set()
+
+        table = pa.Table.from_pandas(prices.reset_index(), preserve_index=False)
+        months = pd.DatetimeIndex(prices.index).strftime("%Y-%m").to_numpy()
+        group_keys = [months, prices[TICKER].to_numpy()] if self.partition_by_ticker else [months]
+        groups = pd.DataFrame(dict(enumerate(group_keys))).groupby(list(range(len(group_keys)))).indices
+
+        written = set()
+        for group, rows in groups.items():
+            key = os.path.join(*group) if isinstance(group, tuple) else group
+            part = table.take(pa.array(rows))
+            path = self._partition_path(key)
+            if os.path.exists(path):
+                part = pa.concat_tables([self._open(path).cast(part.schema), part])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, part.schema) as writer:
+                writer.write_table(part)
+            os.replace(tmp_path, path)
+            self._partitions[key] = {'bytes': os.path.getsize(path), 'last_access': time.time()}
+            written.add(key)
+        return written
+
+    def _drop_cached_rows(self, prices: pd.DataFrame) -> pd.DataFrame:
+        """Drops fetched rows that are already cached, e.g. tickers that were cached before a fetch of
+        every ticker over the same range."""
+        if len(prices) == 0 or not self._coverage:
+            return prices
+        intervals = pd.DataFrame(
+            [(ticker, start, end) for ticker, covered in self._coverage.items() for start, end in covered],
+            columns=[TICKER, 'start', 'end'],
+        )
+        rows = pd.DataFrame({TICKER: prices[TICKER].to_numpy(), 'date': pd.DatetimeIndex(prices.index).date,
+                             'row': np.arange(len(prices))})
+        matches = rows.merge(intervals, on=TICKER)
+        cached = matches['row'][(matches['date'] >= matches['start']) & (matches['date'] <= matches['end'])]
+        return prices.iloc[np.setdiff1d(np.arange(len(prices)), cached.to_numpy())]
+
+    def _read(
+        self, ids: Optional[List[str]], start_date: datetime.date, end_date: datetime.date, columns: List[str], dtype
+    ) -> pd.DataFrame:
+        """Reads the requested rows and columns from the memory-mapped partitions."""
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        now = time.time()
+        tables = []
+        for key in self._overlapping(ids, start_date, end_date):
+            ticker = self._parse_partition_key(key)[1]
+            # Column pushdown: only the selected columns of the mapped file are touched.
+            table = self._open(self._partition_path(key)).select([DATA_DATE, TICKER] + columns)
+            mask = pc.and_(pc.greater_equal(table[DATA_DATE], pa.scalar(start, table.schema.field(DATA_DATE).type)),
+                           pc.less_equal(table[DATA_DATE], pa.scalar(end, table.schema.field(DATA_DATE).type)))
+            if ids is not None and ticker is None:
+                mask = pc.and_(mask, pc.is_in(table[TICKER], value_set=pa.array(ids, type=table.schema.field(TICKER).type)))
+            tables.append(table.filter(mask))
+            self._partitions[key]['last_access'] = now
+        self._save_metadata()
+
+        if not tables:
+            return self._empty_frame(columns, dtype)
+        table = pa.concat_tables(tables).sort_by([(DATA_DATE, 'ascending'), (TICKER, 'ascending')])
+        prices = table.to_pandas().set_index(DATA_DATE)
+        return prices.astype({col: dtype for col in columns})
+
+    def _overlapping(self, ids: Optional[List[str]], start_date: datetime.date, end_date: datetime.date) -> List[str]:
+        """Gets the keys of the partitions that hold rows of a request."""
+        keys = []
+        for key in self._partitions:
+            month, ticker = self._parse_partition_key(key)
+            first, last = self._month_range(month)
+            if last < start_date or first > end_date or (ticker is not None and ids is not None and ticker not in ids):
+                continue
+            keys.append(key)
+        return keys
+
+    def _evict(self, keep: set) -> None:
+        """Deletes least recently used partitions, other than `keep`, until the cache fits in max_bytes."""
+        if self.max_bytes is None:
+            return
+        total = self.size_bytes
+        for key in sorted(self._partitions, key=lambda k: self._partitions[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            total -= self._partitions[key]['bytes']
+            self._delete_partition(key)
+
+    def _delete_partition(self, key: str) -> None:
+        month, ticker = self._parse_partition_key(key)
+        path = self._partition_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+        del self._partitions[key]
+        self._remove_coverage(ticker, *self._month_range(month))
+
+    def _partition_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.arrow")
+
+    def _parse_partition_key(self, key: str) -> Tuple[str, Optional[str]]:
+        """Splits a partition key into its month and ticker (None if not partitioned by ticker)."""
+        month, _, ticker = key.partition(os.sep)
+        return month, ticker or None
+
+    @staticmethod
+    def _month_range(month: str) -> Interval:
+        first = datetime.date.fromisoformat(f"{month}-01")
+        next_month = (first + datetime.timedelta(days=32)).replace(day=1)
+        return first, next_month - _ONE_DAY
+
+    @staticmethod
+    def _empty_frame(columns: List[str], dtype) -> pd.DataFrame:
+        return pd.DataFrame({TICKER: np.array([], dtype=object), **{col: np.array([], dtype=dtype) for col in columns}},
+                            index=pd.DatetimeIndex([], name=DATA_DATE))
+
+    @staticmethod
+    def _open(path: str) -> pa.Table:
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    def _load_metadata(self) -> None:
+        path = os.path.join(self.root, _METADATA_FILE)
+        metadata = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                metadata = json.load(f)
+        if metadata.get('partition_by_ticker', self.partition_by_ticker) != self.partition_by_ticker:
+            # The layout changed, so the cached files cannot be used.
+            shutil.rmtree(self.root)
+            os.makedirs(self.root)
+            metadata = {}
+
+        def parse(intervals):
+            return [(datetime.date.fromisoformat(s), datetime.date.fromisoformat(e)) for s, e in intervals]
+
+        self._coverage: Dict[str, List[Interval]] = {t: parse(c) for t, c in metadata.get('coverage', {}).items()}
+        self._universe: List[Interval] = parse(metadata.get('universe', []))
+        self._partitions: Dict[str, dict] = metadata.get('partitions', {})
+
+    def _save_metadata(self) -> None:
+        def dump(intervals):
+            return [(s.isoformat(), e.isoformat()) for s, e in intervals]
+
+        metadata = {
+            'partition_by_ticker': self.partition_by_ticker,
+            'coverage': {ticker: dump(covered) for ticker, covered in self._coverage.items()},
+            'universe': dump(self._universe),
+            'partitions': self._partitions,
+        }
+        path = os.path.join(self.root, _METADATA_FILE)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(metadata, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def _union(intervals: List[Interval]) -> List[Interval]:
+    """Merges overlapping and adjacent date intervals."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + _ONE_DAY:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(intervals: List[Interval], removed: List[Interval]) -> List[Interval]:
+    """Removes the dates of `removed` from `intervals`."""
+    result = []
+    for start, end in _union(intervals):
+        for r_start, r_end in _union(removed):
+            if r_end < start or r_start > end:
+                continue
+            if r_start > start:
+                result.append((start, r_start - _ONE_DAY))
+            start = r_end + _ONE_DAY
+            if start > end:
+                break
+        if start <= end:
+            result.append((start, end))
+    return result
@@ -1,5 +1,6 @@
 # General DB Constants
 DATA_DATE = "data_date"
+TICKER = "ticker"
 
 # prices table
 RAW_PRICES_TABLE = "public.prices"
@@ -3,22 +3,197 @@ This file contains functions to get data from our database tables.
 """
 
 import datetime
-from typing import List
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 
+from instrumentation import instrumented
+from data.constants import (
+    CLOSE, DATA_DATE, HIGH, LOW, OPEN, RAW_PRICES_TABLE, TICKER, TRANSACTIONS, VOLUME, VWAP
+)
+
+PRICE_COLUMNS = [OPEN, HIGH, LOW, CLOSE, VWAP, VOLUME, TRANSACTIONS]
+
+# Placeholder for one query parameter, by DB-API paramstyle.
+PLACEHOLDERS = {"format": "%s", "pyformat": "%s", "qmark": "?"}
+
+
 class DataClient:
+    """
+    Reads our database tables into long format dataframes (see FeatureTransform).
+
+    `connection` is any DB-API connection, e.g. `psycopg2.connect(...)` for the production database or
+    `sqlite3.connect(...)` for a local copy. `paramstyle` is the paramstyle of its driver ("format" for
+    psycopg2, "qmark" for sqlite3). With `server_side_cursors`, results are streamed with a named
+    (server-side) cursor, which psycopg2 supports, instead of being buffered by the driver.
+
+    With a `cache` (see data.cache.PriceCache), `get_prices` is served from local files and only the
+    date ranges missing from the cache are read from the database.
+    """
+
+    def __init__(self, connection, paramstyle: str = "format", server_side_cursors: bool = False, cache=None):
+        assert paramstyle in PLACEHOLDERS
+        self.connection = connection
+        self.paramstyle = paramstyle
+        self.server_side_cursors = server_side_cursors
+        self.cache = cache
+
+    @instrumented()
     def get_prices(
-        ids: List[str], start_date: datetime.date, end_date: datetime.date, columns: List[str]
+        self,
+        ids: Optional[List[str]],
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: List[str],
+        dtype=np.float64,
+        chunk_size: int = 100_000,
+        id_batch_size: int = 1_000,
     ) -> pd.DataFrame:
-        """_summary_
+        """Gets daily prices from the prices table.
+
+        Only the requested columns are selected, the ticker and date filters run in the database, and
+        rows are fetched `chunk_size` at a time straight into typed arrays.
 
         Args:
-            ids (List[str]): _description_
-            start_date (datetime.date): _description_
-            end_date (datetime.date): _description_
-            columns (List[str]): _description_
+            ids (Optional[List[str]]): tickers to get, or None for every ticker.
+            start_date (datetime.date): first date to get (inclusive).
+            end_date (datetime.date): last date to get (inclusive).
+            columns (List[str]): price columns to get, from `PRICE_COLUMNS`.
+            dtype (optional): dtype of the price columns, np.float64 or np.float32. Defaults to np.float64.
+            chunk_size (int, optional): number of rows fetched at a time. Defaults to 100_000.
+            id_batch_size (int, optional): maximum number of tickers per query. Defaults to 1_000.
 
         Returns:
-            pd.DataFrame: _description_
+            pd.DataFrame: long format dataframe indexed by date, with a ticker column and one column per
+            requested price column, sorted by date.
+        """
+        if self.cache is not None:
+            # Cached partitions hold every price column, so later requests for other columns are hits too.
+            def fetch(missing_ids, missing_start, missing_end):
+                return self._query_prices(
+                    missing_ids, missing_start, missing_end, PRICE_COLUMNS, np.float64, chunk_size, id_batch_size
+                )
+            return self.cache.get_prices(fetch, ids, start_date, end_date, columns, dtype)
+        return self._query_prices(ids, start_date, end_date, columns, dtype, chunk_size, id_batch_size)
+
+    def iter_prices(
+        self,
+        ids: Optional[List[str]],
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: List[str],
+        dtype=np.float64,
+        chunk_size: int = 100_000,
+        id_batch_size: int = 1_000,
+    ) -> Iterator[pd.DataFrame]:
+        """Gets daily prices from the prices table as a stream of dataframes of at most `chunk_size` rows,
+        for pulls that do not fit in memory. Takes the same arguments as `get_prices`, and always reads
+        from the database.
+
+        Chunks are sorted by date within each batch of `id_batch_size` tickers, so all the rows of a
+        ticker arrive in date order.
         """
-        pd.read_sql()
+        for chunk_dates, chunk_tickers, chunk_values, _ in self._iter_price_chunks(
+            ids, start_date, end_date, columns, dtype, chunk_size, id_batch_size
+        ):
+            yield self._to_frame(chunk_dates, chunk_tickers, chunk_values, columns)
+
+    ############################################
+    # Private Methods
+    ############################################
+
+    @instrumented()
+    def _query_prices(
+        self,
+        ids: Optional[List[str]],
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: List[str],
+        dtype,
+        chunk_size: int,
+        id_batch_size: int,
+    ) -> pd.DataFrame:
+        """Reads prices from the database into one dataframe (see `get_prices`)."""
+        capacity = chunk_size
+        dates = np.empty(capacity, dtype=object)
+        tickers = np.empty(capacity, dtype=object)
+        values = np.empty((len(columns), capacity), dtype=dtype)
+        n_rows = 0
+        n_batches = 0
+
+        for batch_dates, batch_tickers, batch_values, first_chunk in self._iter_price_chunks(
+            ids, start_date, end_date, columns, dtype, chunk_size, id_batch_size
+        ):
+            n_batches += first_chunk
+            n = len(batch_dates)
+            if n_rows + n > capacity:
+                # Grow geometrically so that appending a chunk is amortized O(chunk_size).
+                capacity = max(2 * capacity, n_rows + n)
+                dates = np.resize(dates, capacity)
+                tickers = np.resize(tickers, capacity)
+                values = np.concatenate([values, np.empty((len(columns), capacity - values.shape[1]), dtype=dtype)], axis=1)
+            dates[n_rows:n_rows + n] = batch_dates
+            tickers[n_rows:n_rows + n] = batch_tickers
+            values[:, n_rows:n_rows + n] = batch_values
+            n_rows += n
+
+        prices = self._to_frame(dates[:n_rows], tickers[:n_rows], values[:, :n_rows], columns)
+        if n_batches > 1:
+            # Every ticker batch is sorted by date on its own.
+            prices = prices.iloc[np.argsort(prices.index.to_numpy(), kind='stable')]
+        return prices
+
+    def _iter_price_chunks(
+        self,
+        ids: Optional[List[str]],
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: List[str],
+        dtype,
+        chunk_size: int,
+        id_batch_size: int,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, bool]]:
+        """Runs the price queries and yields (dates, tickers, values, first chunk of a query) per fetched chunk."""
+        assert len(columns) > 0
+        assert all(col in PRICE_COLUMNS for col in columns), f"columns must be in {PRICE_COLUMNS}"
+        assert start_date <= end_date
+        assert chunk_size > 0 and id_batch_size > 0
+        if ids is not None and len(ids) == 0:
+            return
+
+        placeholder = PLACEHOLDERS[self.paramstyle]
+        select = f"SELECT {DATA_DATE}, {TICKER}, {', '.join(columns)} FROM {RAW_PRICES_TABLE} " \
+                 f"WHERE {DATA_DATE} BETWEEN {placeholder} AND {placeholder}"
+        order_by = f" ORDER BY {DATA_DATE}, {TICKER}"
+
+        id_batches = [None] if ids is None else [ids[i:i + id_batch_size] for i in range(0, len(ids), id_batch_size)]
+        for id_batch in id_batches:
+            sql = select
+            params = [start_date, end_date]
+            if id_batch is not None:
+                sql += f" AND {TICKER} IN ({', '.join([placeholder] * len(id_batch))})"
+                params += list(id_batch)
+
+            cursor = self.connection.cursor(name="get_prices") if self.server_side_cursors else self.connection.cursor()
+            try:
+                cursor.execute(sql + order_by, params)
+                first_chunk = True
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    fields = list(zip(*rows))
+                    chunk_values = np.empty((len(columns), len(rows)), dtype=dtype)
+                    for i in range(len(columns)):
+                        # NULL prices become NaN
+                        chunk_values[i] = np.array(fields[i + 2], dtype=np.float64)
+                    yield np.array(fields[0], dtype=object), np.array(fields[1], dtype=object), chunk_values, first_chunk
+                    first_chunk = False
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def _to_frame(dates: np.ndarray, tickers: np.ndarray, values: np.ndarray, columns: List[str]) -> pd.DataFrame:
+        """Builds a long format dataframe from fetched columns."""
+        index = pd.DatetimeIndex(pd.to_datetime(dates), name=DATA_DATE)
+        return pd.DataFrame({TICKER: tickers, **{col: values[i] for i, col in enumerate(columns)}}, index=index)
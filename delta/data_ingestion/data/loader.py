@@ -0,0 +1,267 @@
+"""
+This file contains the bulk loader that writes vendor bars into the prices table.
+"""
+
+import glob
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from data.constants import DATA_DATE, RAW_PRICES_TABLE, TICKER
+from data.data import PLACEHOLDERS, PRICE_COLUMNS
+
+# A unit of work for the loader: a checkpoint key, and a function that gets its bars as a long format dataframe.
+Unit = Tuple[str, Callable[[], pd.DataFrame]]
+
+# Layout of the prices table for a local SQLite stand-in (see `connect_sqlite`).
+SQLITE_PRICES_SCHEMA = (
+    f"CREATE TABLE IF NOT EXISTS prices ({DATA_DATE} TEXT, {TICKER} TEXT, "
+    f"{', '.join(f'{col} REAL' for col in PRICE_COLUMNS)}, PRIMARY KEY ({TICKER}, {DATA_DATE}))",
+    f"CREATE INDEX IF NOT EXISTS prices_date ON prices ({DATA_DATE}, {TICKER})",
+)
+
+
+class PriceLoader:
+    """
+    Bulk loads long format bars (see FeatureTransform) into the prices table, replacing the rows of a
+    (ticker, data_date) that is already there. Only the price columns a unit has are written: the other
+    columns of an existing row keep their values (and are NULL in a new row).
+
+    Bars come in units (e.g. a group of tickers from Polygon, or a Parquet file), which are written by a pool
+    of `workers` threads, each with its own connection from `connect`, in transactions of at most `batch_size`
+    rows. With method="copy" (Postgres), a batch is COPYed as CSV into a temporary table and upserted from
+    there with one `INSERT ... SELECT ... ON CONFLICT (ticker, data_date) DO UPDATE`. With method="values"
+    (any driver, e.g. sqlite3), it is upserted with multi-row `INSERT ... VALUES` statements. Bars are fetched
+    on the calling thread while earlier units are written.
+
+    With a `checkpoint_path`, every unit that was fully written is recorded there, and skipped (without
+    fetching it) when a load is run again, so an interrupted backfill resumes where it stopped. Since writes
+    are upserts, rewriting the part of a unit that was written before an interruption is harmless.
+
+    Usage:
+    ```
+    loader = PriceLoader(lambda: psycopg2.connect(dsn), workers=8, checkpoint_path="backfill.json")
+    loader.load(polygon_units(PolygonClient(api_key), tickers, start_date, end_date))
+    ```
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], object],
+        paramstyle: str = "format",
+        method: str = "copy",
+        batch_size: int = 50_000,
+        workers: int = 4,
+        checkpoint_path: Optional[str] = None,
+        rows_per_statement: int = 1_000,
+        table: str = RAW_PRICES_TABLE,
+        verbose: bool = True,
+    ):
+        if paramstyle not in PLACEHOLDERS:
+            raise ValueError(f"paramstyle must be one of {sorted(PLACEHOLDERS)}, got {paramstyle!r}")
+        if method not in ("copy", "values"):
+            raise ValueError(f"method must be 'copy' or 'values', got {method!r}")
+        assert batch_size > 0 and workers > 0 and rows_per_statement > 0
+        self.connect = connect
+        self.paramstyle = paramstyle
+        self.method = method
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self.rows_per_statement = rows_per_statement
+        self.table = table
+        self.verbose = verbose
+        self._lock = threading.Lock()
+
+    def load(self, units: Iterable[Unit]) -> dict:
+        """Writes every unit that is not checkpointed yet.
+
+        Returns:
+            dict: the number of rows written and units written and skipped, the seconds taken, and rows per second.
+        """
+        done = self._load_checkpoint()
+        local = threading.local()
+        connections = []
+        stats = {'rows': 0, 'units': 0, 'skipped': 0}
+        start = time.perf_counter()
+
+        def write(key: str, frame: pd.DataFrame) -> int:
+            if not hasattr(local, 'connection'):
+                local.connection = self.connect()
+                with self._lock:
+                    connections.append(local.connection)
+            frame = _prepare(frame)
+            for i in range(0, len(frame), self.batch_size):
+                self._write_batch(local.connection, frame.iloc[i:i + self.batch_size])
+            with self._lock:
+                done.add(key)
+                self._save_checkpoint(done)
+                stats['rows'] += len(frame)
+                stats['units'] += 1
+                if self.verbose:
+                    elapsed = time.perf_counter() - start
+                    print(f"{key}: {len(frame):,} rows ({stats['rows']:,} in {elapsed:.1f}s, "
+                          f"{stats['rows'] / elapsed:,.0f} rows/s)")
+            return len(frame)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = set()
+                for key, fetch in units:
+                    if key in done:
+                        stats['skipped'] += 1
+                        continue
+                    # At most two units per writer are held in memory.
+                    while len(pending) >= 2 * self.workers:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            future.result()
+                    pending.add(executor.submit(write, key, fetch()))
+                for future in pending:
+                    future.result()
+        finally:
+            for connection in connections:
+                connection.close()
+
+        stats['seconds'] = time.perf_counter() - start
+        stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        return stats
+
+    ############################################
+    # Private Methods
+    ############################################
+
+    @instrumented(rows_in='frame')
+    def _write_batch(self, connection, frame: pd.DataFrame) -> None:
+        """Upserts one batch in one transaction."""
+        cursor = connection.cursor()
+        try:
+            if self.method == "copy":
+                self._copy(cursor, frame)
+            else:
+                self._insert_values(cursor, frame)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _upsert_clause(self, columns: List[str]) -> str:
+        """Gets the ON CONFLICT clause that overwrites the price columns among `columns`, and no others."""
+        updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in columns if col in PRICE_COLUMNS)
+        if not updates:
+            return f"ON CONFLICT ({TICKER}, {DATA_DATE}) DO NOTHING"
+        return f"ON CONFLICT ({TICKER}, {DATA_DATE}) DO UPDATE SET {updates}"
+
+    def _copy(self, cursor, frame: pd.DataFrame) -> None:
+        columns = ', '.join(frame.columns)
+        staging = "prices_load"
+        buffer = io.StringIO()
+        # Empty fields are NULL in CSV COPY. %.17g round trips every double, and writes whole numbers without a
+        # decimal point, so they also load into integer columns.
+        frame.to_csv(buffer, header=False, index=False, na_rep='', float_format='%.17g')
+        buffer.seek(0)
+
+        cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        copy_sql = f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)"
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            cursor.copy_expert(copy_sql, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+        # WHERE true: SQLite needs it to tell ON CONFLICT from a join constraint, Postgres ignores it.
+        cursor.execute(f"INSERT INTO {self.table} ({columns}) SELECT {columns} FROM {staging} WHERE true "
+                       f"{self._upsert_clause(list(frame.columns))}")
+
+    def _insert_values(self, cursor, frame: pd.DataFrame) -> None:
+        placeholder = PLACEHOLDERS[self.paramstyle]
+        columns = list(frame.columns)
+        row = f"({', '.join([placeholder] * len(columns))})"
+        values = np.empty((len(frame), len(columns)), dtype=object)
+        values[:, 0] = frame[DATA_DATE].to_numpy()
+        values[:, 1] = frame[TICKER].to_numpy()
+        for i, col in enumerate(columns[2:]):
+            prices = frame[col].to_numpy(dtype=np.float64)
+            # NaN is written as NULL
+            values[:, i + 2] = np.where(np.isnan(prices), None, prices.astype(object))
+
+        for i in range(0, len(values), self.rows_per_statement):
+            chunk = values[i:i + self.rows_per_statement]
+            cursor.execute(
+                f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES {', '.join([row] * len(chunk))} "
+                f"{self._upsert_clause(columns)}",
+                chunk.ravel().tolist(),
+            )
+
+    def _load_checkpoint(self) -> set:
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            return set(json.load(f)['done'])
+
+    def _save_checkpoint(self, done: set) -> None:
+        if self.checkpoint_path is None:
+            return
+        with open(f"{self.checkpoint_path}.tmp", 'w') as f:
+            json.dump({'done': sorted(done)}, f)
+        os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+
+
+def _prepare(frame: pd.DataFrame) -> pd.DataFrame:
+    """Gets the date, ticker and the price columns a long format dataframe has (indexed by date, or with a date
+    column), with ISO dates, and the last row of a (ticker, date) that appears more than once, since an upsert can
+    only touch a row once. Missing price columns are left out rather than filled, so they are not overwritten."""
+    if DATA_DATE not in frame.columns:
+        frame = frame.rename_axis(DATA_DATE).reset_index()
+    frame = frame.assign(**{DATA_DATE: pd.to_datetime(frame[DATA_DATE]).dt.strftime('%Y-%m-%d')})
+    columns = [DATA_DATE, TICKER] + [col for col in PRICE_COLUMNS if col in frame.columns]
+    return frame[columns].drop_duplicates([TICKER, DATA_DATE], keep='last')
+
+
+############################################
+# Sources
+############################################
+
+def polygon_units(
+    client, tickers: List[str], start_date, end_date, tickers_per_unit: int = 100, **aggregates_kwargs
+) -> Iterator[Unit]:
+    """Splits a backfill from Polygon (see data.polygon.polygon.PolygonClient) into units of `tickers_per_unit`
+    tickers, which are fetched concurrently by the client."""
+    for i in range(0, len(tickers), tickers_per_unit):
+        batch = list(tickers[i:i + tickers_per_unit])
+        digest = hashlib.sha1(','.join(batch).encode()).hexdigest()[:12]
+        key = f"polygon/{start_date}/{end_date}/{batch[0]}-{batch[-1]}/{len(batch)}-{digest}"
+        yield key, lambda batch=batch: client.get_aggregates(batch, start_date, end_date, **aggregates_kwargs)
+
+
+def parquet_units(patterns: List[str]) -> Iterator[Unit]:
+    """Gets a unit per Parquet file matching `patterns` (globs). A file is loaded again if it changed."""
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern, recursive=True)})
+    for path in paths:
+        stat = os.stat(path)
+        key = f"parquet/{os.path.abspath(path)}/{stat.st_size}-{int(stat.st_mtime)}"
+        yield key, lambda path=path: pd.read_parquet(path)
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """Opens a local SQLite stand-in of the prices table. The file is attached as the `public` schema, so that
+    `public.prices` resolves, and the table is created if it does not exist."""
+    connection = sqlite3.connect(":memory:", timeout=60, check_same_thread=False)
+    connection.execute("ATTACH DATABASE ? AS public", (path,))
+    for statement in SQLITE_PRICES_SCHEMA:
+        connection.execute(statement.replace("TABLE IF NOT EXISTS prices", "TABLE IF NOT EXISTS public.prices")
+                           .replace("INDEX IF NOT EXISTS prices_date", "INDEX IF NOT EXISTS public.prices_date"))
+    connection.commit()
+    return connection
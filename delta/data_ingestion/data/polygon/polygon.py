@@ -1 +1,348 @@
-"""Polygon API Client Wrapper"""
+"""Polygon API Client Wrapper
+
+Fetches aggregate bars (`/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{from}/{to}`) for many tickers
+concurrently, into long format dataframes with the column names of our prices table.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import http.client
+import json
+import os
+import random
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Mapping, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from data.constants import CLOSE, DATA_DATE, HIGH, LOW, OPEN, TICKER, TRANSACTIONS, VOLUME, VWAP
+
+# Fields of an aggregate bar, by the column they are stored in.
+AGGREGATE_FIELDS = {OPEN: 'o', HIGH: 'h', LOW: 'l', CLOSE: 'c', VWAP: 'vw', VOLUME: 'v', TRANSACTIONS: 'n'}
+
+# Polygon timestamps bars at the start of their window in New York time.
+MARKET_TIMEZONE = "America/New_York"
+
+# Responses that are worth retrying: rate limited, and server side errors.
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_MODES = ("live", "record", "replay")
+
+
+class PolygonError(Exception):
+    """A request that failed for good (a non-retryable status, or retries ran out)."""
+
+
+class PolygonClient:
+    """
+    Client for Polygon's aggregates (bars) endpoint.
+
+    Every (ticker, date range) is fetched concurrently over a pool of at most `max_connections` keep-alive
+    connections, each following its own `next_url` pages. All requests, including retries, take a token from
+    a bucket refilled at `requests_per_second` (holding at most `burst` tokens), so the client stays under the
+    plan's rate limit however many tickers are in flight. Rate limited (429), server side and connection
+    errors are retried with exponential backoff and full jitter, honoring `Retry-After`.
+
+    With `mode="record"`, every response is also saved under `fixtures_dir` (keyed by its URL without the API
+    key), and with `mode="replay"` responses are read from there without any network access, so code that
+    uses the client can be tested offline. `base_url` can point at a local stand-in of the API.
+
+    Usage:
+    ```
+    client = PolygonClient(api_key, requests_per_second=50, max_connections=20)
+    prices = client.get_aggregates(["AAPL", "MSFT"], datetime.date(2020, 1, 1), datetime.date(2023, 12, 31))
+    ```
+    In a running event loop (e.g. a notebook), `await client.fetch_aggregates(...)` instead.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = "https://api.polygon.io",
+        max_connections: int = 10,
+        requests_per_second: float = 100.0,
+        burst: Optional[int] = None,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 30.0,
+        mode: str = "live",
+        fixtures_dir: Optional[str] = None,
+    ):
+        assert max_connections > 0
+        assert requests_per_second > 0
+        assert max_retries >= 0
+        assert mode in _MODES
+        assert mode == "live" or fixtures_dir is not None, "record and replay modes need a fixtures_dir"
+        self.api_key = api_key if api_key is not None else os.environ.get("POLYGON_API_KEY")
+        assert self.api_key is not None or mode == "replay", "pass api_key or set POLYGON_API_KEY"
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.requests_per_second = requests_per_second
+        self.burst = burst if burst is not None else max_connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.mode = mode
+        self.fixtures_dir = fixtures_dir
+
+    def get_aggregates(
+        self,
+        tickers: List[str],
+        start_date: datetime.date,
+        end_date: datetime.date,
+        multiplier: int = 1,
+        timespan: str = "day",
+        adjusted: bool = True,
+        chunk_days: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Gets the aggregate bars of `tickers` (see `fetch_aggregates`)."""
+        return asyncio.run(
+            self.fetch_aggregates(tickers, start_date, end_date, multiplier, timespan, adjusted, chunk_days)
+        )
+
+    async def fetch_aggregates(
+        self,
+        tickers: List[str],
+        start_date: datetime.date,
+        end_date: datetime.date,
+        multiplier: int = 1,
+        timespan: str = "day",
+        adjusted: bool = True,
+        chunk_days: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Fetches the aggregate bars of `tickers` between two dates.
+
+        Args:
+            tickers (List[str]): tickers to get.
+            start_date (datetime.date): first date to get (inclusive).
+            end_date (datetime.date): last date to get (inclusive).
+            multiplier (int, optional): size of the bars in `timespan` units. Defaults to 1.
+            timespan (str, optional): "minute", "hour", "day", "week", ... Defaults to "day".
+            adjusted (bool, optional): get split adjusted bars. Defaults to True.
+            chunk_days (int, optional): split every ticker's date range into ranges of this many days, which
+                are fetched concurrently, for long histories of small bars. Defaults to one range.
+
+        Returns:
+            pd.DataFrame: long format dataframe indexed by the start of each bar (a date for daily bars) in New
+            York time, with a ticker column and one column per price column, sorted by date and ticker.
+        """
+        assert start_date <= end_date
+        assert multiplier > 0
+        assert chunk_days is None or chunk_days > 0
+
+        ranges = _split_range(start_date, end_date, chunk_days)
+        jobs = [(ticker, self._aggregates_url(ticker, multiplier, timespan, start, end, adjusted))
+                for ticker in dict.fromkeys(tickers) for start, end in ranges]
+
+        bucket = _TokenBucket(self.requests_per_second, self.burst)
+        with _ConnectionPool(self.max_connections, self.timeout) as pool:
+            tasks = [asyncio.ensure_future(self._fetch_pages(url, pool, bucket)) for _, url in jobs]
+            try:
+                pages = await asyncio.gather(*tasks)
+            except BaseException:
+                # One request failed for good, so the others are stopped rather than left running.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+        return _to_frame([ticker for ticker, _ in jobs], pages)
+
+    ############################################
+    # Private Methods
+    ############################################
+
+    def _aggregates_url(
+        self, ticker: str, multiplier: int, timespan: str, start: datetime.date, end: datetime.date, adjusted: bool
+    ) -> str:
+        path = f"/v2/aggs/ticker/{urllib.parse.quote(ticker)}/range/{multiplier}/{timespan}/{start}/{end}"
+        query = urllib.parse.urlencode({"adjusted": str(adjusted).lower(), "sort": "asc", "limit": 50000})
+        return f"{self.base_url}{path}?{query}"
+
+    async def _fetch_pages(self, url: str, pool: '_ConnectionPool', bucket: '_TokenBucket') -> List[dict]:
+        """Gets every page of one request, following `next_url` until there is none."""
+        pages = []
+        while url:
+            page = await self._get_json(url, pool, bucket)
+            pages.append(page)
+            url = page.get("next_url")
+        return pages
+
+    async def _get_json(self, url: str, pool: '_ConnectionPool', bucket: '_TokenBucket') -> dict:
+        """Gets one page, from the fixtures in replay mode, and otherwise from the API with retries."""
+        if self.mode == "replay":
+            return self._read_fixture(url)
+
+        # next_url links do not carry the API key.
+        signed_url = _with_query(url, apiKey=self.api_key)
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            retry_after = None
+            try:
+                status, headers, body = await pool.request(signed_url)
+            except (OSError, http.client.HTTPException) as e:
+                error = PolygonError(f"GET {url} failed: {e!r}")
+            else:
+                if status == 200:
+                    page = json.loads(body)
+                    if self.mode == "record":
+                        self._write_fixture(url, page)
+                    return page
+                error = PolygonError(f"GET {url} returned {status}: {body[:200]!r}")
+                if status not in _RETRY_STATUSES:
+                    raise error
+                retry_after = headers.get("Retry-After")
+
+            if attempt == self.max_retries:
+                raise error
+            await asyncio.sleep(self._get_backoff(attempt, retry_after))
+
+    def _get_backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        """Seconds to wait before a retry: `Retry-After` if the server sent one, otherwise a uniformly random
+        time up to an exponentially growing cap ("full jitter"), so that concurrent retries spread out."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _fixture_path(self, url: str) -> str:
+        key = hashlib.sha1(_with_query(url, apiKey=None).encode()).hexdigest()
+        return os.path.join(self.fixtures_dir, f"{key}.json")
+
+    def _read_fixture(self, url: str) -> dict:
+        path = self._fixture_path(url)
+        if not os.path.exists(path):
+            raise PolygonError(f"no recorded response for GET {url} in {self.fixtures_dir}")
+        with open(path) as f:
+            return json.load(f)["response"]
+
+    def _write_fixture(self, url: str, page: dict) -> None:
+        path = self._fixture_path(url)
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"url": _with_query(url, apiKey=None), "response": page}, f)
+        os.replace(f"{path}.tmp", path)
+
+
+class _TokenBucket:
+    """Allows `rate` acquisitions per second on average, and bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Waiters queue on the lock, so tokens are handed out in arrival order.
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP(S) connections, at most `size` of them in use at once. The blocking requests run on a
+    thread per connection, so `size` requests are in flight concurrently."""
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self.idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.slots = None
+
+    def __enter__(self) -> '_ConnectionPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.executor.shutdown(wait=True)
+        for connections in self.idle.values():
+            for connection in connections:
+                connection.close()
+        self.idle = {}
+
+    async def request(self, url: str) -> Tuple[int, Mapping[str, str], bytes]:
+        """GETs `url` and returns its (status, headers, body). Header names are case insensitive."""
+        if self.slots is None:
+            # Created here, so that it belongs to the running event loop.
+            self.slots = asyncio.Semaphore(self.size)
+        parts = urllib.parse.urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(("", "", parts.path, parts.query, ""))
+        async with self.slots:
+            idle = self.idle.setdefault(host, [])
+            connection = idle.pop() if idle else self._connect(*host)
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, _get, connection, path)
+            except BaseException:
+                # The connection may be half way through a response, so it is not reused.
+                connection.close()
+                raise
+            idle.append(connection)
+            return result
+
+    def _connect(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+
+def _get(connection: http.client.HTTPConnection, path: str) -> Tuple[int, Mapping[str, str], bytes]:
+    connection.request("GET", path, headers={"Accept-Encoding": "identity"})
+    response = connection.getresponse()
+    body = response.read()
+    if response.getheader("Connection", "").lower() == "close":
+        connection.close()
+    return response.status, response.headers, body
+
+
+def _with_query(url: str, **params) -> str:
+    """Sets (or with None, removes) query parameters of a URL."""
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    for key, value in params.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(sorted(query.items()))))
+
+
+def _split_range(
+    start_date: datetime.date, end_date: datetime.date, chunk_days: Optional[int]
+) -> List[Tuple[datetime.date, datetime.date]]:
+    if chunk_days is None:
+        return [(start_date, end_date)]
+    step = datetime.timedelta(days=chunk_days)
+    starts = [start_date + i * step for i in range((end_date - start_date) // step + 1)]
+    return [(start, min(start + step - datetime.timedelta(days=1), end_date)) for start in starts]
+
+
+def _to_frame(tickers: List[str], pages: List[List[dict]]) -> pd.DataFrame:
+    """Builds a long format dataframe from the result pages of every request."""
+    bars = [(ticker, bar) for ticker, ticker_pages in zip(tickers, pages) for page in ticker_pages
+            for bar in page.get("results") or []]
+    timestamps = np.array([bar["t"] for _, bar in bars], dtype=np.int64)
+    data = {TICKER: np.array([ticker for ticker, _ in bars], dtype=object)}
+    for column, field in AGGREGATE_FIELDS.items():
+        # vwap and transactions are missing from some bars
+        data[column] = np.array([bar.get(field, np.nan) for _, bar in bars], dtype=np.float64)
+
+    index = pd.to_datetime(timestamps, unit="ms", utc=True).tz_convert(MARKET_TIMEZONE).tz_localize(None)
+    prices = pd.DataFrame(data, index=pd.DatetimeIndex(index, name=DATA_DATE))
+    # Ranges of a ticker do not overlap, but a bar is kept once should the API repeat it across pages.
+    prices = prices[~pd.DataFrame({TICKER: prices[TICKER].to_numpy(), 't': timestamps}).duplicated().to_numpy()]
+    return prices.reset_index().sort_values([DATA_DATE, TICKER], kind='stable').set_index(DATA_DATE)
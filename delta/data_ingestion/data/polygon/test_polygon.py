@@ -0,0 +1,232 @@
+import datetime
+import glob
+import http.server
+import json
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from data.constants import CLOSE, DATA_DATE, OPEN, TICKER, TRANSACTIONS, VWAP
+from data.polygon.polygon import PolygonClient, PolygonError
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    """
+    Local stand-in of the aggregates endpoint. Every ticker has one daily bar per calendar day of the requested
+    range, served `page_size` bars per page with `next_url` links. `failures[ticker]` is a list of (status,
+    headers) responses sent, one per request, before the ticker's bars.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, page_size=3):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.page_size = page_size
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    @staticmethod
+    def bars(ticker, start, end):
+        bars = []
+        for day in pd.date_range(start, end):
+            # The same day has the same bar whichever range it is requested in.
+            i = day.dayofyear - 1
+            timestamp = int(day.tz_localize('America/New_York').tz_convert('UTC').value // 10**6)
+            price = 10.0 * (sum(map(ord, ticker)) % 7 + 1) + i
+            bar = {'t': timestamp, 'o': price, 'h': price + 1, 'l': price - 1, 'c': price + 0.5, 'v': 1000.0 + i}
+            # vwap and transactions are missing from some bars
+            if i % 4:
+                bar.update({'vw': price + 0.25, 'n': 10 + i})
+            bars.append(bar)
+        return bars
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        parts = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        # /v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{from}/{to}
+        _, _, _, _, ticker, _, _, _, start, end = parts.path.split('/')
+        ticker = urllib.parse.unquote(ticker)
+        with server.lock:
+            server.requests.append((time.monotonic(), ticker, query))
+            failures = server.failures.get(ticker)
+            failure = failures.pop(0) if failures else None
+
+        if failure is not None:
+            status, headers = failure
+            self.respond(status, {'status': 'ERROR', 'error': f'status {status}'}, headers)
+            return
+        if query.get('apiKey') != 'key':
+            self.respond(401, {'status': 'ERROR', 'error': 'unknown API key'})
+            return
+
+        bars = StandIn.bars(ticker, start, end)
+        cursor = int(query.get('cursor', 0))
+        page = {'ticker': ticker, 'status': 'OK', 'results': bars[cursor:cursor + server.page_size]}
+        if cursor + server.page_size < len(bars):
+            # Like Polygon's, the link does not carry the API key.
+            next_query = urllib.parse.urlencode({'cursor': cursor + server.page_size})
+            page['next_url'] = f'{server.url}{parts.path}?{next_query}'
+        self.respond(200, page)
+
+    def respond(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPolygonClient(unittest.TestCase):
+
+    """
+    PolygonClient against a local stand-in of the API. Run from data_ingestion:
+        python -m unittest data.polygon.test_polygon
+    """
+
+    START, END = datetime.date(2023, 1, 1), datetime.date(2023, 1, 10)
+
+    def setUp(self):
+        self.server = StandIn()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def client(self, **kwargs):
+        kwargs = {'api_key': 'key', 'base_url': self.server.url, 'backoff': 0.01, 'timeout': 5, **kwargs}
+        return PolygonClient(**kwargs)
+
+    def requests(self, ticker=None):
+        return [request for request in self.server.requests if ticker is None or request[1] == ticker]
+
+    def test_get_aggregates_pagination(self):
+        prices = self.client().get_aggregates(['AAPL', 'MSFT'], self.START, self.END)
+
+        # 10 bars each, 3 per page: 4 pages per ticker, the later ones from next_url, signed with the API key.
+        self.assertEqual(len(self.requests('AAPL')), 4)
+        self.assertEqual([query.get('cursor') for _, _, query in self.requests('AAPL')], [None, '3', '6', '9'])
+        self.assertTrue(all(query['apiKey'] == 'key' for _, _, query in self.requests()))
+
+        self.assertEqual(len(prices), 20)
+        self.assertEqual(prices.index.name, DATA_DATE)
+        self.assertEqual(list(prices.index.unique()), list(pd.date_range(self.START, self.END)))
+        self.assertEqual(list(prices[TICKER].iloc[:2]), ['AAPL', 'MSFT'])
+        bars = StandIn.bars('AAPL', self.START, self.END)
+        aapl = prices[prices[TICKER] == 'AAPL']
+        np.testing.assert_array_equal(aapl[OPEN], [bar['o'] for bar in bars])
+        np.testing.assert_array_equal(aapl[CLOSE], [bar['c'] for bar in bars])
+        # Missing vwap and transactions are NaN.
+        self.assertTrue(np.isnan(aapl[VWAP].iloc[0]) and np.isnan(aapl[TRANSACTIONS].iloc[4]))
+        self.assertEqual(aapl[TRANSACTIONS].iloc[1], 11)
+
+    def test_get_aggregates_chunks(self):
+        whole = self.client().get_aggregates(['AAPL'], self.START, self.END)
+        chunked = self.client().get_aggregates(['AAPL'], self.START, self.END, chunk_days=4)
+        pd.testing.assert_frame_equal(chunked, whole)
+
+    def test_get_aggregates_retries(self):
+        # Rate limited with Retry-After, then a server error without it: both retried.
+        self.server.failures['AAPL'] = [(429, {'Retry-After': '0.3'}), (503, {})]
+        start = time.monotonic()
+        prices = self.client().get_aggregates(['AAPL'], self.START, self.END)
+
+        self.assertEqual(len(prices), 10)
+        requests = self.requests('AAPL')
+        self.assertEqual(len(requests), 2 + 4)
+        # The retry after the 429 waited as long as the server asked.
+        self.assertGreaterEqual(requests[1][0] - requests[0][0], 0.3)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+
+        # Retries run out.
+        self.server.failures['MSFT'] = [(503, {})] * 3
+        with self.assertRaisesRegex(PolygonError, '503'):
+            self.client(max_retries=2).get_aggregates(['MSFT'], self.START, self.END)
+        self.assertEqual(len(self.requests('MSFT')), 3)
+
+    def test_get_aggregates_non_retryable(self):
+        self.server.failures['AAPL'] = [(403, {'Retry-After': '0'})]
+        with self.assertRaisesRegex(PolygonError, '403'):
+            self.client().get_aggregates(['AAPL', 'MSFT'], self.START, self.END)
+        self.assertEqual(len(self.requests('AAPL')), 1)
+
+        with self.assertRaisesRegex(PolygonError, '401'):
+            self.client(api_key='wrong').get_aggregates(['AAPL'], self.START, self.END)
+
+    def test_get_aggregates_rate_limit(self):
+        # 12 requests (4 tickers x 3 pages, with 4 bars per ticker) at 20 per second after a burst of 2.
+        rate, burst = 20.0, 2
+        self.server.page_size = 2
+        tickers = ['A', 'B', 'C', 'D']
+        self.client(requests_per_second=rate, burst=burst, max_connections=8).get_aggregates(
+            tickers, self.START, self.START + datetime.timedelta(days=4))
+
+        times = sorted(t for t, _, _ in self.requests())
+        self.assertEqual(len(times), 12)
+        # However the requests interleave, any k of them take at least (k - burst) / rate seconds.
+        for k in range(burst + 1, len(times) + 1):
+            for i in range(len(times) - k + 1):
+                self.assertGreaterEqual(times[i + k - 1] - times[i], (k - burst) / rate - 0.02)
+
+    def test_record_and_replay(self):
+        fixtures_dir = self.tmp_dir.name
+        recorded = self.client(mode='record', fixtures_dir=fixtures_dir).get_aggregates(
+            ['AAPL', 'MSFT'], self.START, self.END)
+        n_requests = len(self.requests())
+
+        # Replayed with no API key, and the stand-in stopped: no request reaches the network.
+        self.server.stop()
+        replayed = PolygonClient(api_key=None, base_url=self.server.url, mode='replay', fixtures_dir=fixtures_dir) \
+            .get_aggregates(['AAPL', 'MSFT'], self.START, self.END)
+        pd.testing.assert_frame_equal(replayed, recorded)
+        self.assertEqual(len(self.requests()), n_requests)
+
+        # The API key is not saved in the fixtures.
+        for path in glob.glob(f'{fixtures_dir}/*.json'):
+            with open(path) as f:
+                self.assertNotIn('apiKey', f.read())
+
+        # A request that was not recorded fails.
+        with self.assertRaisesRegex(PolygonError, 'no recorded response'):
+            PolygonClient(base_url=self.server.url, mode='replay', fixtures_dir=fixtures_dir).get_aggregates(
+                ['GOOG'], self.START, self.END)
+
+        # Restarted for tearDown.
+        self.server = StandIn()
+
+    def test_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            PolygonClient(api_key='key', mode='replay')
+        with self.assertRaises(AssertionError):
+            self.client().get_aggregates(['AAPL'], self.END, self.START)
+
+
+if __name__ == '__main__':
+    unittest.main()
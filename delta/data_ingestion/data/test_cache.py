@@ -0,0 +1,169 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from data.cache import PriceCache, _subtract, _union
+from data.constants import CLOSE, DATA_DATE, TICKER, VOLUME
+from data.data import PRICE_COLUMNS
+
+
+def date(text):
+    return datetime.date.fromisoformat(text)
+
+
+class FakePrices:
+    """Stands in for the prices table: every ticker has a row on every calendar day, and every fetch is recorded."""
+
+    TICKERS = ['AAA', 'BBB', 'CCC']
+
+    def __init__(self):
+        self.fetches = []
+
+    def __call__(self, ids, start_date, end_date):
+        self.fetches.append((None if ids is None else list(ids), start_date, end_date))
+        return self.prices(ids, start_date, end_date, PRICE_COLUMNS)
+
+    def prices(self, ids, start_date, end_date, columns):
+        tickers = self.TICKERS if ids is None else [ticker for ticker in self.TICKERS if ticker in ids]
+        dates = pd.date_range(start_date, end_date)
+        index = pd.DatetimeIndex(np.repeat(dates, len(tickers)), name=DATA_DATE)
+        ticker_column = np.tile(np.array(tickers, dtype=object), len(dates))
+        day = (index - pd.Timestamp('2023-01-01')).days.to_numpy()
+        ticker_number = np.array([self.TICKERS.index(ticker) for ticker in ticker_column])
+        values = {col: (day * 10 + ticker_number + PRICE_COLUMNS.index(col) / 10).astype(np.float64) for col in columns}
+        return pd.DataFrame({TICKER: ticker_column, **values}, index=index)
+
+
+class TestPriceCache(unittest.TestCase):
+
+    """
+    PriceCache over an in-memory stand-in of the prices table. Run from data_ingestion:
+        python -m unittest data.test_cache
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'cache')
+        self.fetch = FakePrices()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assert_prices(self, prices, ids, start_date, end_date, columns):
+        expected = self.fetch.prices(ids, start_date, end_date, columns)
+        expected = expected.reset_index().sort_values([DATA_DATE, TICKER], ignore_index=True)
+        pd.testing.assert_frame_equal(prices.reset_index(), expected, check_dtype=False)
+
+    def test_get_prices_valid_input(self):
+        cache = PriceCache(self.root)
+        first = cache.get_prices(self.fetch, ['AAA', 'BBB'], date('2023-01-10'), date('2023-02-05'), [CLOSE])
+        second = cache.get_prices(self.fetch, ['BBB'], date('2023-01-15'), date('2023-01-20'), [CLOSE, VOLUME])
+
+        self.assert_prices(first, ['AAA', 'BBB'], date('2023-01-10'), date('2023-02-05'), [CLOSE])
+        self.assert_prices(second, ['BBB'], date('2023-01-15'), date('2023-01-20'), [CLOSE, VOLUME])
+        # The second request is covered by the first, for another column too.
+        self.assertEqual(len(self.fetch.fetches), 1)
+
+        # Coverage outlives the process.
+        reopened = PriceCache(self.root)
+        self.assert_prices(reopened.get_prices(self.fetch, ['AAA'], date('2023-01-10'), date('2023-02-05'), [CLOSE]),
+                           ['AAA'], date('2023-01-10'), date('2023-02-05'), [CLOSE])
+        self.assertEqual(len(self.fetch.fetches), 1)
+
+    def test_get_prices_partial_coverage(self):
+        cache = PriceCache(self.root)
+        cache.get_prices(self.fetch, ['AAA'], date('2023-01-10'), date('2023-01-20'), [CLOSE])
+        prices = cache.get_prices(self.fetch, ['AAA', 'BBB'], date('2023-01-05'), date('2023-01-25'), [CLOSE])
+
+        self.assert_prices(prices, ['AAA', 'BBB'], date('2023-01-05'), date('2023-01-25'), [CLOSE])
+        # AAA only misses the ends of the range; BBB misses all of it.
+        self.assertCountEqual(self.fetch.fetches[1:], [
+            (['AAA'], date('2023-01-05'), date('2023-01-09')),
+            (['AAA'], date('2023-01-21'), date('2023-01-25')),
+            (['BBB'], date('2023-01-05'), date('2023-01-25')),
+        ])
+
+        # A fetch of every ticker over a range is universe coverage, which covers any ticker.
+        cache.get_prices(self.fetch, None, date('2023-01-01'), date('2023-01-31'), [CLOSE])
+        self.assertEqual(self.fetch.fetches[-1], (None, date('2023-01-01'), date('2023-01-31')))
+        n_fetches = len(self.fetch.fetches)
+        prices = cache.get_prices(self.fetch, ['CCC', 'AAA'], date('2023-01-02'), date('2023-01-30'), [CLOSE])
+        self.assert_prices(prices, ['AAA', 'CCC'], date('2023-01-02'), date('2023-01-30'), [CLOSE])
+        self.assertEqual(len(self.fetch.fetches), n_fetches)
+
+    def test_get_prices_coverage_merging(self):
+        cache = PriceCache(self.root)
+        cache.get_prices(self.fetch, ['AAA'], date('2023-01-01'), date('2023-01-10'), [CLOSE])
+        cache.get_prices(self.fetch, ['AAA'], date('2023-01-11'), date('2023-01-20'), [CLOSE])
+        cache.get_prices(self.fetch, ['AAA'], date('2023-01-25'), date('2023-01-31'), [CLOSE])
+
+        # Adjacent ranges merge into one interval; the gap stays.
+        self.assertEqual(cache._coverage['AAA'], [(date('2023-01-01'), date('2023-01-20')),
+                                                  (date('2023-01-25'), date('2023-01-31'))])
+        cache.get_prices(self.fetch, ['AAA'], date('2023-01-05'), date('2023-01-28'), [CLOSE])
+        self.assertEqual(self.fetch.fetches[-1], (['AAA'], date('2023-01-21'), date('2023-01-24')))
+        self.assertEqual(cache._coverage['AAA'], [(date('2023-01-01'), date('2023-01-31'))])
+
+    def test_get_prices_eviction(self):
+        january = (date('2023-01-01'), date('2023-01-31'))
+        january_february = (date('2023-01-01'), date('2023-02-28'))
+        cache = PriceCache(self.root, max_bytes=6000)
+        cache.get_prices(self.fetch, None, *january, [CLOSE])
+
+        # Both months are larger than max_bytes, but a request never evicts its own partitions.
+        prices = cache.get_prices(self.fetch, None, *january_february, [CLOSE])
+        self.assert_prices(prices, None, *january_february, [CLOSE])
+        self.assertEqual(sorted(cache._partitions), ['2023-01', '2023-02'])
+
+        # The least recently used months go first, and lose their coverage.
+        prices = cache.get_prices(self.fetch, None, date('2023-03-01'), date('2023-03-31'), [CLOSE])
+        self.assert_prices(prices, None, date('2023-03-01'), date('2023-03-31'), [CLOSE])
+        self.assertEqual(sorted(cache._partitions), ['2023-03'])
+        self.assertEqual(sorted(os.listdir(self.root)), ['2023-03.arrow', '_metadata.json'])
+        self.assertEqual(cache._universe, [(date('2023-03-01'), date('2023-03-31'))])
+
+        # So an evicted month is fetched again.
+        n_fetches = len(self.fetch.fetches)
+        prices = cache.get_prices(self.fetch, ['AAA'], *january, [CLOSE])
+        self.assert_prices(prices, ['AAA'], *january, [CLOSE])
+        self.assertEqual(self.fetch.fetches[n_fetches:], [(['AAA'], *january)])
+
+    def test_get_prices_edge_cases(self):
+        cache = PriceCache(self.root, partition_by_ticker=True)
+        self.assertEqual(len(cache.get_prices(self.fetch, [], date('2023-01-01'), date('2023-01-31'), [CLOSE])), 0)
+        self.assertEqual(self.fetch.fetches, [])
+
+        prices = cache.get_prices(self.fetch, ['AAA', 'AAA'], date('2023-01-31'), date('2023-01-31'), [CLOSE],
+                                  dtype=np.float32)
+        self.assertEqual(len(prices), 1)
+        self.assertEqual(prices[CLOSE].dtype, np.float32)
+        self.assertTrue(os.path.exists(os.path.join(self.root, '2023-01', 'AAA.arrow')))
+
+        cache.invalidate(date('2023-01-01'), date('2023-01-31'), ids=['AAA'])
+        self.assertEqual(cache._coverage, {})
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_get_prices_invalid_input(self):
+        cache = PriceCache(self.root)
+        with self.assertRaises(AssertionError):
+            cache.get_prices(self.fetch, ['AAA'], date('2023-01-31'), date('2023-01-01'), [CLOSE])
+        with self.assertRaises(AssertionError):
+            PriceCache(self.root, max_bytes=0)
+
+    def test_intervals(self):
+        self.assertEqual(_union([(date('2023-01-05'), date('2023-01-10')), (date('2023-01-01'), date('2023-01-04')),
+                                 (date('2023-01-08'), date('2023-01-12')), (date('2023-01-20'), date('2023-01-21'))]),
+                         [(date('2023-01-01'), date('2023-01-12')), (date('2023-01-20'), date('2023-01-21'))])
+        self.assertEqual(_subtract([(date('2023-01-01'), date('2023-01-31'))],
+                                   [(date('2023-01-10'), date('2023-01-12')), (date('2023-01-31'), date('2023-02-05'))]),
+                         [(date('2023-01-01'), date('2023-01-09')), (date('2023-01-13'), date('2023-01-30'))])
+        self.assertEqual(_subtract([(date('2023-01-01'), date('2023-01-31'))], [(date('2022-12-01'), date('2023-02-01'))]), [])
+        self.assertEqual(_subtract([], [(date('2023-01-01'), date('2023-01-31'))]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
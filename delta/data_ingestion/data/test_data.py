@@ -0,0 +1,118 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from data.constants import CLOSE, DATA_DATE, OPEN, TICKER, VOLUME
+from data.data import PRICE_COLUMNS, DataClient
+from data.loader import connect_sqlite
+
+
+class TestDataClient(unittest.TestCase):
+
+    """
+    DataClient.get_prices against a local SQLite copy of the prices table. Run from data_ingestion:
+        python -m unittest data.test_data
+    """
+
+    TICKERS = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']
+    DATES = pd.bdate_range('2023-01-02', periods=20)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.connection = connect_sqlite(os.path.join(self.tmp_dir.name, 'prices.db'))
+        rows = []
+        for i, ticker in enumerate(self.TICKERS):
+            for j, date in enumerate(self.DATES):
+                values = [100.0 * (i + 1) + j + k / 10 for k in range(len(PRICE_COLUMNS))]
+                rows.append((date.strftime('%Y-%m-%d'), ticker, *values))
+        # A NULL close and volume, which come back as NaN.
+        null_row = list(rows[3])
+        null_row[2 + PRICE_COLUMNS.index(CLOSE)] = null_row[2 + PRICE_COLUMNS.index(VOLUME)] = None
+        rows[3] = tuple(null_row)
+        self.connection.executemany(
+            f"INSERT INTO public.prices ({DATA_DATE}, {TICKER}, {', '.join(PRICE_COLUMNS)}) "
+            f"VALUES ({', '.join(['?'] * (len(PRICE_COLUMNS) + 2))})",
+            rows,
+        )
+        self.connection.commit()
+        self.expected = pd.DataFrame(rows, columns=[DATA_DATE, TICKER] + PRICE_COLUMNS)
+        self.expected[DATA_DATE] = pd.to_datetime(self.expected[DATA_DATE])
+        self.client = DataClient(self.connection, paramstyle="qmark")
+
+    def tearDown(self):
+        self.connection.close()
+        self.tmp_dir.cleanup()
+
+    def expected_prices(self, ids, start_date, end_date, columns):
+        expected = self.expected[
+            self.expected[TICKER].isin(ids) & self.expected[DATA_DATE].between(pd.Timestamp(start_date), pd.Timestamp(end_date))
+        ]
+        return expected.sort_values([DATA_DATE, TICKER]).set_index(DATA_DATE)[[TICKER] + columns]
+
+    def test_get_prices_valid_input(self):
+        columns = [OPEN, CLOSE]
+        prices = self.client.get_prices(['AAA', 'CCC'], datetime.date(2023, 1, 3), datetime.date(2023, 1, 20), columns)
+
+        self.assertEqual(list(prices.columns), [TICKER] + columns)
+        self.assertEqual(prices.index.name, DATA_DATE)
+        pd.testing.assert_frame_equal(
+            prices, self.expected_prices(['AAA', 'CCC'], '2023-01-03', '2023-01-20', columns),
+            check_freq=False, check_index_type=False
+        )
+
+    def test_get_prices_id_batches(self):
+        # 5 tickers in batches of 2 run 3 queries, each sorted by date on its own.
+        ids = ['EEE', 'AAA', 'DDD', 'BBB', 'CCC']
+        columns = [CLOSE, VOLUME]
+        batched = self.client.get_prices(ids, self.DATES[0].date(), self.DATES[-1].date(), columns,
+                                         chunk_size=7, id_batch_size=2)
+        whole = self.client.get_prices(ids, self.DATES[0].date(), self.DATES[-1].date(), columns)
+
+        self.assertEqual(len(batched), len(self.TICKERS) * len(self.DATES))
+        self.assertTrue(batched.index.is_monotonic_increasing)
+        # Within a date, rows keep the order of the batches they came from.
+        for _, group in batched.groupby(level=0):
+            self.assertEqual(list(group[TICKER]), ['AAA', 'EEE', 'BBB', 'DDD', 'CCC'])
+        pd.testing.assert_frame_equal(
+            batched.reset_index().sort_values([DATA_DATE, TICKER], ignore_index=True),
+            whole.reset_index().sort_values([DATA_DATE, TICKER], ignore_index=True),
+        )
+        pd.testing.assert_frame_equal(
+            batched.reset_index().sort_values([DATA_DATE, TICKER]).set_index(DATA_DATE),
+            self.expected_prices(ids, self.DATES[0], self.DATES[-1], columns),
+            check_freq=False, check_index_type=False
+        )
+
+    def test_get_prices_null_to_nan(self):
+        prices = self.client.get_prices(['AAA'], self.DATES[3].date(), self.DATES[3].date(), [OPEN, CLOSE, VOLUME])
+
+        self.assertEqual(len(prices), 1)
+        self.assertFalse(np.isnan(prices[OPEN].iloc[0]))
+        self.assertTrue(np.isnan(prices[CLOSE].iloc[0]))
+        self.assertTrue(np.isnan(prices[VOLUME].iloc[0]))
+
+    def test_get_prices_edge_cases(self):
+        # No tickers, and a range without rows.
+        self.assertEqual(len(self.client.get_prices([], self.DATES[0].date(), self.DATES[-1].date(), [CLOSE])), 0)
+        empty = self.client.get_prices(['AAA'], datetime.date(2020, 1, 1), datetime.date(2020, 1, 31), [CLOSE])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(list(empty.columns), [TICKER, CLOSE])
+
+        # Every ticker, in float32.
+        prices = self.client.get_prices(None, self.DATES[0].date(), self.DATES[-1].date(), [CLOSE], dtype=np.float32)
+        self.assertEqual(len(prices), len(self.TICKERS) * len(self.DATES))
+        self.assertEqual(prices[CLOSE].dtype, np.float32)
+
+    def test_get_prices_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            self.client.get_prices(['AAA'], self.DATES[0].date(), self.DATES[-1].date(), ['not_a_column'])
+        with self.assertRaises(AssertionError):
+            self.client.get_prices(['AAA'], self.DATES[-1].date(), self.DATES[0].date(), [CLOSE])
+
+
+if __name__ == '__main__':
+    unittest.main()
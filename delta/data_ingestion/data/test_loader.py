@@ -0,0 +1,310 @@
+import contextlib
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from data.constants import CLOSE, DATA_DATE, OPEN, TICKER, VOLUME
+from data.data import PRICE_COLUMNS
+from data.loader import PriceLoader, connect_sqlite, parquet_units
+
+
+class CopyConnection:
+    """
+    Stands in for a psycopg2 connection on top of connect_sqlite: COPY ... FROM STDIN goes through copy_expert,
+    and the temporary table created LIKE the prices table is dropped on commit or rollback.
+    """
+
+    def __init__(self, path):
+        self.connection = connect_sqlite(path)
+        self.staging = []
+        self.copies = 0
+
+    def cursor(self):
+        return CopyCursor(self)
+
+    def commit(self):
+        self._drop()
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+        self._drop()
+
+    def close(self):
+        self.connection.close()
+
+    def _drop(self):
+        for table in self.staging:
+            self.connection.execute(f"DROP TABLE IF EXISTS temp.{table}")
+        self.staging = []
+
+
+class CopyCursor:
+    LIKE = re.compile(r"CREATE TEMP TABLE (\w+) \(LIKE ([\w.]+) INCLUDING DEFAULTS\) ON COMMIT DROP")
+    COPY = re.compile(r"COPY (\w+) \(([^)]*)\) FROM STDIN WITH \(FORMAT csv\)")
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.cursor = owner.connection.cursor()
+
+    def execute(self, sql, params=()):
+        like = self.LIKE.fullmatch(sql)
+        if like is None:
+            return self.cursor.execute(sql, params)
+        self.cursor.execute(f"CREATE TEMP TABLE {like[1]} AS SELECT * FROM {like[2]} WHERE 0")
+        self.owner.staging.append(like[1])
+
+    def copy_expert(self, sql, buffer):
+        copy = self.COPY.fullmatch(sql)
+        columns = copy[2].split(', ')
+        # Empty fields are NULL, as in Postgres' CSV format.
+        rows = [[None if value == '' else value for value in row] for row in csv.reader(buffer)]
+        self.cursor.executemany(f"INSERT INTO {copy[1]} ({copy[2]}) VALUES ({', '.join(['?'] * len(columns))})", rows)
+        self.owner.copies += 1
+
+    def close(self):
+        self.cursor.close()
+
+
+def bars(tickers, dates, offset=0.0, columns=PRICE_COLUMNS):
+    """Long format bars indexed by date, with a value per (ticker, date, column) that `offset` shifts."""
+    dates = pd.DatetimeIndex(dates)
+    index = pd.DatetimeIndex(np.tile(dates, len(tickers)), name=DATA_DATE)
+    day = (index - pd.Timestamp('2023-01-01')).days.to_numpy()
+    ticker = np.repeat(tickers, len(dates))
+    number = np.array([sum(map(ord, name)) % 97 for name in ticker])
+    values = {col: 100.0 * number + day + PRICE_COLUMNS.index(col) / 10 + offset for col in columns}
+    return pd.DataFrame({TICKER: ticker, **values}, index=index)
+
+
+class TestPriceLoader(unittest.TestCase):
+
+    """
+    PriceLoader against a local SQLite copy of the prices table. Run from data_ingestion:
+        python -m unittest data.test_loader
+    """
+
+    TICKERS = ['AAA', 'BBB', 'CCC']
+    DATES = pd.bdate_range('2023-01-02', periods=10)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'prices.db')
+        self.checkpoint_path = os.path.join(self.tmp_dir.name, 'checkpoint.json')
+        self.statements = []
+        self.connections = []
+        self.fetches = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def connect(self, method='values'):
+        """Opens a connection for the loader, recording its statements."""
+        connection = CopyConnection(self.path) if method == 'copy' else connect_sqlite(self.path)
+        sqlite_connection = connection.connection if method == 'copy' else connection
+        sqlite_connection.set_trace_callback(self.statements.append)
+        self.connections.append(connection)
+        return connection
+
+    def loader(self, method='values', **kwargs):
+        kwargs = {'batch_size': 4, 'workers': 1, 'rows_per_statement': 3, 'verbose': False, **kwargs}
+        return PriceLoader(lambda: self.connect(method), paramstyle='qmark', method=method, **kwargs)
+
+    def units(self, frames):
+        """Units keyed by name, recording which are fetched."""
+        def fetch(key, frame):
+            self.fetches.append(key)
+            return frame
+        return [(key, lambda key=key, frame=frame: fetch(key, frame)) for key, frame in frames.items()]
+
+    def ticker_units(self, offset=0.0, columns=PRICE_COLUMNS):
+        return self.units({ticker: bars([ticker], self.DATES, offset, columns) for ticker in self.TICKERS})
+
+    def stored(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            frame = pd.read_sql(f"SELECT * FROM prices ORDER BY {TICKER}, {DATA_DATE}", connection)
+        finally:
+            connection.close()
+        return frame.set_index(pd.DatetimeIndex(pd.to_datetime(frame.pop(DATA_DATE)), name=DATA_DATE))
+
+    def expected(self, frame):
+        frame = frame.reindex(columns=[TICKER] + PRICE_COLUMNS)
+        return frame.sort_values(TICKER, kind='stable').astype({col: np.float64 for col in PRICE_COLUMNS})
+
+    def assert_stored(self, expected):
+        pd.testing.assert_frame_equal(self.stored(), self.expected(expected))
+
+    ############################################
+    # Tests for the batched upserts
+    ############################################
+
+    def test_load_values(self):
+        stats = self.loader().load(self.ticker_units())
+        self.assert_stored(bars(self.TICKERS, self.DATES))
+        self.assertEqual((stats['rows'], stats['units'], stats['skipped']), (30, 3, 0))
+
+        # 10 rows per unit in batches of 4 (4, 4, 2), each upserted 3 rows per statement: 2 + 2 + 1 statements.
+        inserts = [sql for sql in self.statements if sql.startswith('INSERT')]
+        self.assertEqual(len(inserts), 3 * 5)
+        self.assertEqual(sorted(sql.count('), (') + 1 for sql in inserts), sorted([3, 1, 3, 1, 2] * 3))
+        self.assertTrue(all('ON CONFLICT (ticker, data_date) DO UPDATE' in sql for sql in inserts))
+        self.assertEqual(len([sql for sql in self.statements if sql == 'COMMIT']), 3 * 3)
+
+    def test_load_copy(self):
+        stats = self.loader('copy').load(self.ticker_units())
+        self.assert_stored(bars(self.TICKERS, self.DATES))
+        self.assertEqual(stats['rows'], 30)
+        # A COPY and an upsert from the staging table per batch.
+        self.assertEqual(sum(connection.copies for connection in self.connections), 3 * 3)
+        inserts = [sql for sql in self.statements if sql.startswith('INSERT INTO public.prices')]
+        self.assertEqual(len(inserts), 3 * 3)
+        self.assertTrue(all('SELECT' in sql and 'ON CONFLICT' in sql for sql in inserts))
+
+    def test_on_conflict(self):
+        for method in ['values', 'copy']:
+            with self.subTest(method=method):
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self.loader(method).load(self.ticker_units())
+
+                # Rows already there are replaced; a (ticker, date) twice in a unit is written once, the last one.
+                update = bars(['BBB'], self.DATES[:4], offset=0.5)
+                update = pd.concat([bars(['BBB'], self.DATES[:2], offset=9.0), update])
+                self.loader(method).load(self.units({'update': update}))
+                expected = bars(self.TICKERS, self.DATES)
+                expected.loc[(expected[TICKER] == 'BBB') & expected.index.isin(self.DATES[:4]), PRICE_COLUMNS] += 0.5
+                self.assert_stored(expected)
+
+                # A unit with only some of the price columns leaves the others as they are; NaN is written as NULL.
+                partial = bars(['CCC'], self.DATES[:3], offset=1.0, columns=[CLOSE, VOLUME])
+                partial[VOLUME] = [np.nan, 7.0, 8.0]
+                # New rows get NULL in the columns they do not have.
+                partial = pd.concat([partial, bars(['DDD'], self.DATES[:1], columns=[CLOSE, VOLUME])])
+                self.loader(method).load(self.units({'partial': partial}))
+                ccc = (expected[TICKER] == 'CCC') & expected.index.isin(self.DATES[:3])
+                expected.loc[ccc, CLOSE] += 1.0
+                expected.loc[ccc, VOLUME] = [np.nan, 7.0, 8.0]
+                stored = self.stored()
+                self.assertEqual(stored.loc[stored[TICKER] == 'CCC', OPEN].iloc[0], expected.loc[ccc, OPEN].iloc[0])
+                expected = pd.concat([expected, bars(['DDD'], self.DATES[:1], columns=[CLOSE, VOLUME])])
+                self.assert_stored(expected)
+
+                # A unit without any price column only adds rows that are not there.
+                self.loader(method).load(self.units({'keys': bars(['AAA', 'EEE'], self.DATES[:1], columns=[])}))
+                expected = pd.concat([expected, bars(['EEE'], self.DATES[:1], columns=[])])
+                self.assert_stored(expected)
+
+    ############################################
+    # Tests for checkpoints
+    ############################################
+
+    def test_checkpoint_resume(self):
+        write_batch = PriceLoader._write_batch
+        calls = []
+
+        def failing_write_batch(loader, connection, frame):
+            calls.append(frame[TICKER].iloc[0])
+            # The second batch of BBB fails, after its first batch was written.
+            if calls.count('BBB') == 2:
+                raise RuntimeError("connection lost")
+            return write_batch(loader, connection, frame)
+
+        with mock.patch.object(PriceLoader, '_write_batch', autospec=True, side_effect=failing_write_batch):
+            with self.assertRaisesRegex(RuntimeError, "connection lost"):
+                self.loader(checkpoint_path=self.checkpoint_path).load(self.ticker_units())
+        with open(self.checkpoint_path) as f:
+            done = set(json.load(f)['done'])
+        self.assertIn('AAA', done)
+        self.assertNotIn('BBB', done)
+        stored = self.stored()
+        self.assertEqual(len(stored[stored[TICKER] == 'BBB']), 4)
+
+        # Run again: the units that were written are skipped without being fetched, the others are (re)written.
+        self.fetches.clear()
+        stats = self.loader(checkpoint_path=self.checkpoint_path).load(self.ticker_units())
+        self.assertEqual(sorted(self.fetches), sorted(set(self.TICKERS) - done))
+        self.assertEqual((stats['units'], stats['skipped']), (3 - len(done), len(done)))
+        self.assert_stored(bars(self.TICKERS, self.DATES))
+
+        # And once everything is loaded, nothing is fetched.
+        self.fetches.clear()
+        stats = self.loader(checkpoint_path=self.checkpoint_path).load(self.ticker_units())
+        self.assertEqual((self.fetches, stats['rows'], stats['skipped']), ([], 0, 3))
+
+    def test_parquet_units(self):
+        folder = os.path.join(self.tmp_dir.name, 'bars')
+        os.makedirs(folder)
+        for ticker in self.TICKERS:
+            bars([ticker], self.DATES).to_parquet(os.path.join(folder, f'{ticker}.parquet'))
+        units = list(parquet_units([os.path.join(folder, '*.parquet')]))
+        self.assertEqual(len(units), 3)
+        self.loader(checkpoint_path=self.checkpoint_path).load(units)
+        self.assert_stored(bars(self.TICKERS, self.DATES))
+
+        # A file that changed is loaded again.
+        changed = os.path.join(folder, 'BBB.parquet')
+        bars(['BBB'], self.DATES, offset=0.5).to_parquet(changed)
+        os.utime(changed, (time.time() + 10, time.time() + 10))
+        stats = self.loader(checkpoint_path=self.checkpoint_path).load(parquet_units([os.path.join(folder, '*')]))
+        self.assertEqual((stats['units'], stats['skipped']), (1, 2))
+
+    ############################################
+    # Tests for the writer pool
+    ############################################
+
+    def test_parallel_writers(self):
+        write_batch = PriceLoader._write_batch
+        threads = {}
+
+        def slow_write_batch(loader, connection, frame):
+            threads.setdefault(id(connection), set()).add(threading.get_ident())
+            # Long enough that the next units are submitted while it runs.
+            time.sleep(0.02)
+            return write_batch(loader, connection, frame)
+
+        tickers = [f'T{i:02d}' for i in range(12)]
+        units = self.units({ticker: bars([ticker], self.DATES) for ticker in tickers})
+        with mock.patch.object(PriceLoader, '_write_batch', autospec=True, side_effect=slow_write_batch):
+            stats = self.loader(workers=3).load(units)
+
+        self.assertEqual((stats['rows'], stats['units']), (120, 12))
+        self.assert_stored(bars(tickers, self.DATES))
+        # Up to `workers` connections, each used by one thread only, and all closed at the end.
+        self.assertGreater(len(self.connections), 1)
+        self.assertLessEqual(len(self.connections), 3)
+        self.assertTrue(all(len(idents) == 1 for idents in threads.values()))
+        for connection in self.connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connection.execute("SELECT 1")
+
+    def test_invalid_input(self):
+        with self.assertRaisesRegex(ValueError, 'paramstyle'):
+            PriceLoader(connect_sqlite, paramstyle='named')
+        with self.assertRaisesRegex(ValueError, 'method'):
+            PriceLoader(connect_sqlite, method='bulk')
+        with self.assertRaises(AssertionError):
+            PriceLoader(connect_sqlite, batch_size=0)
+
+        from main import main
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit):
+            main(['--sqlite', self.path, '--method', 'copy', 'parquet', 'bars/*.parquet'])
+        self.assertIn('--method copy needs Postgres', stderr.getvalue())
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1 @@
+from .feature_transform import FeaturePipeline, FeatureTransform, IncrementalFeatureTransform, ShardedFeaturePipeline
@@ -1,7 +1,21 @@
 import math
-from typing import Optional
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional, Tuple
+import numpy as np
 import pandas as pd
 
+try:
+    from instrumentation import instrumented
+except ImportError:
+    # Run from feature_transform/ (e.g. python test_feature_transform.py), without data_ingestion on the path:
+    # nothing is recorded.
+    def instrumented(name: Optional[str] = None, rows_in: Optional[str] = None, rows_out: bool = True):
+        return lambda func: func
+
 class FeatureTransform:
     """
     Feature transformation and engineering functions. Assume that all inputs have been cleaned, validated,
@@ -21,6 +35,15 @@ class FeatureTransform:
     import pandas as pd
     df = pd.read_parquet("")
     ```
+
+    Compact Mode:
+    For full-universe histories, `FeatureTransform.compact` stores the group column as a categorical, and the
+    methods that add feature columns take `dtype=np.float32` to write them as float32. Features are computed
+    into one preallocated block and added to `data` without copying it, also when `inplace=False`.
+    ```
+    df = FeatureTransform.compact(df)
+    df = FeatureTransform.rolling_zscore(df, 60, inplace=False, dtype=np.float32)
+    ```
     """
 
     ############################################
@@ -28,6 +51,7 @@ class FeatureTransform:
     ############################################
     
     @staticmethod
+    @instrumented(rows_in='security_series')
     def rolling_beta(
         security_series: pd.Series, benchmark_series: pd.Series, window: int, min_window_pct: float=0.8
     ) -> pd.Series:
@@ -37,14 +61,16 @@ class FeatureTransform:
         assert 0 <= min_window_pct <= 1
         min_periods = FeatureTransform._get_min_periods_length(window, min_window_pct)
 
+        benchmark_returns = benchmark_series.pct_change(1)
         return_series = security_series.pct_change(1).rolling(window, min_periods=min_periods)
-        benchmark_return_series = benchmark_series.pct_change(1).rolling(window, min_periods=min_periods)
-        
+        benchmark_return_series = benchmark_returns.rolling(window, min_periods=min_periods)
+
         # Beta = Cov(R_p, R_m) / Var(R_m) where R_p is portfolio return, R_m is market (benchmark) return
-        betas = return_series.cov(benchmark_return_series) / benchmark_return_series.var()
+        betas = return_series.cov(benchmark_returns) / benchmark_return_series.var()
         return betas
 
     @staticmethod
+    @instrumented(rows_in='series')
     def percent_from_trailing_max(
         series: pd.Series, window: int, min_window_pct: float=0.8
     ) -> pd.Series:
@@ -55,6 +81,7 @@ class FeatureTransform:
         return series / series.rolling(window, min_periods=min_periods).max() - 1
 
     @staticmethod
+    @instrumented(rows_in='series')
     def percent_from_trailing_min(
         series: pd.Series, window: int, min_window_pct: float=0.8
     ) -> pd.Series:
@@ -65,6 +92,7 @@ class FeatureTransform:
         return series / series.rolling(window, min_periods=min_periods).min() - 1
 
     @staticmethod
+    @instrumented(rows_in='series')
     def sma(
         series: pd.Series, window: int, min_window_pct: float=0.8
     ) -> pd.Series:
@@ -76,6 +104,7 @@ class FeatureTransform:
         return series.rolling(window=window, min_periods=min_periods).mean()
     
     @staticmethod
+    @instrumented(rows_in='series')
     def ema(
         series: pd.Series, window: int, min_window_pct: float=0.8, adjust: bool = False, halflife: Optional[float] = None, span: Optional[float] = None, com: Optional[float] = None
         # TODO: add other params for weights
@@ -95,83 +124,1630 @@ class FeatureTransform:
         else:
             return series.ewm(span=window, min_periods=min_periods, adjust=adjust).mean()
 
-        
+    ############################################
+    # Wide DataFrame Transformations
+    ############################################
+
+    @staticmethod
+    @instrumented(rows_in='prices')
+    def rolling_beta_matrix(
+        prices: pd.DataFrame, benchmark_series: pd.Series, window: int, min_window_pct: float=0.8
+    ) -> pd.DataFrame:
+        """Compute `rolling_beta` of every column of a wide (date x ticker) price frame against one benchmark.
+
+        The benchmark returns and their rolling variance are computed once, and the rolling covariances of
+        all columns come from window sums over one 2-D block instead of a rolling object per column.
+
+        Args:
+            prices (pd.DataFrame): wide format prices, one column per security, date aligned with `benchmark_series`.
+            benchmark_series (pd.Series): benchmark prices.
+            window (int): rolling lookback window length.
+            min_window_pct (float, optional): minimum fraction of the window that must be observed. Defaults to 0.8.
+
+        Returns:
+            pd.DataFrame: betas with the index and columns of `prices`.
+        """
+        assert window > 0
+        assert 0 <= min_window_pct <= 1
+        assert len(prices) == len(benchmark_series)
+        min_periods = max(FeatureTransform._get_min_periods_length(window, min_window_pct), 1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = prices.pct_change(1).to_numpy(dtype=np.float64).T
+            benchmark_returns = benchmark_series.pct_change(1).to_numpy(dtype=np.float64)
+        # Like `rolling`, infinite returns count as missing.
+        returns = np.where(np.isinf(returns), np.nan, returns)
+        benchmark_returns = np.where(np.isinf(benchmark_returns), np.nan, benchmark_returns)
+        benchmark_valid = ~np.isnan(benchmark_returns)
+
+        # Covariances are shift invariant, so the returns are centered first to keep the window sums precise.
+        benchmark_center = np.nanmean(benchmark_returns) if benchmark_valid.any() else 0.0
+        centered_benchmark = np.where(benchmark_valid, benchmark_returns - benchmark_center, 0.0)[None, :]
+
+        # Rolling sample variance of the benchmark, with an all-equal window having exactly zero variance.
+        count, sum1, sum2 = FeatureTransform._rolling_window_sum(
+            np.vstack([benchmark_valid, centered_benchmark[0], centered_benchmark[0] ** 2]), window
+        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            benchmark_var = np.maximum(sum2 - sum1 * sum1 / count, 0.0) / (count - 1)
+        all_equal = FeatureTransform._trailing_run_length(benchmark_returns, benchmark_valid) >= count
+        benchmark_var[all_equal] = 0.0
+        benchmark_var[(count < min_periods) | (count < 2)] = np.nan
+
+        betas = np.empty_like(returns)
+        for batch in FeatureTransform._get_column_batches(*returns.shape):
+            x = returns[batch]
+            # Like `Rolling.cov`, only dates where both the security and the benchmark have a return are used.
+            valid = ~np.isnan(x) & benchmark_valid
+            center = np.where(valid, x, 0.0).sum(axis=1, keepdims=True) / np.maximum(valid.sum(axis=1, keepdims=True), 1)
+            x = np.where(valid, x - center, 0.0)
+            y = np.where(valid, centered_benchmark, 0.0)
+
+            count = FeatureTransform._rolling_window_sum(valid.astype(np.float64), window)
+            sum_x = FeatureTransform._rolling_window_sum(x, window)
+            sum_y = FeatureTransform._rolling_window_sum(y, window)
+            sum_xy = FeatureTransform._rolling_window_sum(x * y, window)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cov = (sum_xy - sum_x * sum_y / count) / (count - 1)
+                cov[(count < min_periods) | (count < 2)] = np.nan
+                # The covariance with an all-equal benchmark window is exactly 0, as it is in `Rolling.cov`.
+                cov[:, all_equal] *= 0.0
+                betas[batch] = cov / benchmark_var
+
+        return pd.DataFrame(betas.T, index=prices.index, columns=prices.columns)
+
+    ############################################
+    # Long Format DataFrame Transformations
+    ############################################
+
+    @staticmethod
+    @instrumented(rows_in='data')
+    def percent_from_trailing_extremes(
+        data: pd.DataFrame, windows: List[int], min_window_pct: float=0.8, columns: Optional[List[str]] = None,
+        group_column='ticker', inplace=True, dtype=np.float64
+    ) -> pd.DataFrame:
+        """Compute `percent_from_trailing_max` and `percent_from_trailing_min` for several windows at once,
+        grouped by some column, along with the number of rows since each trailing max and min.
+
+        Rows are assumed to be in chronological order within each group. The frame is sorted once by group,
+        and the trailing max/min of every window is built from max/min tables over the last 1, 2, 4, ...
+        rows of each group, so all windows come out of one sweep of O(log(max window)) vectorized passes
+        with no loop over groups. When the extreme occurs more than once in a window, the most recent
+        occurrence is the one counted from.
+
+        Args:
+            data (pd.DataFrame): long format dataframe.
+            windows (List[int]): rolling lookback window lengths, e.g. [21, 63, 126, 252].
+            min_window_pct (float, optional): minimum fraction of the window that must be observed. Defaults to 0.8.
+            columns (List[str], optional): columns to compute the features of. Defaults to every numeric column.
+            group_column (str, optional): column to group the rolling windows by. Defaults to 'ticker'.
+            inplace (bool, optional): add the feature columns to `data` instead of a copy. Defaults to True.
+            dtype (optional): dtype of the feature columns, e.g. np.float32 in compact mode. Defaults to np.float64.
+
+        Returns:
+            pd.DataFrame: `data` with `{col}_pct_from_max_{w}`, `{col}_pct_from_min_{w}`, `{col}_days_since_max_{w}`
+                and `{col}_days_since_min_{w}` columns for every column and window.
+        """
+        assert len(windows) > 0
+        assert all(window > 0 for window in windows)
+        assert 0 <= min_window_pct <= 1
+        if not inplace:
+            data = data.copy(deep=False)
+
+        if columns is None:
+            columns = data.select_dtypes(include='number').columns
+        if len(columns) == 0:
+            return data
+
+        features = ['pct_from_max', 'pct_from_min', 'days_since_max', 'days_since_min']
+        order, starts = FeatureTransform._get_group_order(data[group_column])
+        lengths = np.diff(np.r_[starts, len(order)])
+        position = np.arange(len(order)) - np.repeat(starts, lengths)
+        inverse = np.full(len(data), len(order))
+        inverse[order] = np.arange(len(order))
+
+        out = np.empty((len(columns), len(windows), len(features), len(data)), dtype=dtype)
+        for batch in FeatureTransform._get_column_batches(len(columns), len(order)):
+            values = np.vstack([np.take(data[col].to_numpy(dtype=np.float64), order) for col in columns[batch]])
+            # Like `rolling`, infinite values are skipped when looking for the max and min.
+            valid = np.isfinite(values)
+            counts = [
+                FeatureTransform._grouped_window_sum(valid.astype(np.float64), starts, lengths, window)
+                if len(order) else np.zeros(values.shape) for window in windows
+            ]
+            for i, sign in enumerate([1.0, -1.0]):
+                # The trailing min is the negated trailing max of the negated values.
+                filled = np.where(valid, sign * values, -np.inf)
+                extremes = FeatureTransform._grouped_rolling_max(filled, position, windows)
+                for j, (window, (extreme, location)) in enumerate(zip(windows, extremes)):
+                    extreme *= sign
+                    too_short = counts[j] < max(FeatureTransform._get_min_periods_length(window, min_window_pct), 1)
+                    extreme[too_short] = np.nan
+                    sorted_out = np.full((2, values.shape[0], len(order) + 1), np.nan)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        np.subtract(values / extreme, 1, out=sorted_out[0, :, :-1])
+                    sorted_out[1, :, :-1] = np.where(too_short, np.nan, np.arange(len(order)) - location)
+                    out[batch, j, i] = np.take(sorted_out[0], inverse, axis=1)
+                    out[batch, j, 2 + i] = np.take(sorted_out[1], inverse, axis=1)
+
+        names = [f'{col}_{feature}_{window}' for col in columns for window in windows for feature in features]
+        FeatureTransform._add_columns(data, names, out.reshape(len(names), len(data)))
+
+        return data
+
+    @staticmethod
+    @instrumented(rows_in='data')
+    def moving_averages(
+        data: pd.DataFrame, specs: List[Tuple], min_window_pct: float=0.8, group_column='ticker', inplace=True,
+        dtype=np.float64
+    ) -> pd.DataFrame:
+        """Compute many `sma` and `ema` features at once, grouped by some column.
+
+        Rows are assumed to be in chronological order within each group. Every spec is (column, kind, window),
+        with kind "sma" or "ema", and optionally a dict of the other `ema` arguments (adjust, halflife, span, com),
+        e.g. [("close", "ema", 12), ("close", "sma", 200), ("volume", "ema", 20, {"halflife": 5})].
+        The frame is sorted once by group. The SMAs of a column are differences of one shared cumulative sum, and
+        the EMAs of every column and span are one recurrence stepped over the positions within the groups, with
+        every (group, spec) pair updated at each step. Results match `sma` and `ema` applied to every group,
+        including `adjust` and the `min_window_pct` rule. Infinite values are skipped by EMAs like in `ema`, and
+        make every SMA window holding them NaN.
+
+        Args:
+            data (pd.DataFrame): long format dataframe.
+            specs (List[Tuple]): (column, "sma" or "ema", window[, ema keyword arguments]) of every feature.
+            min_window_pct (float, optional): minimum fraction of the window that must be observed. Defaults to 0.8.
+            group_column (str, optional): column to group the windows by. Defaults to 'ticker'.
+            inplace (bool, optional): add the feature columns to `data` instead of a copy. Defaults to True.
+            dtype (optional): dtype of the feature columns, e.g. np.float32 in compact mode. Defaults to np.float64.
+
+        Returns:
+            pd.DataFrame: `data` with a `{column}_{kind}_{window}` column for every spec.
+        """
+        assert len(specs) > 0
+        assert 0 <= min_window_pct <= 1
+        parsed = []
+        for column, kind, window, *options in specs:
+            options = dict(options[0]) if options else {}
+            assert kind in ('sma', 'ema')
+            assert window > 0
+            assert kind == 'ema' or not options
+            assert set(options) <= {'adjust', 'halflife', 'span', 'com'}
+            parsed.append((column, kind, window, options))
+        names = [f'{column}_{kind}_{window}' for column, kind, window, _ in parsed]
+        assert len(set(names)) == len(names)
+        if not inplace:
+            data = data.copy(deep=False)
+
+        columns = list(dict.fromkeys(column for column, _, _, _ in parsed))
+        rows = [columns.index(column) for column, _, _, _ in parsed]
+        min_periods = [FeatureTransform._get_min_periods_length(window, min_window_pct) for _, _, window, _ in parsed]
+        order, starts = FeatureTransform._get_group_order(data[group_column])
+        inverse = np.full(len(data), len(order))
+        inverse[order] = np.arange(len(order))
+        values = np.vstack([np.take(data[col].to_numpy(dtype=np.float64), order) for col in columns])
+
+        sorted_out = np.full((len(parsed), len(order) + 1), np.nan)
+        if len(order):
+            sma = [i for i, spec in enumerate(parsed) if spec[1] == 'sma']
+            if sma:
+                sorted_out[sma, :-1] = FeatureTransform._grouped_moving_average(
+                    values, starts, [rows[i] for i in sma], [parsed[i][2] for i in sma], [min_periods[i] for i in sma]
+                )
+            ema = [i for i, spec in enumerate(parsed) if spec[1] == 'ema']
+            if ema:
+                # Same precedence as `ema`: halflife, then span, then com, then the window as the span.
+                coms = []
+                for i in ema:
+                    _, _, window, options = parsed[i]
+                    if options.get('halflife') is not None:
+                        coms.append(1. / (1. - math.exp(math.log(0.5) / options['halflife'])) - 1.)
+                    elif options.get('span') is not None:
+                        coms.append((options['span'] - 1.) / 2.)
+                    elif options.get('com') is not None:
+                        coms.append(float(options['com']))
+                    else:
+                        coms.append((window - 1.) / 2.)
+                sorted_out[ema, :-1] = FeatureTransform._grouped_ewm_mean(
+                    values, starts, [rows[i] for i in ema], coms,
+                    [bool(parsed[i][3].get('adjust', False)) for i in ema], [min_periods[i] for i in ema]
+                )
+
+        out = np.empty((len(parsed), len(data)), dtype=dtype)
+        out[:] = np.take(sorted_out, inverse, axis=1)
+        FeatureTransform._add_columns(data, names, out)
+
+        return data
+
+
     ############################################
     # DataFrame Normalization Methods
     ############################################
 
     @staticmethod
+    @instrumented(rows_in='data')
     def rolling_zscore(
-        data: pd.DataFrame, window: int, min_window_pct=0.8, group_column='ticker', inplace=True
+        data: pd.DataFrame, window: int, min_window_pct=0.8, group_column='ticker', inplace=True, engine='numpy',
+        dtype=np.float64
     ) -> pd.DataFrame:
         """Compute a rolling window Z score grouped by some column.
 
+        Rows are assumed to be in chronological order within each group. The default "numpy" engine
+        sorts the frame once by group, computes the rolling mean/std of every numeric column over one
+        2-D block, and writes all `*_r_zscore` columns in a single assignment. The "pandas" engine runs
+        a grouped `rolling` per column and is kept as the reference implementation.
+
         Args:
-            data (pd.DataFrame): _description_
-            window (int): _description_
-            min_window_pct (float, optional): _description_. Defaults to 0.8.
-            group_column (str, optional): _description_. Defaults to 'ticker'.
-            inplace (bool, optional): _description_. Defaults to True.
+            data (pd.DataFrame): long format dataframe.
+            window (int): rolling lookback window length.
+            min_window_pct (float, optional): minimum fraction of the window that must be observed. Defaults to 0.8.
+            group_column (str, optional): column to group the rolling windows by. Defaults to 'ticker'.
+            inplace (bool, optional): add the Z score columns to `data` instead of a copy. Defaults to True.
+            engine (str, optional): "numpy" or "pandas". Defaults to 'numpy'.
+            dtype (optional): dtype of the Z score columns, e.g. np.float32 in compact mode. Defaults to np.float64.
 
         Returns:
-            pd.DataFrame: _description_
+            pd.DataFrame: `data` with a `{col}_r_zscore` column for every numeric column.
         """
         assert window > 0
         assert 0 <= min_window_pct <= 1
+        assert engine in ('numpy', 'pandas')
         min_periods = FeatureTransform._get_min_periods_length(window, min_window_pct)
         if not inplace:
-            data = data.copy()
+            data = data.copy(deep=False)
 
-        # Function to calculate Z-score
-        def rolling_zscore(x):
-            r = x.rolling(window=window, min_periods=min_periods)
-            m = r.mean()
-            s = r.std(ddof=0)
-            z = (x - m) / s
-            return z
-
-        # Apply Z-score function to each group
         numeric_cols = data.select_dtypes(include='number').columns
-        for col in numeric_cols:
-            data[f'{col}_r_zscore'] = data.groupby(group_column)[col].transform(rolling_zscore)
+        if len(numeric_cols) == 0:
+            return data
+
+        if engine == 'pandas':
+            # Function to calculate Z-score
+            def rolling_zscore(x):
+                r = x.rolling(window=window, min_periods=min_periods)
+                m = r.mean()
+                s = r.std(ddof=0)
+                z = (x - m) / s
+                return z
+
+            # Apply Z-score function to each group
+            for col in numeric_cols:
+                data[f'{col}_r_zscore'] = data.groupby(group_column, observed=True)[col].transform(rolling_zscore).astype(dtype)
+            return data
+
+        order, starts = FeatureTransform._get_group_order(data[group_column])
+        # Position of every row in the sorted block, or one past the end (a NaN slot) if it was dropped.
+        inverse = np.full(len(data), len(order))
+        inverse[order] = np.arange(len(order))
+
+        z = np.empty((len(numeric_cols), len(data)), dtype=dtype)
+        for batch in FeatureTransform._get_column_batches(len(numeric_cols), len(order)):
+            values = np.vstack([np.take(data[col].to_numpy(dtype=np.float64), order) for col in numeric_cols[batch]])
+            mean, var, _ = FeatureTransform._grouped_rolling_moments(values, starts, window, min_periods)
+            sorted_z = np.full((values.shape[0], len(order) + 1), np.nan)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.divide(values - mean, np.sqrt(var), out=sorted_z[:, :-1])
+            z[batch] = np.take(sorted_z, inverse, axis=1)
+        FeatureTransform._add_columns(data, [f'{col}_r_zscore' for col in numeric_cols], z)
 
         return data
 
     @staticmethod
+    @instrumented(rows_in='data')
     def cross_sectional_zscore(
-        data: pd.DataFrame, min_window_pct=0.8, inplace=True
+        data: pd.DataFrame, min_window_pct=0.8, inplace=True, engine='numpy', dtype=np.float64
     ) -> pd.DataFrame:
         """Compute the cross-sectional Z score grouped by the dataframe index.
 
+        A date's Z score is only computed for a column if at least `min_window_pct` of the rows on that
+        date have a value in the column. The default "numpy" engine factorizes the dates once, computes
+        the per-date means and standard deviations of every numeric column over one 2-D block, and writes
+        all `*_zscore` columns in a single assignment. The "pandas" engine runs a grouped `transform`
+        per column and is kept as the reference implementation.
+
         Args:
-            data (pd.DataFrame): _description_
-            min_window_pct (float, optional): _description_. Defaults to 0.8.
-            inplace (bool, optional): _description_. Defaults to True.
+            data (pd.DataFrame): long format dataframe.
+            min_window_pct (float, optional): minimum fraction of a date's rows that must be observed. Defaults to 0.8.
+            inplace (bool, optional): add the Z score columns to `data` instead of a copy. Defaults to True.
+            engine (str, optional): "numpy" or "pandas". Defaults to 'numpy'.
+            dtype (optional): dtype of the Z score columns, e.g. np.float32 in compact mode. Defaults to np.float64.
 
         Returns:
-            pd.DataFrame: _description_
+            pd.DataFrame: `data` with a `{col}_zscore` column for every numeric column.
         """
         assert 0 <= min_window_pct <= 1
+        assert engine in ('numpy', 'pandas')
         if not inplace:
-            data = data.copy()
-
-        # group by date, and Z score normalize the features on each date.
-        def zscore(df):
-            return (df - df.mean()) / df.std(ddof=0)
+            data = data.copy(deep=False)
 
         numeric_cols = data.select_dtypes(include='number').columns
-        for col in numeric_cols:
-            # Assume dataframe is the index 
-            data[f'{col}_zscore'] = data.groupby(level=0)[col].transform(zscore)
-            
+        if len(numeric_cols) == 0:
+            return data
+
+        if engine == 'pandas':
+            # group by date, and Z score normalize the features on each date.
+            def zscore(df):
+                if df.count() < FeatureTransform._get_min_periods_length(len(df), min_window_pct):
+                    return df * np.nan
+                return (df - df.mean()) / df.std(ddof=0)
+
+            for col in numeric_cols:
+                # Assume dataframe is the index
+                data[f'{col}_zscore'] = data.groupby(level=0)[col].transform(zscore).astype(dtype)
+            return data
+
+        order, starts = FeatureTransform._get_group_order(data.index.get_level_values(0))
+        lengths = np.diff(np.r_[starts, len(order)])
+        min_count = np.ceil(lengths * min_window_pct)
+        inverse = np.full(len(data), len(order))
+        inverse[order] = np.arange(len(order))
+
+        z = np.empty((len(numeric_cols), len(data)), dtype=dtype)
+        for batch in FeatureTransform._get_column_batches(len(numeric_cols), len(order)):
+            values = np.vstack([np.take(data[col].to_numpy(dtype=np.float64), order) for col in numeric_cols[batch]])
+            sorted_z = np.full((values.shape[0], len(order) + 1), np.nan)
+            if len(order):
+                valid = ~np.isnan(values)
+                count = np.add.reduceat(valid, starts, axis=1)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    mean = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=1) / count
+                    deviation = values - np.repeat(mean, lengths, axis=1)
+                    # Two passes (mean, then squared deviations) like pandas, rather than E[x^2] - E[x]^2.
+                    std = np.sqrt(np.add.reduceat(np.where(valid, deviation * deviation, 0.0), starts, axis=1) / count)
+                    std[count < min_count] = np.nan
+                    np.divide(deviation, np.repeat(std, lengths, axis=1), out=sorted_z[:, :-1])
+            z[batch] = np.take(sorted_z, inverse, axis=1)
+        FeatureTransform._add_columns(data, [f'{col}_zscore' for col in numeric_cols], z)
+
         return data
-    
+
+    ############################################
+    # Memory
+    ############################################
+
+    @staticmethod
+    def compact(data: pd.DataFrame, group_column='ticker') -> pd.DataFrame:
+        """Stores the group column of a long format dataframe as a categorical, which holds every ticker once
+        and a small integer code per row instead of a string per row. The other columns are not copied.
+
+        Args:
+            data (pd.DataFrame): long format dataframe.
+            group_column (str, optional): column to make categorical. Defaults to 'ticker'.
+
+        Returns:
+            pd.DataFrame: a shallow copy of `data` with a categorical `group_column`.
+        """
+        data = data.copy(deep=False)
+        if not isinstance(data[group_column].dtype, pd.CategoricalDtype):
+            data[group_column] = data[group_column].astype('category')
+        return data
+
     ############################################
     # Private Methods
     ############################################
 
+    @staticmethod
+    def _add_columns(data: pd.DataFrame, names: List[str], block: np.ndarray) -> None:
+        """Adds the rows of a (features x rows) block as columns of `data`. The transposed block is laid out
+        like a pandas block already, so it becomes the columns' storage instead of being copied.
+        """
+        data[names] = pd.DataFrame(block.T, index=data.index, columns=names, copy=False)
+
     @staticmethod
     def _get_min_periods_length(window: int, min_window_pct: float) -> int:
         """Gets the minimum period required for a rolling window."""
         return int(math.ceil(window * min_window_pct))
 
+    @staticmethod
+    def _get_group_order(groups: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """Gets a stable sort order that makes every group contiguous, and the start of each group.
+
+        Rows with a missing group key are dropped from the order, like they are in `groupby`.
+        """
+        codes, uniques = pd.factorize(groups, sort=False)
+        # Stable sorts of small integer keys are radix sorts.
+        key_dtype = np.min_scalar_type(-max(len(uniques), 1))
+        order = np.argsort(codes.astype(key_dtype, copy=False), kind='stable')
+        order = order[codes[order] >= 0]
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(order) else np.empty(0, dtype=np.int64)
+        return order, starts
+
+    @staticmethod
+    def _get_column_batches(n_columns: int, n_rows: int, max_elements: int = 1 << 22) -> List[slice]:
+        """Splits columns into batches of at most `max_elements` values, to bound the size of temporaries."""
+        size = max(1, max_elements // max(n_rows, 1))
+        return [slice(i, min(i + size, n_columns)) for i in range(0, n_columns, size)]
+
+    @staticmethod
+    def _grouped_rolling_moments(
+        values: np.ndarray, starts: np.ndarray, window: int, min_periods: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Computes the rolling mean, population variance, and observation count along every row of a
+        (columns x observations) block whose groups are contiguous and begin at `starts`. Matches
+        `Series.rolling` per group, including NaN for windows with fewer than `min_periods` observations.
+        """
+        k, n = values.shape
+        if n == 0:
+            return values.copy(), values.copy(), np.zeros((k, n))
+
+        lengths = np.diff(np.r_[starts, n])
+        valid = ~np.isnan(values)
+
+        # Center and scale each group so that the window sums keep their precision for every group.
+        filled = np.where(valid, values, 0.0)
+        group_count = np.add.reduceat(valid, starts, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            center = np.add.reduceat(filled, starts, axis=1) / group_count
+        center[group_count == 0] = 0.0
+        center = np.repeat(center, lengths, axis=1)
+        scaled = np.subtract(filled, center, out=filled, where=valid)
+        scale = np.maximum.reduceat(np.abs(scaled), starts, axis=1)
+        scale[scale == 0] = 1.0
+        scale = np.repeat(scale, lengths, axis=1)
+        scaled /= scale
+
+        count = FeatureTransform._grouped_window_sum(valid.astype(np.float64), starts, lengths, window)
+        sum1 = FeatureTransform._grouped_window_sum(scaled, starts, lengths, window)
+        sum2 = FeatureTransform._grouped_window_sum(np.multiply(scaled, scaled, out=filled), starts, lengths, window)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sum1 / count
+            var = sum2 / count
+        var -= mean * mean
+        np.maximum(var, 0.0, out=var)
+
+        # Like pandas, a window whose observations are all equal has exactly its value as mean and zero
+        # variance. Only columns with a near-zero variance somewhere need the exact check.
+        all_equal = valid & (count == 1)
+        for j in np.flatnonzero((valid & (count > 1) & (var < 1e-10)).any(axis=1)):
+            all_equal[j] |= valid[j] & (FeatureTransform._trailing_run_length(values[j], valid[j]) >= count[j])
+
+        mean *= scale
+        mean += center
+        var *= scale * scale
+        mean[all_equal] = values[all_equal]
+        var[all_equal] = 0.0
+
+        too_short = count < max(min_periods, 1)
+        mean[too_short] = np.nan
+        var[too_short] = np.nan
+        return mean, var, count
+
+    @staticmethod
+    def _grouped_window_sum(values: np.ndarray, starts: np.ndarray, lengths: np.ndarray, window: int) -> np.ndarray:
+        """Sums the last `window` values up to every position along each row of a 2-D block, without
+        crossing the group boundaries given by `starts` and `lengths`.
+
+        Like `_rolling_window_sum`, prefix sums are accumulated in chunks, but the chunks start at the start of
+        every group: each group is laid out on its own cells of a (cell x position) grid. A group no longer than
+        a chunk is a single cell, and longer groups are cut every `max(window, 1024)` values, so every sum only
+        depends on the values of its group, not on where the group sits in the block.
+        """
+        k, n = values.shape
+        if n == 0:
+            return np.zeros((k, 0))
+        chunk = max(window, min(1024, int(lengths.max())))
+        cells = -(-lengths // chunk)
+        first_cell = np.r_[0, np.cumsum(cells)[:-1]]
+        position = np.arange(n) - np.repeat(starts, lengths)
+        cell = np.repeat(first_cell * chunk, lengths) + position
+        local = np.zeros((k, int(cells.sum()), chunk))
+        local.reshape(k, -1)[:, cell] = values
+        np.cumsum(local, axis=2, out=local)
+        chunk_total = local[:, :, -1].copy()
+
+        sums = local.copy()
+        if window < sums.shape[1] * chunk:
+            sums.reshape(k, -1)[:, window:] -= local.reshape(k, -1)[:, :-window]
+            # A window starting in the previous cell also needs the rest of that cell.
+            sums[:, 1:, :window] += chunk_total[:, :-1, None]
+        # The first `window` positions of every group only sum back to the start of their group.
+        sums[:, first_cell, :window] = local[:, first_cell, :window]
+        return np.take(sums.reshape(k, -1), cell, axis=1)
+
+    @staticmethod
+    def _grouped_rolling_max(
+        values: np.ndarray, position: np.ndarray, windows: List[int]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Computes the max of the last `window` values up to every position along each row of a 2-D block,
+        and the index of its most recent occurrence, for every window at once. Windows do not cross group
+        boundaries; `position` is the position of every value within its group.
+
+        A table holding the max over the last 1, 2, 4, ... values is doubled level by level, and every window
+        takes the tables of the set bits of its length, lowest first, each covering the values just before the
+        ones already covered. Every step is a shift by a constant, so it is a slice rather than a gather.
+        """
+        k, n = values.shape
+        rows = np.arange(n)
+        results = [(np.full((k, n), -np.inf), np.tile(rows, (k, 1))) for _ in windows]
+        covered = [0] * len(windows)
+
+        level, level_location = values, np.broadcast_to(rows, (k, n))
+        length = 1
+        while True:
+            for i, window in enumerate(windows):
+                shift = covered[i]
+                if window & length and shift < n:
+                    extreme, location = results[i]
+                    # Only strictly greater older values replace the max, so ties keep the latest location.
+                    take = (position[shift:] >= shift) & (level[:, :n - shift] > extreme[:, shift:])
+                    np.copyto(extreme[:, shift:], level[:, :n - shift], where=take)
+                    np.copyto(location[:, shift:], level_location[:, :n - shift], where=take)
+                covered[i] += window & length
+            if 2 * length > max(windows):
+                break
+            # Once a level spans every group, doubling it does not change it.
+            if length < n:
+                take = (position[length:] >= length) & (level[:, :n - length] > level[:, length:])
+                previous, previous_location = level, level_location
+                level, level_location = previous.copy(), previous_location.copy()
+                np.copyto(level[:, length:], previous[:, :n - length], where=take)
+                np.copyto(level_location[:, length:], previous_location[:, :n - length], where=take)
+            length *= 2
+        return results
+
+    @staticmethod
+    def _grouped_moving_average(
+        values: np.ndarray, starts: np.ndarray, rows: List[int], windows: List[int], min_periods: List[int]
+    ) -> np.ndarray:
+        """Computes the rolling mean of row `rows[i]` of a (columns x observations) block with window `windows[i]`
+        for every i, like `Series.rolling(...).mean()` per group. Every window of a row is the difference of two
+        entries of one cumulative sum of the row, centered on each group's mean to keep its precision. A window
+        holding an infinite value is NaN.
+        """
+        k, n = values.shape
+        lengths = np.diff(np.r_[starts, n])
+        valid = ~np.isnan(values)
+        finite = np.isfinite(values)
+        filled = np.where(finite, values, 0.0)
+        group_count = np.add.reduceat(finite, starts, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            center = np.add.reduceat(filled, starts, axis=1) / group_count
+        center[group_count == 0] = 0.0
+        center = np.repeat(center, lengths, axis=1)
+        np.subtract(filled, center, out=filled, where=finite)
+
+        # Sums, observation counts and infinite value counts, with a leading zero.
+        cumulative = np.zeros((3, k, n + 1))
+        np.cumsum(filled, axis=1, out=cumulative[0, :, 1:])
+        np.cumsum(valid, axis=1, out=cumulative[1, :, 1:])
+        np.cumsum(valid & ~finite, axis=1, out=cumulative[2, :, 1:])
+
+        group_start = np.repeat(starts, lengths)
+        end = np.arange(1, n + 1)
+        out = np.empty((len(rows), n))
+        for i, (row, window, periods) in enumerate(zip(rows, windows, min_periods)):
+            start = np.maximum(end - window, group_start)
+            total, count, infinite = cumulative[:, row, 1:] - cumulative[:, row, start]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[i] = total / count + center[row]
+            out[i, (count < max(periods, 1)) | (infinite > 0)] = np.nan
+        return out
+
+    @staticmethod
+    def _grouped_ewm_mean(
+        values: np.ndarray, starts: np.ndarray, rows: List[int], coms: List[float], adjusts: List[bool],
+        min_periods: List[int]
+    ) -> np.ndarray:
+        """Computes the exponentially weighted mean of row `rows[i]` of a (columns x observations) block with
+        center of mass `coms[i]` for every i, like `Series.ewm(...).mean()` per group (see `_Ewm`).
+
+        The values are laid out on a (position in group x group) grid, and the recurrence is stepped over the
+        positions, updating every (group, spec) pair at once, so the Python loop is as long as the longest group.
+        Infinite values are skipped like missing ones.
+        """
+        k, n = values.shape
+        lengths = np.diff(np.r_[starts, n])
+        position = np.arange(n) - np.repeat(starts, lengths)
+        group = np.repeat(np.arange(len(starts)), lengths)
+        grid = np.full((int(lengths.max()), len(starts), k), np.nan)
+        grid[position, group] = np.where(np.isfinite(values), values, np.nan).T
+
+        coms = np.asarray(coms, dtype=np.float64)
+        adjusts = np.asarray(adjusts, dtype=bool)
+        alpha = 1. / (1. + coms)
+        old_wt_factor = 1. - alpha
+        new_wt = np.where(adjusts, 1., alpha)
+        # pandas' weights for unevenly spaced observations, which it also applies to com=1 without adjust.
+        uneven = ~adjusts & (coms == 1)
+        min_periods = np.maximum(np.asarray(min_periods), 1)
+
+        shape = (len(starts), len(rows))
+        weighted = np.full(shape, np.nan)
+        old_wt = np.ones(shape)
+        nobs = np.zeros(shape, dtype=np.int64)
+        out = np.empty((grid.shape[0],) + shape)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for t in range(grid.shape[0]):
+                value = grid[t][:, rows]
+                is_observation = ~np.isnan(value)
+                has_weighted = ~np.isnan(weighted)
+                old_wt = np.where(has_weighted, old_wt * old_wt_factor, old_wt)
+                update = has_weighted & is_observation
+                step_wt = np.where(uneven, 1. - old_wt, new_wt)
+                blended = (old_wt * weighted + step_wt * value) / (old_wt + step_wt)
+                weighted = np.where(is_observation & ~has_weighted, value, weighted)
+                weighted = np.where(update & (weighted != value), blended, weighted)
+                old_wt = np.where(update, np.where(adjusts, old_wt + new_wt, 1.), old_wt)
+                nobs += is_observation
+                out[t] = np.where(nobs >= min_periods, weighted, np.nan)
+        return out[position, group].T
+
+    @staticmethod
+    def _rolling_window_sum(values: np.ndarray, window: int) -> np.ndarray:
+        """Sums every `window` consecutive values along each row of a 2-D block, truncated at the start.
+
+        Prefix sums are accumulated in chunks of at least `window` values rather than over the whole
+        row, so the rounding error of a window sum does not grow with the number of values before it.
+        """
+        k, n = values.shape
+        chunk = max(window, 1024)
+        n_chunks = -(-n // chunk)
+        local = np.zeros((k, n_chunks, chunk))
+        local.reshape(k, -1)[:, :n] = values
+        np.cumsum(local, axis=2, out=local)
+        chunk_total = local[:, :, -1].copy()
+
+        sums = local.copy()
+        if window < n_chunks * chunk:
+            sums.reshape(k, -1)[:, window:] -= local.reshape(k, -1)[:, :-window]
+            # A window starting in the previous chunk also needs the rest of that chunk.
+            sums[:, 1:, :window] += chunk_total[:, :-1, None]
+        return sums.reshape(k, -1)[:, :n]
+
+    @staticmethod
+    def _trailing_run_length(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        """For every row, counts the observations in the run of equal observed values ending at that row.
+        Missing values are skipped rather than breaking the run.
+        """
+        n = len(values)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.arange(n)
+        last_valid = np.maximum.accumulate(np.where(valid, rows, -1))
+        prev_valid = np.r_[-1, last_valid[:-1]]
+        is_break = valid & ((prev_valid < 0) | (values != values[np.maximum(prev_valid, 0)]))
+        last_break = np.maximum.accumulate(np.where(is_break, rows, 0))
+        cum_valid = np.cumsum(valid)
+        return cum_valid - cum_valid[last_break] + valid[last_break]
+
+
+class IncrementalFeatureTransform:
+    """
+    Incremental version of the FeatureTransform methods, for data that arrives a few bars at a time.
+
+    Features are registered once, then every call to `update` takes the new rows (long format, in
+    chronological order within each group) and returns the features of those rows only. The rolling state
+    of every group (the last `window` values, running sums, monotonic deques for the trailing max/min, and
+    the EWM weights) is kept between calls, so an update costs O(new rows) however long the history is.
+    The features of a group match the batch method applied to the group's full history, including the
+    `min_window_pct` rule.
+
+    ```
+    stream = IncrementalFeatureTransform().sma('price', 20).rolling_beta('price', 'spy_price', 60)
+    stream.update(history)
+    features = stream.update(new_bars)
+    ```
+    """
+
+    def __init__(self, group_column: str = 'ticker'):
+        self.group_column = group_column
+        self._features = []
+        self._states = {}
+
+    @property
+    def columns(self) -> List[str]:
+        """Names of the registered feature columns, in the order `update` returns them."""
+        return [feature.name for feature in self._features]
+
+    ############################################
+    # Feature Registration
+    ############################################
+
+    def rolling_beta(
+        self, column: str, benchmark_column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'IncrementalFeatureTransform':
+        """Adds `FeatureTransform.rolling_beta` of `column` against `benchmark_column`, as `{column}_beta_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_feature(_RollingBeta(name or f'{column}_beta_{window}', column, benchmark_column, window, min_periods))
+
+    def percent_from_trailing_max(
+        self, column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'IncrementalFeatureTransform':
+        """Adds `FeatureTransform.percent_from_trailing_max` of `column`, as `{column}_pct_from_max_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_feature(_PercentFromExtreme(name or f'{column}_pct_from_max_{window}', column, window, min_periods, True))
+
+    def percent_from_trailing_min(
+        self, column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'IncrementalFeatureTransform':
+        """Adds `FeatureTransform.percent_from_trailing_min` of `column`, as `{column}_pct_from_min_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_feature(_PercentFromExtreme(name or f'{column}_pct_from_min_{window}', column, window, min_periods, False))
+
+    def sma(
+        self, column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'IncrementalFeatureTransform':
+        """Adds `FeatureTransform.sma` of `column`, as `{column}_sma_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_feature(_Sma(name or f'{column}_sma_{window}', column, window, min_periods))
+
+    def ema(
+        self, column: str, window: int, min_window_pct: float=0.8, adjust: bool = False, halflife: Optional[float] = None,
+        span: Optional[float] = None, com: Optional[float] = None, name: Optional[str]=None
+    ) -> 'IncrementalFeatureTransform':
+        """Adds `FeatureTransform.ema` of `column`, as `{column}_ema_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        # Same precedence as FeatureTransform.ema, and the same center of mass as `Series.ewm`.
+        if halflife is not None:
+            assert halflife > 0
+            com = 1 / (1 - np.exp(np.log(0.5) / halflife)) - 1
+        elif span is not None:
+            assert span >= 1
+            com = (span - 1) / 2
+        elif com is None:
+            com = (window - 1) / 2
+        assert com >= 0
+        return self._add_feature(_Ema(name or f'{column}_ema_{window}', column, float(com), min_periods, adjust))
+
+    def rolling_zscore(
+        self, columns: List[str], window: int, min_window_pct: float=0.8
+    ) -> 'IncrementalFeatureTransform':
+        """Adds `FeatureTransform.rolling_zscore` of every column in `columns`, as `{col}_r_zscore`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        for column in columns:
+            self._add_feature(_RollingZscore(f'{column}_r_zscore', column, window, min_periods))
+        return self
+
+    ############################################
+    # Updates
+    ############################################
+
+    @instrumented(rows_in='data')
+    def update(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Adds new rows to the rolling state of their groups and computes their features.
+
+        Args:
+            data (pd.DataFrame): long format dataframe of the new rows, in chronological order within each group.
+
+        Returns:
+            pd.DataFrame: the registered feature columns of the new rows, with the index of `data`. Rows without
+            a group are NaN and do not change any state.
+        """
+        assert self._features, "register features before updating"
+        order, starts = FeatureTransform._get_group_order(data[self.group_column])
+        stops = np.r_[starts[1:], len(order)].astype(np.int64)
+        groups = data[self.group_column].to_numpy()[order[starts]] if len(order) else []
+
+        inputs = {}
+        for feature in self._features:
+            for column in feature.columns:
+                if column not in inputs:
+                    inputs[column] = np.take(data[column].to_numpy(dtype=np.float64), order)
+
+        result = np.full((len(self._features), len(data)), np.nan)
+        for group, start, stop in zip(groups, starts, stops):
+            if group not in self._states:
+                self._states[group] = [feature.new_state() for feature in self._features]
+            rows = order[start:stop]
+            for i, (feature, state) in enumerate(zip(self._features, self._states[group])):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    result[i, rows] = feature.update(state, *[inputs[column][start:stop] for column in feature.columns])
+
+        return pd.DataFrame(result.T, index=data.index, columns=self.columns)
+
+    ############################################
+    # Private Methods
+    ############################################
+
+    def _add_feature(self, feature: '_Feature') -> 'IncrementalFeatureTransform':
+        assert not self._states, "features must be registered before the first update"
+        assert feature.name not in self.columns, f"duplicate feature column {feature.name}"
+        self._features.append(feature)
+        return self
+
+    @staticmethod
+    def _get_min_periods_length(window: int, min_window_pct: float) -> int:
+        assert window > 0
+        assert 0 <= min_window_pct <= 1
+        return FeatureTransform._get_min_periods_length(window, min_window_pct)
+
+
+class FeaturePipeline:
+    """
+    Declarative version of the FeatureTransform methods, for computing a whole feature set in one pass.
+
+    Features are declared once, then `run` builds a graph of the intermediates they need: the group sort
+    order, every input column in group order, grouped returns, rolling moments, trailing extremes and EWMs.
+    Intermediates are keyed by what they compute, so one that several features share (the returns of a
+    benchmark for every beta, the rolling moments of a column for an sma and a z score with the same window,
+    the trailing max/min of a column for all of its windows) is computed once and freed after its last use.
+    The features of a group match the batch method applied to the group, and the time spent in every node
+    is kept in `timings`.
+
+    ```
+    pipeline = FeaturePipeline().sma('c', 20).ema('c', 12).rolling_zscore(['volume'], 60).rolling_beta('c', 'spy_c', 252)
+    features = pipeline.run(data)
+    print(pipeline.timings.sort_values(ascending=False))
+    ```
+    """
+
+    def __init__(self, group_column: str = 'ticker'):
+        self.group_column = group_column
+        self.timings = None
+        self._specs = []
+
+    @property
+    def columns(self) -> List[str]:
+        """Names of the declared feature columns, in the order `run` returns them."""
+        return [spec[0] for spec in self._specs]
+
+    @property
+    def input_columns(self) -> List[str]:
+        """Names of the columns of `data` the declared features read."""
+        columns = []
+        for _, kind, column, *args in self._specs:
+            for col in [column, args[0]] if kind == 'rolling_beta' else [column]:
+                if col not in columns:
+                    columns.append(col)
+        return columns
+
+    ############################################
+    # Feature Declaration
+    ############################################
+
+    def rolling_beta(
+        self, column: str, benchmark_column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'FeaturePipeline':
+        """Adds `FeatureTransform.rolling_beta` of `column` against `benchmark_column`, as `{column}_beta_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_spec(name or f'{column}_beta_{window}', 'rolling_beta', column, benchmark_column, window, min_periods)
+
+    def percent_from_trailing_max(
+        self, column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'FeaturePipeline':
+        """Adds `FeatureTransform.percent_from_trailing_max` of `column`, as `{column}_pct_from_max_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_spec(name or f'{column}_pct_from_max_{window}', 'percent_from_trailing', column, window, min_periods, 1.0)
+
+    def percent_from_trailing_min(
+        self, column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'FeaturePipeline':
+        """Adds `FeatureTransform.percent_from_trailing_min` of `column`, as `{column}_pct_from_min_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_spec(name or f'{column}_pct_from_min_{window}', 'percent_from_trailing', column, window, min_periods, -1.0)
+
+    def sma(
+        self, column: str, window: int, min_window_pct: float=0.8, name: Optional[str]=None
+    ) -> 'FeaturePipeline':
+        """Adds `FeatureTransform.sma` of `column`, as `{column}_sma_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        return self._add_spec(name or f'{column}_sma_{window}', 'sma', column, window, min_periods)
+
+    def ema(
+        self, column: str, window: int, min_window_pct: float=0.8, adjust: bool = False, halflife: Optional[float] = None,
+        span: Optional[float] = None, com: Optional[float] = None, name: Optional[str]=None
+    ) -> 'FeaturePipeline':
+        """Adds `FeatureTransform.ema` of `column`, as `{column}_ema_{window}`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        # Same precedence as FeatureTransform.ema.
+        if halflife is not None:
+            decay = ('halflife', halflife)
+        elif span is not None:
+            decay = ('span', span)
+        elif com is not None:
+            decay = ('com', com)
+        else:
+            decay = ('span', window)
+        return self._add_spec(name or f'{column}_ema_{window}', 'ema', column, decay, adjust, min_periods)
+
+    def rolling_zscore(
+        self, columns: List[str], window: int, min_window_pct: float=0.8
+    ) -> 'FeaturePipeline':
+        """Adds `FeatureTransform.rolling_zscore` of every column in `columns`, as `{col}_r_zscore`."""
+        min_periods = self._get_min_periods_length(window, min_window_pct)
+        for column in columns:
+            self._add_spec(f'{column}_r_zscore', 'rolling_zscore', column, window, min_periods)
+        return self
+
+    ############################################
+    # Evaluation
+    ############################################
+
+    @instrumented(rows_in='data')
+    def run(self, data: pd.DataFrame, dtype=np.float64) -> pd.DataFrame:
+        """Computes every declared feature of `data`.
+
+        Args:
+            data (pd.DataFrame): long format dataframe, in chronological order within each group.
+            dtype (optional): dtype of the feature columns, e.g. np.float32 in compact mode. Defaults to np.float64.
+
+        Returns:
+            pd.DataFrame: the declared feature columns, with the index of `data`. Rows without a group are NaN.
+            The seconds spent in every node of the graph are in `self.timings`.
+        """
+        assert self._specs, "declare features before running"
+        graph = _FeatureGraph(self.group_column)
+        # All the windows of a column's trailing max/min come out of one sweep, so they are collected first.
+        for _, kind, column, window, *_ in self._specs:
+            if kind == 'percent_from_trailing':
+                graph.extreme_windows.setdefault(column, set()).add(window)
+        outputs = [getattr(graph, kind)(*args) for _, kind, *args in self._specs]
+
+        # The group order is also kept to the end, to put the features back in the order of `data`.
+        group_order = graph.group_order()
+        results = {}
+        remaining = {key: 0 for key in graph.nodes}
+        for key in [dep for node in graph.nodes.values() for dep in node.deps] + outputs + [group_order]:
+            remaining[key] += 1
+        timings = {}
+        features = np.full((len(outputs), len(data)), np.nan, dtype=dtype)
+        for key, node in graph.nodes.items():
+            start = time.perf_counter()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results[key] = node.function(data, *[results[dep] for dep in node.deps])
+            timings[node.label] = time.perf_counter() - start
+            # Intermediates are dropped as soon as everything that reads them has run.
+            for dep in node.deps:
+                remaining[dep] -= 1
+                if remaining[dep] == 0:
+                    del results[dep]
+
+        start = time.perf_counter()
+        order = results[group_order][0]
+        for i, key in enumerate(outputs):
+            features[i, order] = results[key]
+        result = pd.DataFrame(features.T, index=data.index, columns=self.columns, copy=False)
+        timings['output'] = time.perf_counter() - start
+
+        self.timings = pd.Series(timings, name='seconds')
+        return result
+
+    ############################################
+    # Private Methods
+    ############################################
+
+    def _add_spec(self, name: str, kind: str, *args) -> 'FeaturePipeline':
+        assert name not in self.columns, f"duplicate feature column {name}"
+        self._specs.append((name, kind, *args))
+        return self
+
+    @staticmethod
+    def _get_min_periods_length(window: int, min_window_pct: float) -> int:
+        assert window > 0
+        assert 0 <= min_window_pct <= 1
+        return FeatureTransform._get_min_periods_length(window, min_window_pct)
+
+
+class ShardedFeaturePipeline:
+    """
+    Runs a FeaturePipeline over shards of groups (tickers) in a process pool, for feature sets too large for one core.
+
+    The groups are split into ceil(rows / `shard_rows`) shards balanced by row count: largest group first, each
+    to the shard with the fewest rows so far. The input columns are copied once into shared memory, shard after
+    shard, and every worker maps its rows from there instead of being sent a pickled frame, then writes its
+    features into a second shared block, which is put back in the row order of `data`. Cross-sectional steps
+    compare groups on every date, so they run on the merged features, in this process.
+
+    The shards only depend on the groups and `shard_rows`, so the features are the same bit for bit for any
+    number of `workers`, including workers=1, which runs the shards one after the other in this process. The
+    grouped kernels only read the values of each group, so they also match `pipeline.run` on the whole frame
+    bit for bit.
+
+    ```
+    pipeline = FeaturePipeline().sma('c', 20).ema('c', 12).rolling_zscore(['volume'], 60).rolling_beta('c', 'spy_c', 252)
+    sharded = ShardedFeaturePipeline(pipeline, workers=32).cross_sectional_zscore(['c_sma_20', 'c_beta_252'])
+    features = sharded.run(data)
+    ```
+    """
+
+    def __init__(self, pipeline: FeaturePipeline, workers: Optional[int] = None, shard_rows: int = 250_000):
+        assert workers is None or workers > 0
+        assert shard_rows > 0
+        self.pipeline = pipeline
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_rows = shard_rows
+        self.timings = None
+        self._cross_sectional = []
+
+    @property
+    def columns(self) -> List[str]:
+        """Names of the feature columns, in the order `run` returns them."""
+        return self.pipeline.columns + [f'{col}_zscore' for columns, _ in self._cross_sectional for col in columns]
+
+    def cross_sectional_zscore(self, columns: List[str], min_window_pct: float=0.8) -> 'ShardedFeaturePipeline':
+        """Adds `FeatureTransform.cross_sectional_zscore` of every column in `columns`, which are features of the
+        pipeline or numeric columns of `data`, as `{col}_zscore`. They are computed after the shards are merged.
+        """
+        assert 0 <= min_window_pct <= 1
+        names = self.columns
+        for col in columns:
+            assert f'{col}_zscore' not in names, f"duplicate feature column {col}_zscore"
+            names.append(f'{col}_zscore')
+        self._cross_sectional.append((list(columns), min_window_pct))
+        return self
+
+    @instrumented(rows_in='data')
+    def run(self, data: pd.DataFrame, dtype=np.float64) -> pd.DataFrame:
+        """Computes the features of the pipeline, shard by shard, then the cross-sectional steps.
+
+        Args:
+            data (pd.DataFrame): long format dataframe indexed by date, in chronological order within each group.
+            dtype (optional): dtype of the feature columns, e.g. np.float32 in compact mode. Defaults to np.float64.
+
+        Returns:
+            pd.DataFrame: the feature columns, with the index of `data`. Rows without a group are NaN.
+            The seconds spent in every node of the pipeline, summed over the shards, are in `self.timings`.
+        """
+        pipeline = self.pipeline
+        assert pipeline.columns, "declare features before running"
+        inputs = pipeline.input_columns
+        order, starts = FeatureTransform._get_group_order(data[pipeline.group_column])
+        lengths = np.diff(np.r_[starts, len(order)])
+        shard_of_group = self._get_shards(lengths)
+        n_shards = int(shard_of_group.max()) + 1 if len(lengths) else 0
+
+        # Rows of the shards one after the other. The sort is stable, so every group stays contiguous and in order.
+        group_of_row = np.repeat(np.arange(len(starts)), lengths)
+        by_shard = np.argsort(shard_of_group[group_of_row], kind='stable')
+        order = order[by_shard]
+        bounds = np.r_[0, np.cumsum(np.bincount(shard_of_group, weights=lengths, minlength=n_shards))].astype(np.int64)
+        # Largest shards first, so that one large shard does not finish alone at the end.
+        tasks = sorted(zip(bounds[:-1], bounds[1:]), key=lambda bound: bound[0] - bound[1])
+
+        features = np.full((len(pipeline.columns), len(data)), np.nan, dtype=dtype)
+        with _SharedArray((len(inputs), len(order)), np.float64) as values, \
+                _SharedArray((len(order),), np.int64) as codes, \
+                _SharedArray((len(pipeline.columns), len(order)), dtype) as out:
+            for i, col in enumerate(inputs):
+                np.take(data[col].to_numpy(dtype=np.float64), order, out=values.array[i])
+            codes.array[:] = group_of_row[by_shard]
+            if self.workers == 1 or len(tasks) <= 1:
+                timings = [_run_shard(pipeline, inputs, values.array, codes.array, out.array, lo, hi) for lo, hi in tasks]
+            else:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+                    futures = [
+                        executor.submit(_run_shared_shard, pipeline, inputs, values.spec, codes.spec, out.spec, lo, hi)
+                        for lo, hi in tasks
+                    ]
+                    timings = [future.result() for future in futures]
+            features[:, order] = out.array
+        result = pd.DataFrame(features.T, index=data.index, columns=pipeline.columns, copy=False)
+
+        for columns, min_window_pct in self._cross_sectional:
+            source = pd.DataFrame(
+                {col: (result[col] if col in result.columns else data[col]).to_numpy() for col in columns},
+                index=data.index,
+            )
+            zscores = FeatureTransform.cross_sectional_zscore(source, min_window_pct, dtype=dtype)
+            names = [f'{col}_zscore' for col in columns]
+            assert all(name in zscores.columns for name in names), "cross-sectional columns must be numeric"
+            FeatureTransform._add_columns(result, names, np.vstack([zscores[name].to_numpy() for name in names]))
+
+        self.timings = pd.concat(timings, axis=1).sum(axis=1).rename('seconds') if timings else None
+        return result
+
+    ############################################
+    # Private Methods
+    ############################################
+
+    def _get_shards(self, lengths: np.ndarray) -> np.ndarray:
+        """Assigns every group to one of ceil(rows / shard_rows) shards, balancing their row counts."""
+        n_shards = max(1, -(-int(lengths.sum()) // self.shard_rows))
+        shard_of_group = np.zeros(len(lengths), dtype=np.int64)
+        if n_shards == 1:
+            return shard_of_group
+        shard_rows = np.zeros(n_shards, dtype=np.int64)
+        for group in np.argsort(-lengths, kind='stable'):
+            shard = int(np.argmin(shard_rows))
+            shard_of_group[group] = shard
+            shard_rows[shard] += lengths[group]
+        return shard_of_group
+
+
+############################################
+# Incremental Features
+############################################
+
+def _without_inf(values: np.ndarray) -> np.ndarray:
+    """pandas rolling and ewm methods treat infinite values as missing."""
+    return np.where(np.isinf(values), np.nan, values)
+
+
+class _Feature:
+    """A feature of IncrementalFeatureTransform: `update` takes the new values of `columns` for one group and
+    its state from `new_state`, and returns the feature of each new row."""
+
+    def __init__(self, name: str, columns: List[str]):
+        self.name = name
+        self.columns = columns
+
+    def new_state(self):
+        raise NotImplementedError
+
+    def update(self, state, *values: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class _Sma(_Feature):
+    def __init__(self, name: str, column: str, window: int, min_periods: int):
+        super().__init__(name, [column])
+        self.window = window
+        self.min_periods = min_periods
+
+    def new_state(self):
+        return _RollingMean(self.window, self.min_periods)
+
+    def update(self, state, values):
+        return np.array([state.update(value) for value in _without_inf(values).tolist()])
+
+
+class _Ema(_Feature):
+    def __init__(self, name: str, column: str, com: float, min_periods: int, adjust: bool):
+        super().__init__(name, [column])
+        self.com = com
+        self.min_periods = min_periods
+        self.adjust = adjust
+
+    def new_state(self):
+        return _Ewm(self.com, self.min_periods, self.adjust)
+
+    def update(self, state, values):
+        return np.array([state.update(value) for value in _without_inf(values).tolist()])
+
+
+class _PercentFromExtreme(_Feature):
+    def __init__(self, name: str, column: str, window: int, min_periods: int, maximum: bool):
+        super().__init__(name, [column])
+        self.window = window
+        self.min_periods = min_periods
+        self.maximum = maximum
+
+    def new_state(self):
+        return _RollingExtreme(self.window, self.min_periods, self.maximum)
+
+    def update(self, state, values):
+        extremes = np.array([state.update(value) for value in _without_inf(values).tolist()])
+        return values / extremes - 1
+
+
+class _RollingZscore(_Feature):
+    def __init__(self, name: str, column: str, window: int, min_periods: int):
+        super().__init__(name, [column])
+        self.window = window
+        self.min_periods = min_periods
+
+    def new_state(self):
+        return _RollingMean(self.window, self.min_periods), _RollingVar(self.window, self.min_periods, ddof=0)
+
+    def update(self, state, values):
+        mean, var = state
+        moments = np.array([(mean.update(value), var.update(value)) for value in _without_inf(values).tolist()])
+        return (values - moments[:, 0]) / np.sqrt(moments[:, 1])
+
+
+class _RollingBeta(_Feature):
+    """Beta of the percent changes of `column` against those of `benchmark_column`, computed like
+    `FeatureTransform.rolling_beta`: the rolling covariance of the jointly observed returns (from rolling means
+    of x * y, x and y) over the rolling variance of all benchmark returns."""
+
+    def __init__(self, name: str, column: str, benchmark_column: str, window: int, min_periods: int):
+        super().__init__(name, [column, benchmark_column])
+        self.window = window
+        self.min_periods = min_periods
+
+    def new_state(self):
+        return {
+            'last': (np.nan, np.nan),
+            'mean_xy': _RollingMean(self.window, self.min_periods),
+            'mean_x': _RollingMean(self.window, self.min_periods),
+            'mean_y': _RollingMean(self.window, self.min_periods),
+            'var_y': _RollingVar(self.window, self.min_periods, ddof=1),
+        }
+
+    def update(self, state, prices, benchmark_prices):
+        last, last_benchmark = state['last']
+        returns = prices / np.r_[last, prices[:-1]] - 1
+        benchmark_returns = benchmark_prices / np.r_[last_benchmark, benchmark_prices[:-1]] - 1
+        state['last'] = (prices[-1], benchmark_prices[-1])
+
+        x = _without_inf(returns + 0 * benchmark_returns)
+        y = _without_inf(benchmark_returns + 0 * returns)
+        mean_xy, mean_x, mean_y, var_y = state['mean_xy'], state['mean_x'], state['mean_y'], state['var_y']
+        moments = np.array([
+            (mean_xy.update(xy), mean_xy.nobs, mean_x.update(x_i), mean_y.update(y_i), var_y.update(b_i))
+            for xy, x_i, y_i, b_i in zip((x * y).tolist(), x.tolist(), y.tolist(), _without_inf(benchmark_returns).tolist())
+        ]).reshape(-1, 5)
+        count = moments[:, 1]
+        cov = (moments[:, 0] - moments[:, 2] * moments[:, 3]) * (count / (count - 1))
+        return cov / moments[:, 4]
+
+
+############################################
+# Rolling State
+############################################
+
+class _RollingMean:
+    """Rolling mean over the last `window` values, updated one value at a time the same way as pandas'
+    `rolling().mean()`: Kahan compensated running sums, with the mean of an all-equal window being its value."""
+
+    def __init__(self, window: int, min_periods: int):
+        self.window = window
+        self.min_periods = min_periods
+        self.values = deque(maxlen=window)
+        self.nobs = 0
+
+    def update(self, value: float) -> float:
+        leaving = self.values[0] if len(self.values) == self.window else None
+        self.values.append(value)
+        if len(self.values) == 1 or self.window == 1:
+            # First window (or a window of one value): summed from scratch.
+            self.nobs, self.sum, self.negatives = 0, 0.0, 0
+            self.compensation_add = self.compensation_remove = 0.0
+            self.same, self.previous = 0, self.values[0]
+            for v in self.values:
+                self._add(v)
+        else:
+            if leaving is not None:
+                self._remove(leaving)
+            self._add(value)
+
+        if self.nobs < max(self.min_periods, 1):
+            return np.nan
+        if self.same >= self.nobs:
+            return self.previous
+        mean = self.sum / self.nobs
+        if self.negatives == 0 and mean < 0 or self.negatives == self.nobs and mean > 0:
+            return 0.0
+        return mean
+
+    def _add(self, value: float):
+        if value != value:
+            return
+        self.nobs += 1
+        y = value - self.compensation_add
+        t = self.sum + y
+        self.compensation_add = t - self.sum - y
+        self.sum = t
+        self.negatives += math.copysign(1.0, value) < 0
+        self.same = self.same + 1 if value == self.previous else 1
+        self.previous = value
+
+    def _remove(self, value: float):
+        if value != value:
+            return
+        self.nobs -= 1
+        y = -value - self.compensation_remove
+        t = self.sum + y
+        self.compensation_remove = t - self.sum - y
+        self.sum = t
+        self.negatives -= math.copysign(1.0, value) < 0
+
+
+class _RollingVar:
+    """Rolling variance over the last `window` values with Welford's method, updated one value at a time.
+    An all-equal window has a variance of exactly 0, like in FeatureTransform.rolling_zscore."""
+
+    def __init__(self, window: int, min_periods: int, ddof: int = 1):
+        self.window = window
+        self.min_periods = max(min_periods, 1)
+        self.ddof = ddof
+        self.values = deque(maxlen=window)
+        self.nobs = 0
+
+    def update(self, value: float) -> float:
+        leaving = self.values[0] if len(self.values) == self.window else None
+        self.values.append(value)
+        if len(self.values) == 1 or self.window == 1:
+            self.nobs, self.mean, self.ssqdm = 0, 0.0, 0.0
+            self.compensation_add = self.compensation_remove = 0.0
+            self.same, self.previous = 0, self.values[0]
+            for v in self.values:
+                self._add(v)
+        else:
+            if leaving is not None:
+                self._remove(leaving)
+            self._add(value)
+
+        if self.nobs < self.min_periods or self.nobs <= self.ddof:
+            return np.nan
+        if self.nobs == 1 or self.same >= self.nobs:
+            return 0.0
+        return max(self.ssqdm / (self.nobs - self.ddof), 0.0)
+
+    def _add(self, value: float):
+        if value != value:
+            return
+        self.nobs += 1
+        self.same = self.same + 1 if value == self.previous else 1
+        self.previous = value
+        previous_mean = self.mean - self.compensation_add
+        y = value - self.compensation_add
+        t = y - self.mean
+        self.compensation_add = t + self.mean - y
+        self.mean += t / self.nobs
+        self.ssqdm += (value - previous_mean) * (value - self.mean)
+
+    def _remove(self, value: float):
+        if value != value:
+            return
+        self.nobs -= 1
+        if self.nobs == 0:
+            self.mean, self.ssqdm = 0.0, 0.0
+            return
+        previous_mean = self.mean - self.compensation_remove
+        y = value - self.compensation_remove
+        t = y - self.mean
+        self.compensation_remove = t + self.mean - y
+        self.mean -= t / self.nobs
+        self.ssqdm -= (value - previous_mean) * (value - self.mean)
+
+
+class _RollingExtreme:
+    """Rolling max (or min) over the last `window` values with a monotonic deque of (position, value)."""
+
+    def __init__(self, window: int, min_periods: int, maximum: bool = True):
+        self.window = window
+        self.min_periods = min_periods
+        self.sign = 1.0 if maximum else -1.0
+        self.values = deque(maxlen=window)
+        self.candidates = deque()
+        self.position = -1
+        self.nobs = 0
+
+    def update(self, value: float) -> float:
+        self.position += 1
+        if len(self.values) == self.window and self.values[0] == self.values[0]:
+            self.nobs -= 1
+        self.values.append(value)
+        while self.candidates and self.candidates[0][0] <= self.position - self.window:
+            self.candidates.popleft()
+        if value == value:
+            self.nobs += 1
+            while self.candidates and self.sign * self.candidates[-1][1] <= self.sign * value:
+                self.candidates.pop()
+            self.candidates.append((self.position, value))
+        if self.nobs < self.min_periods or not self.candidates:
+            return np.nan
+        return self.candidates[0][1]
+
+
+class _Ewm:
+    """Exponentially weighted mean updated one value at a time the same way as pandas' `ewm().mean()`
+    (with `ignore_na=False`)."""
+
+    def __init__(self, com: float, min_periods: int, adjust: bool):
+        alpha = 1. / (1. + com)
+        self.com = com
+        self.old_wt_factor = 1. - alpha
+        self.new_wt = 1. if adjust else alpha
+        self.adjust = adjust
+        self.min_periods = max(int(min_periods), 1)
+        self.weighted = None
+        self.old_wt = 1.
+        self.nobs = 0
+
+    def update(self, value: float) -> float:
+        is_observation = value == value
+        self.nobs += is_observation
+        if self.weighted is None:
+            self.weighted = value
+        elif self.weighted == self.weighted:
+            self.old_wt *= self.old_wt_factor
+            if is_observation:
+                if self.weighted != value:
+                    new_wt = self.new_wt
+                    if not self.adjust and self.com == 1:
+                        # pandas' weights for unevenly spaced observations, which it also applies here.
+                        new_wt = 1. - self.old_wt
+                    self.weighted = (self.old_wt * self.weighted + new_wt * value) / (self.old_wt + new_wt)
+                self.old_wt = self.old_wt + self.new_wt if self.adjust else 1.
+        elif is_observation:
+            self.weighted = value
+        return self.weighted if self.nobs >= self.min_periods else np.nan
+
+
+############################################
+# Pipeline Graph
+############################################
+
+class _Node:
+    """One step of a FeaturePipeline: `function(data, *results of deps)` computes a value in group order."""
+
+    def __init__(self, label: str, function, deps: Tuple):
+        self.label = label
+        self.function = function
+        self.deps = deps
+
+
+class _FeatureGraph:
+    """Builds the nodes of a FeaturePipeline. Every method adds the node for one intermediate or feature,
+    unless a node with the same key already exists, and returns its key. Nodes are added after their
+    dependencies, so the insertion order of `nodes` is an evaluation order.
+    """
+
+    def __init__(self, group_column: str):
+        self.group_column = group_column
+        self.nodes = {}
+        self.extreme_windows = {}
+
+    def _add(self, key: Tuple, label: str, function, *deps: Tuple) -> Tuple:
+        if key not in self.nodes:
+            self.nodes[key] = _Node(label, function, deps)
+        return key
+
+    def _label(self, key: Tuple) -> str:
+        return self.nodes[key].label
+
+    ############################################
+    # Intermediates
+    ############################################
+
+    def group_order(self) -> Tuple:
+        def function(data):
+            order, starts = FeatureTransform._get_group_order(data[self.group_column])
+            return order, starts, np.diff(np.r_[starts, len(order)])
+        return self._add(('group_order',), f'group_order({self.group_column})', function)
+
+    def column(self, column: str) -> Tuple:
+        def function(data, group):
+            return np.take(data[column].to_numpy(dtype=np.float64), group[0])
+        return self._add(('column', column), f'column({column})', function, self.group_order())
+
+    def returns(self, column: str) -> Tuple:
+        def function(data, group, values):
+            # Like `pct_change` per group: the first row of every group has no return.
+            returns = np.empty_like(values)
+            returns[1:] = values[1:] / values[:-1] - 1
+            returns[group[1]] = np.nan
+            return returns
+        return self._add(('returns', column), f'returns({column})', function, self.group_order(), self.column(column))
+
+    def rolling_moments(self, input_key: Tuple, window: int, min_periods: int) -> Tuple:
+        def function(data, group, values):
+            # Like `rolling`, infinite values count as missing.
+            values = np.where(np.isinf(values), np.nan, values)[None, :]
+            return FeatureTransform._grouped_rolling_moments(values, group[1], window, min_periods)
+        label = f'rolling_moments({self._label(input_key)}, {window}, {min_periods})'
+        return self._add(('rolling_moments', input_key, window, min_periods), label, function, self.group_order(), input_key)
+
+    def rolling_cov(self, x_key: Tuple, y_key: Tuple, window: int, min_periods: int) -> Tuple:
+        def function(data, group, x, y):
+            # Like `Rolling.cov`, only rows where both have an observation are used, centered on each group's
+            # mean to keep the sums precise.
+            _, starts, lengths = group
+            valid = np.isfinite(x) & np.isfinite(y)
+            if len(x):
+                xy = np.where(valid, np.vstack([x, y]), 0.0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    center = np.add.reduceat(xy, starts, axis=1) / np.add.reduceat(valid, starts)
+                xy = np.where(valid, xy - np.repeat(center, lengths, axis=1), 0.0)
+                x, y = xy
+            count, sum_x, sum_y, sum_xy = FeatureTransform._grouped_window_sum(
+                np.vstack([valid, x, y, x * y]), starts, lengths, window
+            ) if len(x) else np.zeros((4, 0))
+            cov = (sum_xy - sum_x * sum_y / count) / (count - 1)
+            cov[(count < max(min_periods, 1)) | (count < 2)] = np.nan
+            return cov
+        label = f'rolling_cov({self._label(x_key)}, {self._label(y_key)}, {window}, {min_periods})'
+        return self._add(('rolling_cov', x_key, y_key, window, min_periods), label, function, self.group_order(), x_key, y_key)
+
+    def trailing_extremes(self, column: str) -> Tuple:
+        windows = sorted(self.extreme_windows[column])
+
+        def function(data, group, values):
+            order, starts, lengths = group
+            position = np.arange(len(order)) - np.repeat(starts, lengths)
+            valid = np.isfinite(values)[None, :]
+            extremes = {}
+            for sign in (1.0, -1.0):
+                filled = np.where(valid, sign * values, -np.inf)
+                for window, (extreme, _) in zip(windows, FeatureTransform._grouped_rolling_max(filled, position, windows)):
+                    extremes[window, sign] = sign * extreme[0]
+            counts = {
+                window: FeatureTransform._grouped_window_sum(valid.astype(np.float64), starts, lengths, window)[0]
+                if len(order) else np.zeros(0) for window in windows
+            }
+            return extremes, counts
+        label = f'trailing_extremes({column}, {windows})'
+        return self._add(('trailing_extremes', column), label, function, self.group_order(), self.column(column))
+
+    ############################################
+    # Features
+    ############################################
+
+    def sma(self, column: str, window: int, min_periods: int) -> Tuple:
+        return self._add(('sma', column, window, min_periods), f'sma({column}, {window}, {min_periods})',
+                         lambda data, moments: moments[0][0], self.rolling_moments(self.column(column), window, min_periods))
+
+    def rolling_zscore(self, column: str, window: int, min_periods: int) -> Tuple:
+        def function(data, values, moments):
+            mean, var, _ = moments
+            return (values - mean[0]) / np.sqrt(var[0])
+        label = f'rolling_zscore({column}, {window}, {min_periods})'
+        return self._add(('rolling_zscore', column, window, min_periods), label, function,
+                         self.column(column), self.rolling_moments(self.column(column), window, min_periods))
+
+    def rolling_beta(self, column: str, benchmark_column: str, window: int, min_periods: int) -> Tuple:
+        def function(data, cov, moments):
+            _, var, count = moments
+            # Sample variance, which is exactly zero for an all-equal window like the covariance with it.
+            var = var[0] * count[0] / (count[0] - 1)
+            var[count[0] < 2] = np.nan
+            return np.where(var == 0, cov * 0.0, cov) / var
+        label = f'rolling_beta({column}, {benchmark_column}, {window}, {min_periods})'
+        benchmark_returns = self.returns(benchmark_column)
+        return self._add(('rolling_beta', column, benchmark_column, window, min_periods), label, function,
+                         self.rolling_cov(self.returns(column), benchmark_returns, window, min_periods),
+                         self.rolling_moments(benchmark_returns, window, min_periods))
+
+    def percent_from_trailing(self, column: str, window: int, min_periods: int, sign: float) -> Tuple:
+        def function(data, values, trailing):
+            extremes, counts = trailing
+            extreme = np.where(counts[window] < max(min_periods, 1), np.nan, extremes[window, sign])
+            return values / extreme - 1
+        label = f"percent_from_trailing_{'max' if sign > 0 else 'min'}({column}, {window}, {min_periods})"
+        return self._add(('percent_from_trailing', column, window, min_periods, sign), label, function,
+                         self.column(column), self.trailing_extremes(column))
+
+    def ema(self, column: str, decay: Tuple[str, float], adjust: bool, min_periods: int) -> Tuple:
+        def function(data, group, values):
+            order, starts, lengths = group
+            # The grouped EWM runs over every group in one call, and keeps the (sorted) row order.
+            codes = np.repeat(np.arange(len(starts)), lengths)
+            ewm = pd.Series(values).groupby(codes, sort=False).ewm(min_periods=min_periods, adjust=adjust, **dict([decay]))
+            return ewm.mean().to_numpy()
+        label = f'ema({column}, {decay[0]}={decay[1]}, adjust={adjust}, {min_periods})'
+        return self._add(('ema', column, decay, adjust, min_periods), label, function, self.group_order(), self.column(column))
+
+
+############################################
+# Shards
+############################################
+
+class _SharedArray:
+    """A numpy array in a block of shared memory, which is freed when the `with` block exits. Other processes
+    map it from `spec` (see `_attach`)."""
+
+    def __init__(self, shape: Tuple[int, ...], dtype):
+        dtype = np.dtype(dtype)
+        # Shared memory blocks can not be empty.
+        self.memory = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf)
+        self.spec = (self.memory.name, shape, dtype.str)
+
+    def __enter__(self) -> '_SharedArray':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        del self.array
+        self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            # Views of the block are still referenced from the traceback of an exception; the mapping goes with them.
+            pass
+
+
+def _run_shard(
+    pipeline: FeaturePipeline, inputs: List[str], values: np.ndarray, codes: np.ndarray, out: np.ndarray, lo: int, hi: int
+) -> pd.Series:
+    """Runs the pipeline on rows lo:hi of the shared blocks, writes the features to `out`, and returns its timings."""
+    shard = pd.DataFrame({pipeline.group_column: codes[lo:hi]}, copy=False)
+    for i, col in enumerate(inputs):
+        shard[col] = values[i, lo:hi]
+    out[:, lo:hi] = pipeline.run(shard, out.dtype).to_numpy().T
+    return pipeline.timings
+
+
+def _run_shared_shard(
+    pipeline: FeaturePipeline, inputs: List[str], values_spec: Tuple, codes_spec: Tuple, out_spec: Tuple, lo: int, hi: int
+) -> pd.Series:
+    """`_run_shard` in a worker process, on the shared blocks of the parent."""
+    memories = [SharedMemory(name=spec[0]) for spec in (values_spec, codes_spec, out_spec)]
+    arrays = [np.ndarray(spec[1], dtype=spec[2], buffer=memory.buf)
+              for spec, memory in zip((values_spec, codes_spec, out_spec), memories)]
+    timings = _run_shard(pipeline, inputs, *arrays, lo, hi)
+    del arrays
+    for memory in memories:
+        memory.close()
+    return timings
@@ -1,7 +1,8 @@
+import sys
 import unittest
 import pandas as pd
 import numpy as np
-from feature_transform import FeatureTransform
+from feature_transform import FeaturePipeline, FeatureTransform, IncrementalFeatureTransform, ShardedFeaturePipeline
 
 class TestFeatureTransform(unittest.TestCase):
 
@@ -248,6 +249,633 @@ class TestFeatureTransform(unittest.TestCase):
             FeatureTransform.ema(self.sample_series, 20, 1.1)
 
 
+
+def make_panel(n_tickers: int = 20, n_dates: int = 120, seed: int = 0) -> pd.DataFrame:
+    """Builds a synthetic long format panel with missing values and flat stretches."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2020-01-01", periods=n_dates)
+    n = n_tickers * n_dates
+    data = pd.DataFrame({
+        'ticker': np.repeat([f"T{i}" for i in range(n_tickers)], n_dates),
+        'c': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n))),
+        'volume': rng.integers(100_000, 10_000_000, n).astype(float),
+        'flag': rng.integers(0, 3, n),
+    }, index=np.tile(dates, n_tickers))
+    data.loc[rng.random(n) < 0.05, 'c'] = np.nan
+    data.iloc[5:40, data.columns.get_loc('flag')] = 1
+    # Interleave the tickers on every date, like the long format sample in FeatureTransform.
+    return data.sample(frac=1, random_state=seed).sort_index(kind='stable')
+
+
+class TestFeatureTransformPanel(unittest.TestCase):
+
+    """
+    Tests of the grouped DataFrame methods against their pandas reference engines on a synthetic panel:
+        python -m pytest test_feature_transform.py -k Panel
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.panel = make_panel()
+
+    ############################################
+    # Tests for rolling_beta_matrix
+    ############################################
+
+    def make_prices(self):
+        prices = self.panel.reset_index().pivot(index='index', columns='ticker', values='c')
+        rng = np.random.default_rng(3)
+        benchmark = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(prices)))), index=prices.index)
+        return prices, benchmark
+
+    # Test rolling_beta_matrix matches rolling_beta on every column
+    def test_rolling_beta_matrix_valid_input(self):
+        prices, benchmark = self.make_prices()
+        for window, min_window_pct in [(20, 0.8), (1, 0.8), (5, 0), (20, 1), (1000, 0.5)]:
+            expected = pd.DataFrame({
+                col: FeatureTransform.rolling_beta(prices[col], benchmark, window, min_window_pct) for col in prices
+            })
+            result = FeatureTransform.rolling_beta_matrix(prices, benchmark, window, min_window_pct)
+            pd.testing.assert_frame_equal(result, expected, rtol=1e-7, check_names=False)
+
+    # Test edge cases for rolling_beta_matrix
+    def test_rolling_beta_matrix_edge_cases(self):
+        prices, benchmark = self.make_prices()
+        # A flat benchmark has no variance, so its betas are NaN
+        benchmark.iloc[50:80] = benchmark.iloc[49]
+        prices.iloc[:, 0] = np.nan
+        expected = pd.DataFrame({col: FeatureTransform.rolling_beta(prices[col], benchmark, 20) for col in prices})
+        result = FeatureTransform.rolling_beta_matrix(prices, benchmark, 20)
+        pd.testing.assert_frame_equal(result, expected, rtol=1e-7, check_names=False)
+        self.assertTrue(result.iloc[70:80].isna().all().all())
+
+        # Empty frame
+        result = FeatureTransform.rolling_beta_matrix(prices.iloc[:0], benchmark.iloc[:0], 20)
+        self.assertEqual(result.shape, (0, prices.shape[1]))
+
+    # Test invalid input for rolling_beta_matrix
+    def test_rolling_beta_matrix_invalid_input(self):
+        prices, benchmark = self.make_prices()
+        with self.assertRaises(AssertionError):
+            FeatureTransform.rolling_beta_matrix(prices, benchmark, 0)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.rolling_beta_matrix(prices, benchmark, 20, 1.1)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.rolling_beta_matrix(prices, benchmark.iloc[1:], 20)
+
+
+    ############################################
+    # Tests for percent_from_trailing_extremes
+    ############################################
+
+    # Test percent_from_trailing_extremes matches the grouped single window methods
+    def test_trailing_extremes_valid_input(self):
+        windows = [1, 2, 5, 21, 63, 200]
+        for min_window_pct in [0.8, 0, 1]:
+            result = FeatureTransform.percent_from_trailing_extremes(
+                self.panel, windows, min_window_pct, columns=['c', 'flag'], inplace=False
+            )
+            for col in ['c', 'flag']:
+                grouped = self.panel.groupby('ticker')[col]
+                for window in windows:
+                    for feature, method in [('max', FeatureTransform.percent_from_trailing_max),
+                                            ('min', FeatureTransform.percent_from_trailing_min)]:
+                        expected = grouped.transform(lambda s: method(s, window, min_window_pct))
+                        pd.testing.assert_series_equal(
+                            result[f'{col}_pct_from_{feature}_{window}'], expected, check_names=False
+                        )
+
+    # Test the days since the trailing max and min count back to their most recent occurrence
+    def test_trailing_extremes_days_since(self):
+        data = pd.DataFrame({
+            'ticker': ['A', 'B', 'A', 'B', 'A', 'B', 'A', 'B', 'A'],
+            'c': [3.0, 1.0, 1.0, np.inf, 3.0, 2.0, np.nan, 0.0, 2.0],
+        })
+        result = FeatureTransform.percent_from_trailing_extremes(data, [3], 0.5, inplace=False)
+        # A: 3, 1, 3, NaN, 2 and B: 1, inf, 2, 0, with at least 2 observations per window
+        np.testing.assert_array_equal(result['c_days_since_max_3'], [np.nan, np.nan, 1, np.nan, 0, 0, 1, 1, 2])
+        np.testing.assert_array_equal(result['c_days_since_min_3'], [np.nan, np.nan, 0, np.nan, 1, 2, 2, 0, 0])
+        np.testing.assert_allclose(result['c_pct_from_max_3'], [np.nan, np.nan, -2 / 3, np.nan, 0, 0, np.nan, -1, -1 / 3])
+
+    # Test edge cases for percent_from_trailing_extremes
+    def test_trailing_extremes_edge_cases(self):
+        # Rows without a ticker are left out of every window
+        data = self.panel.copy()
+        data.iloc[:3, data.columns.get_loc('ticker')] = None
+        result = FeatureTransform.percent_from_trailing_extremes(data, [20], columns=['c'], inplace=False)
+        expected = data.groupby('ticker')['c'].transform(lambda s: FeatureTransform.percent_from_trailing_max(s, 20))
+        pd.testing.assert_series_equal(result['c_pct_from_max_20'], expected, check_names=False)
+        self.assertTrue(result.iloc[:3]['c_days_since_max_20'].isna().all())
+
+        # Empty frame
+        result = FeatureTransform.percent_from_trailing_extremes(self.panel.iloc[:0], [20], columns=['c'], inplace=False)
+        self.assertIn('c_days_since_min_20', result.columns)
+        self.assertEqual(len(result), 0)
+
+        # inplace=False leaves the input untouched
+        FeatureTransform.percent_from_trailing_extremes(self.panel, [20], inplace=False)
+        self.assertNotIn('c_pct_from_max_20', self.panel.columns)
+
+    # Test invalid input for percent_from_trailing_extremes
+    def test_trailing_extremes_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            FeatureTransform.percent_from_trailing_extremes(self.panel, [], inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.percent_from_trailing_extremes(self.panel, [20, 0], inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.percent_from_trailing_extremes(self.panel, [20], 1.1, inplace=False)
+
+
+    ############################################
+    # Tests for moving_averages
+    ############################################
+
+    # Test moving_averages matches the grouped sma and ema of every spec
+    def test_moving_averages_valid_input(self):
+        specs = [
+            ('c', 'ema', 12), ('c', 'ema', 26, {'adjust': True}), ('c', 'ema', 1), ('c', 'sma', 20), ('c', 'sma', 200),
+            ('volume', 'sma', 1), ('volume', 'ema', 5, {'halflife': 2.5}), ('volume', 'ema', 9, {'span': 3}),
+            ('flag', 'ema', 7, {'com': 0.5, 'adjust': True}), ('flag', 'sma', 3),
+        ]
+        for min_window_pct in [0.8, 0, 1]:
+            result = FeatureTransform.moving_averages(self.panel, specs, min_window_pct, inplace=False)
+            for col, kind, window, *options in specs:
+                method = FeatureTransform.sma if kind == 'sma' else FeatureTransform.ema
+                kwargs = options[0] if options else {}
+                expected = self.panel.groupby('ticker')[col].transform(
+                    lambda s: method(s, window, min_window_pct, **kwargs)
+                )
+                pd.testing.assert_series_equal(result[f'{col}_{kind}_{window}'], expected, rtol=1e-9, check_names=False)
+
+    # Test edge cases for moving_averages
+    def test_moving_averages_edge_cases(self):
+        # Rows without a ticker are left out, an all-missing ticker has no averages, and EMAs skip infinite values
+        data = self.panel.copy()
+        data.iloc[:3, data.columns.get_loc('ticker')] = None
+        data.loc[data['ticker'] == 'T1', 'c'] = np.nan
+        data.iloc[10, data.columns.get_loc('c')] = np.inf
+        result = FeatureTransform.moving_averages(data, [('c', 'ema', 10), ('c', 'sma', 10)], inplace=False)
+        expected = data.groupby('ticker')['c'].transform(lambda s: FeatureTransform.ema(s, 10))
+        pd.testing.assert_series_equal(result['c_ema_10'], expected, rtol=1e-9, check_names=False)
+        self.assertTrue(result.iloc[:3][['c_ema_10', 'c_sma_10']].isna().all().all())
+        self.assertTrue(result.loc[data['ticker'] == 'T1', 'c_sma_10'].isna().all())
+
+        # Empty frame
+        result = FeatureTransform.moving_averages(self.panel.iloc[:0], [('c', 'sma', 20)], inplace=False)
+        self.assertIn('c_sma_20', result.columns)
+        self.assertEqual(len(result), 0)
+
+        # inplace=False leaves the input untouched
+        FeatureTransform.moving_averages(self.panel, [('c', 'sma', 20)], inplace=False)
+        self.assertNotIn('c_sma_20', self.panel.columns)
+
+    # Test invalid input for moving_averages
+    def test_moving_averages_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            FeatureTransform.moving_averages(self.panel, [], inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.moving_averages(self.panel, [('c', 'wma', 20)], inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.moving_averages(self.panel, [('c', 'sma', 0)], inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.moving_averages(self.panel, [('c', 'sma', 20, {'span': 5})], inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.moving_averages(self.panel, [('c', 'ema', 20), ('c', 'ema', 20, {'adjust': True})], inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.moving_averages(self.panel, [('c', 'sma', 20)], 1.1, inplace=False)
+
+
+    ############################################
+    # Tests for rolling_zscore
+    ############################################
+
+    # Test the numpy engine matches the pandas engine
+    def test_rolling_zscore_engines_match(self):
+        for window, min_window_pct in [(20, 0.8), (1, 0.8), (1000, 0.8), (20, 0), (20, 1), (5, 0.5)]:
+            expected = FeatureTransform.rolling_zscore(self.panel, window, min_window_pct, inplace=False, engine='pandas')
+            result = FeatureTransform.rolling_zscore(self.panel, window, min_window_pct, inplace=False, engine='numpy')
+            pd.testing.assert_frame_equal(result, expected, rtol=1e-7)
+
+    # Test edge cases for rolling_zscore
+    def test_rolling_zscore_edge_cases(self):
+        # Rows without a ticker are left out of every window
+        data = self.panel.copy()
+        data.iloc[:3, data.columns.get_loc('ticker')] = None
+        expected = FeatureTransform.rolling_zscore(data, 20, inplace=False, engine='pandas')
+        result = FeatureTransform.rolling_zscore(data, 20, inplace=False)
+        pd.testing.assert_frame_equal(result, expected, rtol=1e-7)
+
+        # Empty frame
+        result = FeatureTransform.rolling_zscore(self.panel.iloc[:0], 20, inplace=False)
+        self.assertIn('c_r_zscore', result.columns)
+        self.assertEqual(len(result), 0)
+
+        # inplace=False leaves the input untouched
+        FeatureTransform.rolling_zscore(self.panel, 20, inplace=False)
+        self.assertNotIn('c_r_zscore', self.panel.columns)
+
+    # Test invalid input for rolling_zscore
+    def test_rolling_zscore_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            FeatureTransform.rolling_zscore(self.panel, 0, inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.rolling_zscore(self.panel, 20, 1.1, inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.rolling_zscore(self.panel, 20, inplace=False, engine='numba')
+
+
+    ############################################
+    # Tests for cross_sectional_zscore
+    ############################################
+
+    # Test the numpy engine matches the pandas engine
+    def test_cross_sectional_zscore_engines_match(self):
+        # Drop some rows so that the cross-sections have different sizes
+        data = self.panel.iloc[np.random.default_rng(1).random(len(self.panel)) > 0.2]
+        for min_window_pct in [0.8, 0, 0.5, 1]:
+            expected = FeatureTransform.cross_sectional_zscore(data, min_window_pct, inplace=False, engine='pandas')
+            result = FeatureTransform.cross_sectional_zscore(data, min_window_pct, inplace=False, engine='numpy')
+            pd.testing.assert_frame_equal(result, expected, rtol=1e-9)
+
+    # Test min_window_pct is the minimum observed fraction of each cross-section
+    def test_cross_sectional_zscore_min_window_pct(self):
+        data = pd.DataFrame(
+            {'ticker': ['A', 'B', 'C', 'A', 'B', 'C'], 'c': [1.0, 2.0, np.nan, 1.0, 2.0, 3.0]},
+            index=pd.to_datetime(['2023-01-02'] * 3 + ['2023-01-03'] * 3),
+        )
+        result = FeatureTransform.cross_sectional_zscore(data, 0.8, inplace=False)
+        self.assertTrue(result['c_zscore'].iloc[:3].isna().all())
+        np.testing.assert_allclose(result['c_zscore'].iloc[3:], [-1.224744871391589, 0.0, 1.224744871391589])
+
+        result = FeatureTransform.cross_sectional_zscore(data, 0.5, inplace=False)
+        np.testing.assert_allclose(result['c_zscore'].iloc[:2], [-1.0, 1.0])
+
+    # Test invalid input for cross_sectional_zscore
+    def test_cross_sectional_zscore_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            FeatureTransform.cross_sectional_zscore(self.panel, -0.1, inplace=False)
+        with self.assertRaises(AssertionError):
+            FeatureTransform.cross_sectional_zscore(self.panel, 0.8, inplace=False, engine='numba')
+
+
+    ############################################
+    # Tests for compact mode
+    ############################################
+
+    def compact_cases(self):
+        """(name, function of (data, inplace, dtype)) of every method that takes a dtype."""
+        return [
+            ('rolling_zscore', lambda data, inplace, dtype: FeatureTransform.rolling_zscore(
+                data, 20, inplace=inplace, dtype=dtype)),
+            ('cross_sectional_zscore', lambda data, inplace, dtype: FeatureTransform.cross_sectional_zscore(
+                data.drop(columns='ticker'), inplace=inplace, dtype=dtype)),
+            ('percent_from_trailing_extremes', lambda data, inplace, dtype: FeatureTransform.percent_from_trailing_extremes(
+                data, [5, 20], columns=['c'], inplace=inplace, dtype=dtype)),
+            ('moving_averages', lambda data, inplace, dtype: FeatureTransform.moving_averages(
+                data, [('c', 'sma', 20), ('volume', 'ema', 10)], inplace=inplace, dtype=dtype)),
+        ]
+
+    # Test compact mode writes float32 features that match the float64 ones
+    def test_compact_float32_output(self):
+        compact = FeatureTransform.compact(self.panel)
+        self.assertIsInstance(compact['ticker'].dtype, pd.CategoricalDtype)
+        self.assertNotIsInstance(self.panel['ticker'].dtype, pd.CategoricalDtype)
+
+        for name, function in self.compact_cases():
+            with self.subTest(name):
+                expected = function(self.panel, False, np.float64)
+                result = function(compact, False, np.float32)
+                features = [col for col in expected.columns if col not in self.panel.columns]
+                self.assertGreater(len(features), 0)
+                self.assertEqual(list(result.columns), list(expected.columns))
+                for col in features:
+                    self.assertEqual(result[col].dtype, np.float32, col)
+                    np.testing.assert_allclose(result[col].to_numpy(np.float64), expected[col].to_numpy(), rtol=1e-5,
+                                               atol=1e-5, err_msg=col)
+                # The input columns keep their dtypes.
+                for col in ['c', 'volume', 'flag']:
+                    self.assertEqual(result[col].dtype, self.panel[col].dtype)
+
+    # Test inplace=False leaves the caller's frame untouched in compact mode
+    def test_compact_inplace_false(self):
+        panel = self.panel.copy()
+        compact = FeatureTransform.compact(panel)
+        expected_panel, expected_compact = panel.copy(deep=True), compact.copy(deep=True)
+
+        for name, function in self.compact_cases():
+            with self.subTest(name):
+                result = function(compact, False, np.float32)
+                pd.testing.assert_frame_equal(compact, expected_compact)
+                # The result shares the input columns without copying them, but writing to it does not reach them.
+                result.iloc[0, result.columns.get_loc('c')] = -1.0
+                pd.testing.assert_frame_equal(compact, expected_compact)
+        pd.testing.assert_frame_equal(panel, expected_panel)
+
+        # inplace=True adds float32 columns to the caller's frame.
+        FeatureTransform.rolling_zscore(compact, 20, dtype=np.float32)
+        self.assertEqual(compact['c_r_zscore'].dtype, np.float32)
+        pd.testing.assert_frame_equal(panel, expected_panel)
+
+
+class TestIncrementalFeatureTransform(unittest.TestCase):
+
+    """
+    Tests of IncrementalFeatureTransform against the batch methods applied to each ticker's full history:
+        python -m pytest test_feature_transform.py -k Incremental
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.panel = make_panel()
+        dates = cls.panel.index.unique()
+        benchmark = pd.Series(100 * np.exp(np.cumsum(np.random.default_rng(2).normal(0, 0.01, len(dates)))), index=dates)
+        cls.panel['benchmark'] = benchmark.reindex(cls.panel.index).to_numpy()
+
+    def update_in_chunks(self, stream: IncrementalFeatureTransform, data: pd.DataFrame, n_chunks: int = 7) -> pd.DataFrame:
+        cuts = np.linspace(0, len(data), n_chunks + 1).astype(int)
+        return pd.concat([stream.update(data.iloc[start:stop]) for start, stop in zip(cuts[:-1], cuts[1:])])
+
+    def batch(self, method, column: str, *args) -> pd.Series:
+        return self.panel.groupby('ticker')[column].transform(lambda series: method(series, *args))
+
+    # Test every feature matches its batch method
+    def test_incremental_matches_batch(self):
+        for min_window_pct in [0.8, 0, 1]:
+            stream = (
+                IncrementalFeatureTransform()
+                .sma('c', 20, min_window_pct)
+                .ema('c', 20, min_window_pct)
+                .ema('volume', 10, min_window_pct, adjust=True)
+                .ema('c', 20, min_window_pct, halflife=5, name='c_ema_halflife')
+                .percent_from_trailing_max('c', 30, min_window_pct)
+                .percent_from_trailing_min('c', 30, min_window_pct)
+                .rolling_beta('c', 'benchmark', 40, min_window_pct)
+                .rolling_zscore(['c', 'volume', 'flag'], 20, min_window_pct)
+            )
+            result = self.update_in_chunks(stream, self.panel)
+
+            expected = {
+                'c_sma_20': self.batch(FeatureTransform.sma, 'c', 20, min_window_pct),
+                'c_ema_20': self.batch(FeatureTransform.ema, 'c', 20, min_window_pct),
+                'volume_ema_10': self.batch(FeatureTransform.ema, 'volume', 10, min_window_pct, True),
+                'c_ema_halflife': self.batch(FeatureTransform.ema, 'c', 20, min_window_pct, False, 5),
+                'c_pct_from_max_30': self.batch(FeatureTransform.percent_from_trailing_max, 'c', 30, min_window_pct),
+                'c_pct_from_min_30': self.batch(FeatureTransform.percent_from_trailing_min, 'c', 30, min_window_pct),
+            }
+            rows = self.panel.reset_index(drop=True).groupby('ticker')
+            expected['c_beta_40'] = pd.concat([
+                FeatureTransform.rolling_beta(group['c'], group['benchmark'], 40, min_window_pct) for _, group in rows
+            ]).sort_index().set_axis(self.panel.index)
+            zscores = FeatureTransform.rolling_zscore(self.panel, 20, min_window_pct, inplace=False, engine='pandas')
+            for col in ['c', 'volume', 'flag']:
+                expected[f'{col}_r_zscore'] = zscores[f'{col}_r_zscore']
+
+            self.assertEqual(list(result.columns), list(expected))
+            for name, series in expected.items():
+                pd.testing.assert_series_equal(result[name], series, rtol=1e-9, check_names=False)
+
+    # Test edge cases for IncrementalFeatureTransform
+    def test_incremental_edge_cases(self):
+        # Rows without a ticker get NaN features and do not change any state
+        data = self.panel.copy()
+        data.iloc[:3, data.columns.get_loc('ticker')] = None
+        stream = IncrementalFeatureTransform().sma('c', 20).rolling_zscore(['c'], 20)
+        result = self.update_in_chunks(stream, data)
+        self.assertTrue(result.iloc[:3].isna().all().all())
+        expected = FeatureTransform.rolling_zscore(data[['ticker', 'c']], 20, inplace=False, engine='pandas')
+        pd.testing.assert_series_equal(result['c_r_zscore'], expected['c_r_zscore'], rtol=1e-9)
+
+        # One row at a time gives the same features as one update
+        stream = IncrementalFeatureTransform().ema('c', 10).percent_from_trailing_max('c', 10)
+        one_update = IncrementalFeatureTransform().ema('c', 10).percent_from_trailing_max('c', 10).update(self.panel.iloc[:200])
+        pd.testing.assert_frame_equal(self.update_in_chunks(stream, self.panel.iloc[:200], 200), one_update)
+
+        # Window of one
+        stream = IncrementalFeatureTransform().sma('c', 1).rolling_zscore(['volume'], 1)
+        result = self.update_in_chunks(stream, self.panel)
+        pd.testing.assert_series_equal(result['c_sma_1'], self.panel['c'], check_names=False)
+        self.assertTrue(result['volume_r_zscore'].isna().all())
+
+    # Test invalid input for IncrementalFeatureTransform
+    def test_incremental_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            IncrementalFeatureTransform().sma('c', 0)
+        with self.assertRaises(AssertionError):
+            IncrementalFeatureTransform().ema('c', 20, 1.1)
+        with self.assertRaises(AssertionError):
+            IncrementalFeatureTransform().update(self.panel)
+        with self.assertRaises(AssertionError):
+            IncrementalFeatureTransform().sma('c', 20).sma('c', 20)
+
+        # Features can not be added once there is state
+        stream = IncrementalFeatureTransform().sma('c', 20)
+        stream.update(self.panel.iloc[:10])
+        with self.assertRaises(AssertionError):
+            stream.ema('c', 20)
+
+
+class TestFeaturePipeline(unittest.TestCase):
+
+    """
+    Tests of FeaturePipeline against the batch methods applied to each ticker:
+        python -m pytest test_feature_transform.py -k Pipeline
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.panel = make_panel()
+        dates = cls.panel.index.unique()
+        benchmark = pd.Series(100 * np.exp(np.cumsum(np.random.default_rng(2).normal(0, 0.01, len(dates)))), index=dates)
+        cls.panel['benchmark'] = benchmark.reindex(cls.panel.index).to_numpy()
+
+    def batch(self, method, column: str, *args) -> pd.Series:
+        return self.panel.groupby('ticker')[column].transform(lambda series: method(series, *args))
+
+    # Test every feature matches its batch method
+    def test_pipeline_matches_batch(self):
+        for min_window_pct in [0.8, 0, 1]:
+            pipeline = (
+                FeaturePipeline()
+                .sma('c', 20, min_window_pct)
+                .ema('c', 20, min_window_pct)
+                .ema('volume', 10, min_window_pct, adjust=True)
+                .ema('c', 20, min_window_pct, halflife=5, name='c_ema_halflife')
+                .percent_from_trailing_max('c', 30, min_window_pct)
+                .percent_from_trailing_min('c', 30, min_window_pct)
+                .percent_from_trailing_max('c', 5, min_window_pct)
+                .rolling_beta('c', 'benchmark', 40, min_window_pct)
+                .rolling_beta('volume', 'benchmark', 40, min_window_pct)
+                .rolling_zscore(['c', 'volume', 'flag'], 20, min_window_pct)
+            )
+            result = pipeline.run(self.panel)
+
+            expected = {
+                'c_sma_20': self.batch(FeatureTransform.sma, 'c', 20, min_window_pct),
+                'c_ema_20': self.batch(FeatureTransform.ema, 'c', 20, min_window_pct),
+                'volume_ema_10': self.batch(FeatureTransform.ema, 'volume', 10, min_window_pct, True),
+                'c_ema_halflife': self.batch(FeatureTransform.ema, 'c', 20, min_window_pct, False, 5),
+                'c_pct_from_max_30': self.batch(FeatureTransform.percent_from_trailing_max, 'c', 30, min_window_pct),
+                'c_pct_from_min_30': self.batch(FeatureTransform.percent_from_trailing_min, 'c', 30, min_window_pct),
+                'c_pct_from_max_5': self.batch(FeatureTransform.percent_from_trailing_max, 'c', 5, min_window_pct),
+            }
+            rows = self.panel.reset_index(drop=True).groupby('ticker')
+            for col in ['c', 'volume']:
+                expected[f'{col}_beta_40'] = pd.concat([
+                    FeatureTransform.rolling_beta(group[col], group['benchmark'], 40, min_window_pct) for _, group in rows
+                ]).sort_index().set_axis(self.panel.index)
+            zscores = FeatureTransform.rolling_zscore(self.panel, 20, min_window_pct, inplace=False, engine='pandas')
+            for col in ['c', 'volume', 'flag']:
+                expected[f'{col}_r_zscore'] = zscores[f'{col}_r_zscore']
+
+            self.assertEqual(set(result.columns), set(expected))
+            for name, series in expected.items():
+                pd.testing.assert_series_equal(result[name], series, rtol=1e-7, check_names=False)
+
+    # Test shared intermediates are computed once, and every node is timed
+    def test_pipeline_shares_intermediates(self):
+        pipeline = (
+            FeaturePipeline()
+            .sma('c', 20)
+            .rolling_zscore(['c'], 20)
+            .rolling_beta('c', 'benchmark', 40)
+            .rolling_beta('volume', 'benchmark', 40)
+            .percent_from_trailing_max('c', 20)
+            .percent_from_trailing_min('c', 60)
+        )
+        pipeline.run(self.panel)
+        nodes = list(pipeline.timings.index)
+        self.assertEqual(len(nodes), len(set(nodes)))
+        self.assertEqual(nodes.count('group_order(ticker)'), 1)
+        self.assertIn('rolling_moments(column(c), 20, 16)', nodes)
+        self.assertIn('rolling_moments(returns(benchmark), 40, 32)', nodes)
+        self.assertIn('trailing_extremes(c, [20, 60])', nodes)
+        self.assertEqual(sum(node.startswith('rolling_moments') for node in nodes), 2)
+        self.assertTrue((pipeline.timings >= 0).all())
+
+    # Test compact mode: float32 features of a categorical ticker column, and the input is left untouched
+    def test_pipeline_compact(self):
+        pipeline = FeaturePipeline().sma('c', 20).ema('volume', 10).rolling_beta('c', 'benchmark', 40).rolling_zscore(['c'], 20)
+        expected = pipeline.run(self.panel)
+        compact = FeatureTransform.compact(self.panel)
+        compact_before = compact.copy(deep=True)
+        result = pipeline.run(compact, dtype=np.float32)
+
+        pd.testing.assert_frame_equal(compact, compact_before)
+        self.assertTrue((result.dtypes == np.float32).all())
+        pd.testing.assert_frame_equal(result.astype(np.float64), expected, rtol=1e-5, atol=1e-5)
+
+    # Test edge cases for FeaturePipeline
+    def test_pipeline_edge_cases(self):
+        # Rows without a ticker get NaN features
+        data = self.panel.copy()
+        data.iloc[:3, data.columns.get_loc('ticker')] = None
+        result = FeaturePipeline().sma('c', 20).rolling_zscore(['c'], 20).run(data)
+        self.assertTrue(result.iloc[:3].isna().all().all())
+        expected = FeatureTransform.rolling_zscore(data[['ticker', 'c']], 20, inplace=False, engine='pandas')
+        pd.testing.assert_series_equal(result['c_r_zscore'], expected['c_r_zscore'], rtol=1e-7)
+
+        # Empty frame
+        result = FeaturePipeline().sma('c', 20).ema('c', 20).rolling_beta('c', 'benchmark', 20).run(self.panel.iloc[:0])
+        self.assertEqual(list(result.columns), ['c_sma_20', 'c_ema_20', 'c_beta_20'])
+        self.assertEqual(len(result), 0)
+
+    # Test invalid input for FeaturePipeline
+    def test_pipeline_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            FeaturePipeline().sma('c', 0)
+        with self.assertRaises(AssertionError):
+            FeaturePipeline().ema('c', 20, 1.1)
+        with self.assertRaises(AssertionError):
+            FeaturePipeline().run(self.panel)
+        with self.assertRaises(AssertionError):
+            FeaturePipeline().sma('c', 20).sma('c', 20)
+
+
+class TestShardedFeaturePipeline(unittest.TestCase):
+
+    """
+    Tests of ShardedFeaturePipeline against FeaturePipeline on the whole panel:
+        python -m pytest test_feature_transform.py -k Sharded
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.panel = make_panel()
+        dates = cls.panel.index.unique()
+        benchmark = pd.Series(100 * np.exp(np.cumsum(np.random.default_rng(2).normal(0, 0.01, len(dates)))), index=dates)
+        cls.panel['benchmark'] = benchmark.reindex(cls.panel.index).to_numpy()
+        # Drop rows at random, so that the tickers have different lengths to balance
+        cls.panel = cls.panel[np.random.default_rng(3).random(len(cls.panel)) < 0.8]
+        cls.pipeline = (
+            FeaturePipeline()
+            .sma('c', 20)
+            .ema('volume', 10, adjust=True)
+            .percent_from_trailing_max('c', 30)
+            .percent_from_trailing_min('c', 5)
+            .rolling_beta('c', 'benchmark', 40)
+            .rolling_zscore(['c', 'volume'], 20)
+        )
+
+    # Test the shards match the whole panel, and the cross-sectional steps run on the merged features
+    def test_sharded_matches_pipeline(self):
+        sharded = ShardedFeaturePipeline(self.pipeline, workers=2, shard_rows=300).cross_sectional_zscore(['c_sma_20', 'volume'])
+        result = sharded.run(self.panel)
+        self.assertEqual(list(result.columns), sharded.columns)
+        self.assertTrue(result.index.equals(self.panel.index))
+
+        expected = self.pipeline.run(self.panel)
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_exact=True)
+        zscores = FeatureTransform.cross_sectional_zscore(
+            pd.DataFrame({'c_sma_20': result['c_sma_20'], 'volume': self.panel['volume']}), inplace=False
+        )
+        for name in ['c_sma_20_zscore', 'volume_zscore']:
+            pd.testing.assert_series_equal(result[name], zscores[name])
+        self.assertIn('group_order(ticker)', sharded.timings.index)
+
+    # Test the features do not depend on the number of workers
+    def test_sharded_identical_across_workers(self):
+        results = [
+            ShardedFeaturePipeline(self.pipeline, workers=workers, shard_rows=500).cross_sectional_zscore(['c_r_zscore']).run(self.panel)
+            for workers in [1, 3]
+        ]
+        pd.testing.assert_frame_equal(results[0], results[1], check_exact=True)
+
+    # Test edge cases for ShardedFeaturePipeline
+    def test_sharded_edge_cases(self):
+        # Rows without a ticker get NaN features
+        data = self.panel.copy()
+        data.iloc[:3, data.columns.get_loc('ticker')] = None
+        result = ShardedFeaturePipeline(self.pipeline, workers=2, shard_rows=400).run(data)
+        self.assertTrue(result.iloc[:3].isna().all().all())
+        pd.testing.assert_frame_equal(result, self.pipeline.run(data), rtol=1e-7)
+
+        # One ticker larger than a shard, and float32 features
+        result = ShardedFeaturePipeline(FeaturePipeline().sma('c', 5), workers=1, shard_rows=10).run(self.panel, np.float32)
+        self.assertEqual(result['c_sma_5'].dtype, np.float32)
+        pd.testing.assert_frame_equal(result, FeaturePipeline().sma('c', 5).run(self.panel, np.float32), rtol=1e-6)
+
+        # Empty frame
+        sharded = ShardedFeaturePipeline(FeaturePipeline().sma('c', 20), workers=2).cross_sectional_zscore(['c_sma_20'])
+        result = sharded.run(self.panel.iloc[:0])
+        self.assertEqual(list(result.columns), ['c_sma_20', 'c_sma_20_zscore'])
+        self.assertEqual(len(result), 0)
+
+    # Test invalid input for ShardedFeaturePipeline
+    def test_sharded_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            ShardedFeaturePipeline(FeaturePipeline(), workers=2).run(self.panel)
+        with self.assertRaises(AssertionError):
+            ShardedFeaturePipeline(self.pipeline, workers=0)
+        with self.assertRaises(AssertionError):
+            ShardedFeaturePipeline(self.pipeline, shard_rows=0)
+        with self.assertRaises(AssertionError):
+            ShardedFeaturePipeline(self.pipeline).cross_sectional_zscore(['c'], 1.1)
+        with self.assertRaises(AssertionError):
+            ShardedFeaturePipeline(self.pipeline).cross_sectional_zscore(['c', 'c'])
+        with self.assertRaises(AssertionError):
+            ShardedFeaturePipeline(self.pipeline, workers=1).cross_sectional_zscore(['ticker']).run(self.panel)
+
+
 if __name__ == '__main__':
     suite = unittest.TestSuite()
 
@@ -282,15 +910,16 @@ if __name__ == '__main__':
 
     if len(sys.argv) > 1:
         group_name = sys.argv[1]
-        if group_name in test_groups:
-            for test in test_groups[group_name]:
-                suite.addTest(TestFeatureTransform(test))
-        else:
+        if group_name not in test_groups:
             print(f"Unknown test group: {group_name}")
             sys.exit(1)
+        groups = [test_groups[group_name]]
     else:
-        for group in test_groups.values():
-            for test in group:
+        groups = test_groups.values()
+    categories = sys.argv[2:3] or ['valid', 'edge', 'invalid']
+    for group in groups:
+        for category in categories:
+            for test in group.get(category, []):
                 suite.addTest(TestFeatureTransform(test))
 
     runner = unittest.TextTestRunner()
@@ -0,0 +1,278 @@
+"""
+Timing and memory instrumentation of the hot paths (data access, queries, feature transforms).
+
+Operations are marked with the `instrumented` decorator or the `timed` context manager, and every call records
+its wall time, the rows it took in and returned, and the peak memory it allocated (with tracemalloc) into the
+process-wide REGISTRY, per operation and per call stack. Instrumentation is off unless the INSTRUMENT environment
+variable is set, and then costs one flag check per call:
+
+    INSTRUMENT=1       count calls and record wall time, rows and peak allocated bytes
+    INSTRUMENT=time    the same without tracemalloc, which slows allocations down
+    INSTRUMENT_OUT=run also write run.json (the stats) and run.folded (stacks for flamegraph.pl or speedscope)
+
+```
+@instrumented(rows_in='data')
+def transform(data): ...
+
+with timed('load', rows_in=len(frame)) as operation:
+    operation.rows_out = write(frame)
+
+report()  # at the end of a run: prints the summary table, and writes INSTRUMENT_OUT files
+```
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+ENV_VAR = 'INSTRUMENT'
+OUT_ENV_VAR = 'INSTRUMENT_OUT'
+
+
+class _Operation:
+    """One running operation. `rows_out` can be set inside a `timed` block."""
+
+    __slots__ = ('name', 'rows_in', 'rows_out', 'start', 'child_seconds', 'start_bytes', 'peak_bytes')
+
+    def __init__(self, name: str, rows_in: Optional[int]):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.child_seconds = 0.0
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self.start = 0.0
+
+
+class _Disabled:
+    """Stands in for an operation when instrumentation is off."""
+
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+class Registry:
+    """
+    Collects the stats of instrumented operations: per operation name, and per call stack (the names of the
+    operations running when it was called, outermost first, in the same thread).
+
+    Peak allocated bytes are the highest memory traced by tracemalloc during the operation, above what was
+    traced when it started. tracemalloc is process-wide, so operations running at the same time in several
+    threads see each other's allocations.
+    """
+
+    def __init__(self, mode: Optional[str] = None):
+        self.enabled = False
+        self.trace_memory = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+        if mode:
+            self.enable(mode)
+
+    def enable(self, mode: str = '1') -> None:
+        """Turns instrumentation on; mode 'time' does not trace memory."""
+        self.trace_memory = mode != 'time'
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        """Drops the stats collected so far."""
+        with self._lock:
+            self.operations = {}
+            self.stacks = {}
+
+    def start(self, name: str, rows_in: Optional[int] = None) -> _Operation:
+        stack = self._stack()
+        operation = _Operation(name, rows_in)
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # The parent's peak so far, before it is reset for this operation.
+                stack[-1].peak_bytes = max(stack[-1].peak_bytes, peak)
+            tracemalloc.reset_peak()
+            operation.start_bytes = operation.peak_bytes = current
+        stack.append(operation)
+        operation.start = time.perf_counter()
+        return operation
+
+    def stop(self, operation: _Operation) -> None:
+        seconds = time.perf_counter() - operation.start
+        stack = self._stack()
+        path = ';'.join(op.name for op in stack)
+        stack.pop()
+        peak_bytes = 0
+        if self.trace_memory:
+            operation.peak_bytes = max(operation.peak_bytes, tracemalloc.get_traced_memory()[1])
+            peak_bytes = operation.peak_bytes - operation.start_bytes
+            tracemalloc.reset_peak()
+        if stack:
+            stack[-1].child_seconds += seconds
+            stack[-1].peak_bytes = max(stack[-1].peak_bytes, operation.peak_bytes)
+
+        self_seconds = seconds - operation.child_seconds
+        with self._lock:
+            stats = self.operations.get(operation.name)
+            if stats is None:
+                stats = self.operations[operation.name] = {
+                    'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0, 'max_seconds': 0.0,
+                    'rows_in': 0, 'rows_out': 0, 'peak_bytes': 0,
+                }
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['self_seconds'] += self_seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['rows_in'] += operation.rows_in or 0
+            stats['rows_out'] += operation.rows_out or 0
+            stats['peak_bytes'] = max(stats['peak_bytes'], peak_bytes)
+            self.stacks[path] = self.stacks.get(path, 0.0) + self_seconds
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    ############################################
+    # Export
+    ############################################
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'operations': {name: dict(stats) for name, stats in self.operations.items()},
+                'stacks': dict(self.stacks),
+            }
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """Gets the stats as JSON, and writes them to `path` if given."""
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_folded(self, path: Optional[str] = None) -> str:
+        """Gets the self time of every call stack in microseconds, one `outer;inner count` line per stack (the
+        folded format of flamegraph.pl, which speedscope also reads), and writes it to `path` if given."""
+        with self._lock:
+            lines = [f'{stack} {int(round(seconds * 1e6))}' for stack, seconds in sorted(self.stacks.items())]
+        text = '\n'.join(lines) + '\n' if lines else ''
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def summary(self) -> str:
+        """Gets a table of the operations, slowest first."""
+        with self._lock:
+            operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        width = max([len('operation')] + [len(name) for name, _ in operations])
+        lines = [f"{'operation':<{width}} {'calls':>8} {'total s':>10} {'self s':>10} {'max s':>9} "
+                 f"{'rows in':>12} {'rows out':>12} {'peak MB':>9}"]
+        for name, stats in operations:
+            lines.append(
+                f"{name:<{width}} {stats['calls']:>8} {stats['seconds']:>10.3f} {stats['self_seconds']:>10.3f} "
+                f"{stats['max_seconds']:>9.3f} {stats['rows_in']:>12,} {stats['rows_out']:>12,} "
+                f"{stats['peak_bytes'] / 2 ** 20:>9.1f}"
+            )
+        return '\n'.join(lines)
+
+
+REGISTRY = Registry(os.environ.get(ENV_VAR) if os.environ.get(ENV_VAR, '0') not in ('', '0') else None)
+
+
+def _rows(value) -> Optional[int]:
+    """Gets the number of rows of a frame, array or sequence, or a count itself."""
+    if isinstance(value, bool) or value is None or isinstance(value, (str, bytes)):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def instrumented(name: Optional[str] = None, rows_in: Optional[str] = None, rows_out: bool = True) -> Callable:
+    """Decorates a function to record its calls as the operation `name` (its qualified name by default).
+
+    Args:
+        name (str, optional): operation name. Defaults to the function's qualified name.
+        rows_in (str, optional): argument whose length is the rows in, e.g. 'data'.
+        rows_out (bool, optional): record the length of the result (or the result, if it is a count) as the
+            rows out. Defaults to True.
+    """
+    def decorator(function):
+        operation_name = name or function.__qualname__
+        position = None
+        if rows_in is not None:
+            code = function.__code__
+            position = code.co_varnames[:code.co_argcount].index(rows_in)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return function(*args, **kwargs)
+            n_in = None
+            if position is not None:
+                n_in = _rows(args[position] if position < len(args) else kwargs.get(rows_in))
+            operation = REGISTRY.start(operation_name, n_in)
+            try:
+                result = function(*args, **kwargs)
+                if rows_out:
+                    operation.rows_out = _rows(result)
+                return result
+            finally:
+                REGISTRY.stop(operation)
+        return wrapper
+    return decorator
+
+
+class timed:
+    """Records a block as the operation `name`. `rows_out` can be set on the operation it returns."""
+
+    def __init__(self, name: str, rows_in: Optional[int] = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.operation = None
+
+    def __enter__(self):
+        if not REGISTRY.enabled:
+            return _DISABLED
+        self.operation = REGISTRY.start(self.name, self.rows_in)
+        return self.operation
+
+    def __exit__(self, *exc_info):
+        if self.operation is not None:
+            REGISTRY.stop(self.operation)
+            self.operation = None
+        return False
+
+
+def report(file=sys.stderr) -> None:
+    """Prints the summary table if instrumentation is on, and writes {INSTRUMENT_OUT}.json and .folded if set."""
+    if not REGISTRY.enabled:
+        return
+    print(REGISTRY.summary(), file=file)
+    out = os.environ.get(OUT_ENV_VAR)
+    if out:
+        REGISTRY.to_json(f'{out}.json')
+        REGISTRY.to_folded(f'{out}.folded')
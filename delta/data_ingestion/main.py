@@ -0,0 +1,73 @@
+"""
+Ingestion entry point: bulk loads daily bars from Polygon or Parquet files into public.prices (see data.loader).
+
+    python main.py polygon --tickers AAPL MSFT --start 2020-01-01 --end 2024-12-31 --dsn postgresql://localhost/delta
+    python main.py parquet "bars/**/*.parquet" --sqlite prices.db --checkpoint parquet.json
+
+Re-running a command with the same --checkpoint skips the units it already loaded.
+"""
+import argparse
+import datetime
+
+from instrumentation import report
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--dsn', help="Postgres connection string (needs psycopg2)")
+    target.add_argument('--sqlite', help="SQLite file standing in for the database, created if needed")
+    parser.add_argument('--method', choices=['copy', 'values'], default=None,
+                        help="copy (Postgres only) or multi-row values upserts; copy for Postgres by default")
+    parser.add_argument('--batch-size', type=int, default=50_000, help="rows per transaction")
+    parser.add_argument('--workers', type=int, default=4, help="parallel writers, each with its own connection")
+    parser.add_argument('--checkpoint', help="file of loaded units, to resume an interrupted load")
+    sources = parser.add_subparsers(dest='source', required=True)
+
+    polygon = sources.add_parser('polygon', help="daily aggregates from Polygon")
+    tickers = polygon.add_mutually_exclusive_group(required=True)
+    tickers.add_argument('--tickers', nargs='+')
+    tickers.add_argument('--tickers-file', help="file with a ticker per line")
+    polygon.add_argument('--start', type=datetime.date.fromisoformat, required=True)
+    polygon.add_argument('--end', type=datetime.date.fromisoformat, required=True)
+    polygon.add_argument('--tickers-per-unit', type=int, default=100)
+    polygon.add_argument('--api-key', help="defaults to the POLYGON_API_KEY environment variable")
+
+    parquet = sources.add_parser('parquet', help="long format bars from Parquet files")
+    parquet.add_argument('patterns', nargs='+', help="files or globs")
+
+    args = parser.parse_args(argv)
+    if args.sqlite and args.method == 'copy':
+        parser.error("--method copy needs Postgres (--dsn)")
+    # Imported once the arguments are valid, so --help and usage errors do not wait for pandas.
+    from data.loader import PriceLoader, connect_sqlite, parquet_units, polygon_units
+
+    if args.sqlite:
+        loader = PriceLoader(lambda: connect_sqlite(args.sqlite), paramstyle="qmark", method="values",
+                             batch_size=args.batch_size, workers=args.workers, checkpoint_path=args.checkpoint)
+    else:
+        import psycopg2
+
+        loader = PriceLoader(lambda: psycopg2.connect(args.dsn), paramstyle="format", method=args.method or "copy",
+                             batch_size=args.batch_size, workers=args.workers, checkpoint_path=args.checkpoint)
+
+    if args.source == 'polygon':
+        from data.polygon.polygon import PolygonClient
+
+        if args.tickers_file:
+            with open(args.tickers_file) as f:
+                args.tickers = [line.strip() for line in f if line.strip()]
+        units = polygon_units(PolygonClient(args.api_key), args.tickers, args.start, args.end,
+                              tickers_per_unit=args.tickers_per_unit)
+    else:
+        units = parquet_units(args.patterns)
+
+    stats = loader.load(units)
+    print(f"loaded {stats['rows']:,} rows from {stats['units']} units ({stats['skipped']} already loaded) "
+          f"in {stats['seconds']:.1f}s, {stats['rows_per_second']:,.0f} rows/s")
+    report()
+    return stats
+
+
+if __name__ == '__main__':
+    main()
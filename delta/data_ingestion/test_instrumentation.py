@@ -0,0 +1,196 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+import instrumentation
+from instrumentation import REGISTRY, instrumented, timed
+
+MB = 2 ** 20
+
+
+@instrumented(name='inner', rows_in='data')
+def inner(data, allocate=0, sleep=0.0):
+    buffer = bytearray(allocate)
+    time.sleep(sleep)
+    del buffer
+    return data[:2]
+
+
+@instrumented(name='outer')
+def outer(before=0, during=0, after=0, inner_allocate=0, sleep=0.0, inner_sleep=0.0):
+    """Allocates and frees `before` bytes, calls inner holding `during` bytes, then allocates `after` bytes."""
+    buffer = bytearray(before)
+    del buffer
+    held = bytearray(during)
+    inner([1, 2, 3], inner_allocate, inner_sleep)
+    del held
+    buffer = bytearray(after)
+    del buffer
+    time.sleep(sleep)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    """
+    Tests of the instrumentation registry, on the process-wide REGISTRY. Run from data_ingestion:
+        python -m unittest test_instrumentation
+    """
+
+    def setUp(self):
+        self.was_enabled, self.was_tracing = REGISTRY.enabled, REGISTRY.trace_memory
+        self.tracemalloc_was_on = tracemalloc.is_tracing()
+        REGISTRY.disable()
+        REGISTRY.reset()
+
+    def tearDown(self):
+        REGISTRY.reset()
+        if not self.tracemalloc_was_on and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        REGISTRY.trace_memory = self.was_tracing
+        REGISTRY.enabled = self.was_enabled
+
+    def assert_between(self, value, low, high):
+        self.assertGreaterEqual(value, low)
+        self.assertLess(value, high)
+
+    ############################################
+    # Tests for peak allocated bytes
+    ############################################
+
+    def test_nested_peak_bytes(self):
+        REGISTRY.enable('1')
+        # The parent holds 1 MB while the child allocates 4 MB: the child's peak is its 4 MB, the parent's both.
+        outer(during=1 * MB, inner_allocate=4 * MB)
+        operations = REGISTRY.operations
+        self.assert_between(operations['inner']['peak_bytes'], 4 * MB, 4 * MB + MB // 4)
+        self.assert_between(operations['outer']['peak_bytes'], 5 * MB, 5 * MB + MB // 4)
+
+        # The parent's own peak before the child and after it count too, the child's does not see them.
+        REGISTRY.reset()
+        outer(before=8 * MB, inner_allocate=1 * MB)
+        self.assert_between(REGISTRY.operations['inner']['peak_bytes'], 1 * MB, 1 * MB + MB // 4)
+        self.assert_between(REGISTRY.operations['outer']['peak_bytes'], 8 * MB, 8 * MB + MB // 4)
+        REGISTRY.reset()
+        outer(after=6 * MB, inner_allocate=2 * MB)
+        self.assert_between(REGISTRY.operations['inner']['peak_bytes'], 2 * MB, 2 * MB + MB // 4)
+        self.assert_between(REGISTRY.operations['outer']['peak_bytes'], 6 * MB, 6 * MB + MB // 4)
+
+        # Memory still held when an operation ends does not lower the next one's peak: each is measured from its
+        # own start.
+        REGISTRY.reset()
+        with timed('hold'):
+            kept = bytearray(3 * MB)
+        with timed('next'):
+            bytearray(1 * MB)
+        del kept
+        self.assert_between(REGISTRY.operations['hold']['peak_bytes'], 3 * MB, 3 * MB + MB // 4)
+        self.assert_between(REGISTRY.operations['next']['peak_bytes'], 1 * MB, 1 * MB + MB // 4)
+
+    def test_time_mode(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        REGISTRY.enable('time')
+        self.assertFalse(tracemalloc.is_tracing())
+        outer(during=1 * MB, inner_allocate=2 * MB, sleep=0.01)
+        self.assertFalse(tracemalloc.is_tracing())
+        for name in ['outer', 'inner']:
+            self.assertEqual(REGISTRY.operations[name]['calls'], 1)
+            self.assertEqual(REGISTRY.operations[name]['peak_bytes'], 0)
+        self.assertGreaterEqual(REGISTRY.operations['outer']['seconds'], 0.01)
+
+    def test_environment(self):
+        # INSTRUMENT picks the mode at import, INSTRUMENT_OUT where report writes the stats.
+        out = os.path.join(tempfile.mkdtemp(), 'run')
+        script = (
+            "from instrumentation import REGISTRY, report, timed\n"
+            "import tracemalloc\n"
+            "with timed('load'):\n"
+            "    pass\n"
+            "print(REGISTRY.enabled, REGISTRY.trace_memory, tracemalloc.is_tracing())\n"
+            "report()\n"
+        )
+        here = os.path.dirname(os.path.abspath(__file__))
+        for mode, expected in [('0', 'False False False'), ('', 'False False False'), ('1', 'True True True'),
+                               ('time', 'True False False')]:
+            env = dict(os.environ, INSTRUMENT=mode, INSTRUMENT_OUT=out)
+            result = subprocess.run([sys.executable, '-c', script], cwd=here, env=env, capture_output=True,
+                                    text=True, check=True)
+            self.assertEqual(result.stdout.strip(), expected)
+            # The summary table is only printed, and the files only written, when instrumentation is on.
+            self.assertEqual('operation' in result.stderr, mode in ('1', 'time'))
+            self.assertEqual(os.path.exists(f'{out}.json'), mode in ('1', 'time'))
+        with open(f'{out}.json') as f:
+            self.assertEqual(json.load(f)['operations']['load']['calls'], 1)
+
+    ############################################
+    # Tests for the recorded stats and exports
+    ############################################
+
+    def test_folded_stacks(self):
+        REGISTRY.enable('time')
+        outer(sleep=0.02, inner_sleep=0.03)
+        outer(sleep=0.02, inner_sleep=0.03)
+        inner([1])
+
+        folded = REGISTRY.to_folded()
+        lines = folded.splitlines()
+        self.assertEqual([line.rsplit(' ', 1)[0] for line in lines], ['inner', 'outer', 'outer;inner'])
+        for line in lines:
+            self.assertRegex(line, r'^[\w;]+ \d+$')
+        micros = {stack: int(count) for stack, count in (line.rsplit(' ', 1) for line in lines)}
+        # Self time: outer's excludes the time inner ran within it.
+        self.assert_between(micros['outer;inner'], 60_000, 90_000)
+        self.assert_between(micros['outer'], 40_000, 60_000)
+        self.assertLess(micros['inner'], 10_000)
+        total = REGISTRY.operations['outer']['seconds'] * 1e6
+        self.assertAlmostEqual(micros['outer'] + micros['outer;inner'], total, delta=len(lines))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            REGISTRY.to_folded(os.path.join(tmp_dir, 'run.folded'))
+            with open(os.path.join(tmp_dir, 'run.folded')) as f:
+                self.assertEqual(f.read(), folded)
+        REGISTRY.reset()
+        self.assertEqual(REGISTRY.to_folded(), '')
+
+    def test_operations(self):
+        REGISTRY.enable('time')
+        outer()
+        outer()
+        with timed('load', rows_in=10) as operation:
+            operation.rows_out = 7
+        stats = json.loads(REGISTRY.to_json())['operations']
+        self.assertEqual((stats['inner']['calls'], stats['inner']['rows_in'], stats['inner']['rows_out']), (2, 6, 4))
+        self.assertEqual((stats['outer']['calls'], stats['outer']['rows_in'], stats['outer']['rows_out']), (2, 0, 0))
+        self.assertEqual((stats['load']['rows_in'], stats['load']['rows_out']), (10, 7))
+        self.assertGreaterEqual(stats['outer']['seconds'], stats['outer']['self_seconds'])
+        summary = REGISTRY.summary().splitlines()
+        self.assertEqual(len(summary), 4)
+        self.assertTrue(summary[0].startswith('operation'))
+
+        # Each thread has its own stack.
+        REGISTRY.reset()
+        with timed('main'):
+            thread = threading.Thread(target=inner, args=([1, 2],))
+            thread.start()
+            thread.join()
+        self.assertEqual(sorted(REGISTRY.stacks), ['inner', 'main'])
+
+    def test_disabled(self):
+        self.assertIs(timed('load').__enter__(), instrumentation._DISABLED)
+        self.assertEqual(inner([1, 2, 3]), [1, 2])
+        outer()
+        self.assertEqual(REGISTRY.to_dict(), {'operations': {}, 'stacks': {}})
+        REGISTRY.enable('time')
+        REGISTRY.disable()
+        outer()
+        self.assertEqual(REGISTRY.operations, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,24 @@
 # driver to connect to SQL server and store csv data per exchange and per asset in ExchangeData folder
+import argparse
 from sql_connection import SQLConnection
 from getData import Database
+from utility.instrumentation import report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--schema-cache', default='.schema_cache.json', help='JSON file caching the table schema')
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
     SQLObject = SQLConnection()
-    connection = SQLObject.create_connection()
-    cursor = connection.cursor()
-    database = Database(cursor)
+    database = Database(SQLObject, cache_path=args.schema_cache)
     print(database.getTables())
 
 
     # connection successful (add operations to read data here)
+
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,194 @@
-import pandas as pd
+# Price charts of each pair: the price on each exchange overlaid, and below it the net spread of buying on one
+# exchange and selling on the other (see spread.py).
+#
+# Ticks are read from the tick store (python ticks.py convert) for the time range of the chart only, and decimated
+# to the pixel width of the chart with M4: the first, last, min and max tick of every pixel column, which draws the
+# same line as every tick at that width, with at most 4 points per pixel instead of millions per line. Charts are
+# written to files without opening a window; with --show, zooming or panning re-reads and re-decimates the visible
+# range from the store, so a zoomed-in chart shows every tick of a short range. matplotlib is imported when the first
+# chart is created, so importing m4 or parsing the arguments does not load it (nor pandas).
+#
+#     python generateGraphs.py --out charts
+#     python generateGraphs.py --pairs ltc-usdt --start 2024-03-01T10:00 --end 2024-03-01T11:00
+#     python generateGraphs.py --pairs ltc-usdt --show
+import argparse
+import os
 import numpy as np
-import matplotlib.pyplot as plt
-
-pairs = ['dot-usdt', 'ltc-usdt', 'trx-usdt']
-for pair in pairs:
-  # Read in data
-  df_binance = pd.read_csv(f'data/binance/{pair}.csv')
-  df_binance['time'] = pd.to_datetime(df_binance['time'], unit='ms')
-  df_poloniex = pd.read_csv(f'data/poloniex/{pair}.csv')
-  df_poloniex['time'] = pd.to_datetime(df_poloniex['time'], unit='ms')
-
-  # Plot data
-  plt.plot(df_binance['time'], df_binance['price'], label='Binance')
-  plt.plot(df_poloniex['time'], df_poloniex['price'], label='Poloniex')
-  plt.xlabel('Time')
-  plt.ylabel('Price')
-  plt.title(f'{pair} Price')
-  plt.legend()
-  plt.show()
+
+from spread import FEES, align, net_spread
+from ticks import TickStore, _to_ms
+from utility.instrumentation import instrumented, report
+
+
+# Gets the (sorted) indices of the ticks M4 keeps: the first, last, min and max of each of `width` equal time bins
+# between `start` and `end`. NaN values are not binned, but the first NaN of a run of them between two kept ticks
+# in different bins (so an empty bin, or the ticks between two bins) is kept, so that the line breaks there like the
+# line of every tick does. `time` must be sorted.
+@instrumented(rows_in='value')
+def m4(time, value, width, start=None, end=None):
+    value = np.asarray(value, dtype=np.float64)
+    is_nan = np.isnan(value)
+    valid = np.flatnonzero(~is_nan)
+    if len(valid) == 0:
+        return valid
+    gaps = np.flatnonzero(is_nan & np.r_[True, ~is_nan[:-1]])
+    gaps = gaps[(gaps > valid[0]) & (gaps < valid[-1])]
+    if len(valid) <= 4 * width:
+        return np.union1d(valid, gaps)
+    time, value = np.asarray(time)[valid], value[valid]
+    start = time[0] if start is None else start
+    end = time[-1] + 1 if end is None else end
+    edges = start + (end - start) * np.arange(1, width) / width
+    bounds = np.searchsorted(time, edges, side='left')
+    starts = np.r_[0, bounds]
+    stops = np.r_[bounds, len(time)]
+    # A run of NaNs breaks the line if the valid ticks around it are in different bins.
+    bins = np.searchsorted(edges, time, side='right')
+    after = np.searchsorted(valid, gaps)
+    gaps = gaps[bins[after - 1] != bins[after]]
+    starts, stops = starts[stops > starts], stops[stops > starts]
+    # Without empty bins, the bins are contiguous, so reduceat over their starts reduces each bin.
+    keep = [starts, stops - 1]
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(value, starts)
+        hits = np.flatnonzero(value == np.repeat(extreme, stops - starts))
+        keep.append(hits[np.searchsorted(hits, starts)])
+    return np.union1d(valid[np.unique(np.concatenate(keep))], gaps)
+
+
+class PairChart:
+    def __init__(self, store, pair, exchanges=('binance', 'poloniex'), fees=FEES, tolerance_ms=1000,
+                 size=(16, 9), dpi=100):
+        import matplotlib.pyplot as plt
+
+        self.store = store
+        self.pair = pair
+        self.exchanges = exchanges
+        self.fees = fees
+        self.tolerance_ms = tolerance_ms
+        self.figure, (self.price_ax, self.spread_ax) = plt.subplots(
+            2, 1, sharex=True, figsize=size, dpi=dpi, gridspec_kw={'height_ratios': [2, 1]}
+        )
+        self.price_lines = [self.price_ax.plot([], [], label=exchange.capitalize(), linewidth=0.8)[0]
+                            for exchange in exchanges]
+        a, b = exchanges
+        self.spread_lines = [self.spread_ax.plot([], [], label=f'Buy {buy}, sell {sell}', linewidth=0.8)[0]
+                             for buy, sell in [(a, b), (b, a)]]
+        self.price_ax.set_ylabel('Price')
+        self.price_ax.set_title(f'{pair} Price')
+        self.price_ax.legend(loc='upper left')
+        self.spread_ax.axhline(0, color='grey', linewidth=0.5)
+        self.spread_ax.set_ylabel('Net spread')
+        self.spread_ax.set_xlabel('Time')
+        self.spread_ax.legend(loc='upper left')
+        self._drawing = False
+
+    # Draws the ticks with start <= time < end (epoch ms, or anything pd.Timestamp takes), all of them by default.
+    @instrumented(rows_out=False)
+    def draw(self, start=None, end=None):
+        start, end = _to_ms(start), _to_ms(end)
+        if start is None or end is None:
+            spans = [span for span in (self.store.span(e, self.pair) for e in self.exchanges) if span is not None]
+            if not spans:
+                return self
+            start = min(span[0] for span in spans) if start is None else start
+            end = max(span[1] for span in spans) + 1 if end is None else end
+        width = max(int(self.price_ax.bbox.width), 1)
+
+        # Ticks from up to `tolerance_ms` before the range give the prices at its start.
+        ticks = [self.store.read(e, self.pair, start - int(self.tolerance_ms), end, ('time', 'price'))
+                 for e in self.exchanges]
+        for line, exchange_ticks in zip(self.price_lines, ticks):
+            _set_line(line, exchange_ticks['time'], exchange_ticks['price'], width, start, end)
+
+        times, price_a, price_b = align(ticks[0]['time'], ticks[0]['price'], ticks[1]['time'], ticks[1]['price'],
+                                        self.tolerance_ms)
+        a, b = self.exchanges
+        for line, (buy, sell, buy_price, sell_price) in zip(self.spread_lines, [
+            (a, b, price_a, price_b), (b, a, price_b, price_a)
+        ]):
+            spread = net_spread(buy_price, sell_price, self.fees[buy], self.fees[sell])
+            _set_line(line, times, spread, width, start, end)
+
+        self._drawing = True
+        for ax in (self.price_ax, self.spread_ax):
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+        self.price_ax.set_xlim(np.datetime64(start, 'ms'), np.datetime64(end, 'ms'))
+        self._drawing = False
+        return self
+
+    # Re-decimates the visible range whenever the x axis is zoomed or panned.
+    def follow_zoom(self):
+        self.price_ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+        return self
+
+    def save(self, path):
+        self.figure.savefig(path)
+        return path
+
+    def close(self):
+        import matplotlib.pyplot as plt
+
+        plt.close(self.figure)
+
+    def _on_xlim_changed(self, ax):
+        if self._drawing:
+            return
+        import matplotlib.dates as mdates
+
+        lo, hi = (mdates.num2date(x) for x in ax.get_xlim())
+        self.draw(lo, hi)
+        self.figure.canvas.draw_idle()
+
+
+# Keeps the ticks of [start, end) that M4 keeps for `width` pixels.
+def _set_line(line, time, value, width, start, end):
+    lo, hi = np.searchsorted(time, [start, end], side='left')
+    time, value = time[lo:hi], value[lo:hi]
+    keep = m4(time, value, width, start, end)
+    line.set_data(np.asarray(time[keep]).astype('datetime64[ms]'), value[keep])
+
+
+# Writes the chart of every pair to {out_dir}/{pair}.png, between `start` and `end` if given. Returns the paths.
+def render(pairs, store=None, out_dir='charts', start=None, end=None, exchanges=('binance', 'poloniex'),
+           tolerance_ms=1000):
+    store = store if store is not None else TickStore()
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for pair in pairs:
+        chart = PairChart(store, pair, exchanges, tolerance_ms=tolerance_ms).draw(start, end)
+        paths.append(chart.save(os.path.join(out_dir, f'{pair}.png')))
+        chart.close()
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs', nargs='+', default=['dot-usdt', 'ltc-usdt', 'trx-usdt'])
+    parser.add_argument('--exchanges', nargs=2, default=['binance', 'poloniex'])
+    parser.add_argument('--store', default=os.path.join('data', '.store'))
+    parser.add_argument('--start', help='e.g. 2024-03-01T10:00 (UTC)')
+    parser.add_argument('--end')
+    parser.add_argument('--tolerance-ms', type=int, default=1000)
+    parser.add_argument('--out', default='charts', help='folder to write {pair}.png to')
+    parser.add_argument('--show', action='store_true', help='open the charts, re-decimating on zoom')
+    args = parser.parse_args(argv)
+
+    import matplotlib.pyplot as plt
+
+    store = TickStore(args.store)
+    if args.show:
+        # Kept referenced, since matplotlib holds the zoom callbacks weakly
+        charts = [PairChart(store, pair, args.exchanges, tolerance_ms=args.tolerance_ms).draw(args.start, args.end)
+                  .follow_zoom() for pair in args.pairs]
+        plt.show()
+    else:
+        plt.switch_backend('Agg')
+        for path in render(args.pairs, store, args.out, args.start, args.end, args.exchanges, args.tolerance_ms):
+            print(path)
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,86 @@
+import json
+import os
+import time
 from utility.query import query
 
+SCHEMA_QUERY = (
+    "SELECT table_name, column_name FROM information_schema.columns "
+    "WHERE table_schema = DATABASE() ORDER BY table_name, ordinal_position"
+)
+
+# `source` is an open cursor, or a SQLConnection that every query borrows a pooled connection from.
+# The schema (tables and their columns) is read with one information_schema query the first time it is
+# needed and cached for `ttl` seconds, in memory and in `cache_path` (a JSON file) if given, so creating
+# a Database does not query the server. The file records which server and database it was read from
+# (`cache_key`, by default the SQLConnection's user, host and database) and is ignored for any other, so
+# a plain cursor without a `cache_key` never uses it. Table objects are created on first access.
 class Database:
-    def __init__(self, cursor):
-        self.tables = {}
-        self.cursor = cursor
-        self.getTables()
+    def __init__(self, source, cache_path=None, ttl=3600, cache_key=None):
+        self.source = source
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.cache_key = cache_key if cache_key is not None else getattr(source, 'cache_key', None)
+        self._tables = {}
+        self._schema = None
+        self._loaded_at = None
+
+    # {table name: Table} of every table.
+    @property
+    def tables(self):
+        for table_name in self.getSchema():
+            self.getTable(table_name)
+        return self._tables
 
     def getTables(self):
-        tables = query("SHOW TABLES", self.cursor)[0]
-        for table in tables:
-            self.tables[table] = Table(table, self.cursor)
-        return self.tables.keys()
+        return self.getSchema().keys()
+
+    def getTable(self, table_name):
+        if table_name not in self._tables:
+            self._tables[table_name] = Table(table_name, self.source, self.getSchema()[table_name])
+        return self._tables[table_name]
+
+    # Gets {table name: [column names]}, from the cache if it is younger than the ttl.
+    def getSchema(self):
+        if self._schema is not None and time.time() - self._loaded_at < self.ttl:
+            return self._schema
+        if self._schema is None and self._uses_cache_file() and os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+            if cached.get('key') == self._cache_file_key() and time.time() - cached['loaded_at'] < self.ttl:
+                self._schema, self._loaded_at = cached['tables'], cached['loaded_at']
+                return self._schema
+        return self.refresh()
+
+    # Reads the schema from the server, replacing the cached one.
+    def refresh(self):
+        schema = {}
+        for table_name, column_name in query(SCHEMA_QUERY, self.source):
+            schema.setdefault(table_name, []).append(column_name)
+        self._schema, self._loaded_at = schema, time.time()
+        self._tables = {}
+        if self._uses_cache_file():
+            with open(f"{self.cache_path}.tmp", 'w') as f:
+                json.dump({'key': self._cache_file_key(), 'loaded_at': self._loaded_at, 'tables': schema}, f)
+            os.replace(f"{self.cache_path}.tmp", self.cache_path)
+        return schema
+
+    def _uses_cache_file(self):
+        return self.cache_path is not None and self.cache_key is not None
+
+    # The cache key as it reads back from JSON.
+    def _cache_file_key(self):
+        return json.loads(json.dumps(self.cache_key))
 
 
 
 class Table:
-    def __init__(self, table_name, cursor):
+    def __init__(self, table_name, source, cols=None):
         self.table_name = table_name
-        self.cursor = cursor
-        self.cols = []
-        self.getCols()
+        self.source = source
+        self.cols = cols
+        if self.cols is None:
+            self.getCols()
 
     def getCols(self):
-        self.cols = [r[0] for r in query(f"SHOW COLUMNS FROM {self.table_name}", self.cursor)]
-        print(self.cols)
+        self.cols = [r[0] for r in query(f"SHOW COLUMNS FROM {self.table_name}", self.source)]
+        return self.cols
@@ -0,0 +1,110 @@
+# Scans many pairs across many exchanges for arbitrage windows (see spread.py) on every core.
+#
+# Ticks are read from the tick store (see ticks.py), into which each data/{exchange}/{pair}.csv is converted
+# once and again only when the CSV changes. Workers read the time range they scan from the memory-mapped day
+# files of the store, so the ticks are shared through the page cache instead of pickled to every process, and
+# only the (small) windows are sent back. pandas is imported where CSVs are converted and windows collected, so
+# --help and workers reading the store start without it.
+#
+#     python scan.py --exchanges binance poloniex kraken --workers 8 --out windows.csv
+#     python scan.py --exchanges binance poloniex --start 2024-03-01 --end 2024-03-08
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from spread import FEES, WINDOW_COLUMNS, find_opportunities, load_ticks
+from ticks import TickStore, _to_ms, sync_csv
+from utility.instrumentation import instrumented, report
+
+
+def scan_pair(store, pair, exchange_a, exchange_b, fees, tolerance_ms, min_spread, start=None, end=None):
+    return find_opportunities(pair, load_ticks(store, exchange_a, pair, start, end),
+                              load_ticks(store, exchange_b, pair, start, end),
+                              exchange_a, exchange_b, fees, tolerance_ms, min_spread)
+
+
+# Finds the pairs every exchange has data for, as a CSV in its folder or in the store. Returns {pair: [exchanges]}.
+def find_pairs(data_dir, exchanges, store=None):
+    store = store if store is not None else TickStore(os.path.join(data_dir, '.store'))
+    pairs = {}
+    for exchange in exchanges:
+        folder = os.path.join(data_dir, exchange)
+        names = {name[:-len('.csv')] for name in os.listdir(folder) if name.endswith('.csv')} if os.path.isdir(folder) else set()
+        for pair in sorted(names | {pair for _, pair in store.pairs(exchange)}):
+            pairs.setdefault(pair, []).append(exchange)
+    return pairs
+
+
+# Scans every pair over every combination of two exchanges listing it, over `workers` processes (all cores
+# by default), for the ticks with start <= time < end (epoch ms, or anything pd.Timestamp takes), all of them by
+# default. Returns (summary, windows): the windows of every pair and exchange combination, and one row per
+# (pair, buy exchange, sell exchange) with the number of windows, the widest spread and the total time open.
+@instrumented(rows_out=False)
+def scan(data_dir='data', exchanges=('binance', 'poloniex'), pairs=None, workers=None, fees=FEES,
+         tolerance_ms=1000, min_spread=0.0, start=None, end=None, store=None):
+    import pandas as pd
+
+    store = store if store is not None else TickStore(os.path.join(data_dir, '.store'))
+    start, end = _to_ms(start), _to_ms(end)
+    listed = find_pairs(data_dir, exchanges, store)
+    if pairs is not None:
+        listed = {pair: listed.get(pair, []) for pair in pairs}
+    tasks = [
+        (pair, exchange_a, exchange_b)
+        for pair, pair_exchanges in listed.items()
+        for exchange_a, exchange_b in itertools.combinations(pair_exchanges, 2)
+    ]
+    files = sorted({(exchange, pair) for pair, exchange_a, exchange_b in tasks for exchange in (exchange_a, exchange_b)})
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(sync_csv, [store] * len(files), [data_dir] * len(files), *zip(*files)))
+        # Largest inputs first, so that one big pair does not finish alone at the end.
+        tasks.sort(key=lambda task: -sum(_rows(store, exchange, task[0], start, end) for exchange in task[1:]))
+        futures = [
+            executor.submit(scan_pair, store, pair, exchange_a, exchange_b, fees, tolerance_ms, min_spread, start, end)
+            for pair, exchange_a, exchange_b in tasks
+        ]
+        windows = [future.result() for future in futures]
+
+    windows = pd.concat(windows, ignore_index=True) if windows else pd.DataFrame(columns=WINDOW_COLUMNS)
+    summary = windows.groupby(['pair', 'buy_exchange', 'sell_exchange']).agg(
+        windows=('start', 'size'), max_spread=('max_spread', 'max'), total_ms=('duration_ms', 'sum')
+    ).reset_index().sort_values('max_spread', ascending=False, ignore_index=True)
+    return summary, windows
+
+
+# Counts the ticks of the days of a pair that overlap [start, end), from the manifest only.
+def _rows(store, exchange, pair, start, end):
+    return sum(day['rows'] for day in store.days(exchange, pair).values()
+               if (start is None or day['last'] >= start) and (end is None or day['first'] < end))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='data')
+    parser.add_argument('--exchanges', nargs='+', default=['binance', 'poloniex'])
+    parser.add_argument('--pairs', nargs='+', help='all pairs in the exchange folders by default')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--tolerance-ms', type=float, default=1000)
+    parser.add_argument('--min-spread', type=float, default=0.0)
+    parser.add_argument('--start', help='first tick time to scan, e.g. 2024-03-01 (UTC), all ticks by default')
+    parser.add_argument('--end', help='scan the ticks before this time')
+    parser.add_argument('--store', help='data/.store by default')
+    parser.add_argument('--fee', action='append', default=[], metavar='EXCHANGE=FEE',
+                        help='taker fee of an exchange not in spread.FEES, e.g. kraken=0.0026')
+    parser.add_argument('--out', help='csv file to write the windows to')
+    args = parser.parse_args(argv)
+
+    fees = dict(FEES, **{exchange: float(fee) for exchange, fee in (f.split('=') for f in args.fee)})
+    store = TickStore(args.store or os.path.join(args.data, '.store'))
+    summary, windows = scan(args.data, args.exchanges, args.pairs, args.workers, fees, args.tolerance_ms,
+                            args.min_spread, args.start, args.end, store)
+    print(summary.to_string(index=False))
+    if args.out:
+        windows.to_csv(args.out, index=False)
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# Cross exchange arbitrage spreads between two exchanges' tick streams.
+#
+# The two streams are lined up with an as-of join: at every tick on either exchange, each side's price is
+# its latest trade, if that trade is at most `tolerance_ms` old. The net spread of buying on one exchange
+# and selling on the other (after both taker fees) is computed in both directions, and consecutive ticks
+# where it stays above `min_spread` form an opportunity window.
+#
+# Ticks are range reads of the tick store (see ticks.py), into which data/{exchange}/{pair}.csv is converted the
+# first time and whenever the CSV changes.
+#
+#     python spread.py --pairs dot-usdt ltc-usdt trx-usdt --tolerance-ms 1000
+#     python spread.py --pairs ltc-usdt --start 2024-03-01 --end 2024-03-02
+import argparse
+import os
+import numpy as np
+
+from ticks import TickStore, _to_ms, sync_csv
+from utility.instrumentation import instrumented, report
+
+# Taker fees (fraction of notional) at tier 0, see README.md
+FEES = {
+    'binance': 0.001,
+    'poloniex': 0.002,
+}
+
+WINDOW_COLUMNS = ['pair', 'buy_exchange', 'sell_exchange', 'start', 'end', 'duration_ms', 'max_spread', 'ticks']
+
+
+# Lines up two tick streams on the union of their tick times (the last tick of a given time only).
+# Returns (times, price_a, price_b), with NaN where a side has no price within `tolerance`, i.e. whose latest
+# tick at or before a time is more than `tolerance` older. Both streams must be sorted by time. They are
+# merged with one stable sort, which is linear for two sorted runs, and a running maximum carries each
+# side's latest tick forward, instead of a search per row.
+def align(time_a, price_a, time_b, price_b, tolerance=np.inf):
+    time_a = np.asarray(time_a)
+    time_b = np.asarray(time_b)
+    times = np.concatenate([time_a, time_b])
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    is_a = order < len(time_a)
+    idx_a = np.maximum.accumulate(np.where(is_a, order, -1))
+    idx_b = np.maximum.accumulate(np.where(is_a, -1, order - len(time_a)))
+    last = np.r_[times[1:] != times[:-1], True][:len(times)]
+    times, idx_a, idx_b = times[last], idx_a[last], idx_b[last]
+    return times, _latest(times, time_a, price_a, idx_a, tolerance), _latest(times, time_b, price_b, idx_b, tolerance)
+
+
+def _latest(times, tick_time, tick_price, idx, tolerance):
+    if len(tick_time) == 0:
+        return np.full(len(times), np.nan)
+    price = np.asarray(tick_price, dtype=np.float64)[np.maximum(idx, 0)]
+    fresh = (idx >= 0) & (times - tick_time[np.maximum(idx, 0)] <= tolerance)
+    return np.where(fresh, price, np.nan)
+
+
+# Net return of buying at `buy_price` and selling at `sell_price`, after the taker fee on both legs.
+def net_spread(buy_price, sell_price, buy_fee, sell_fee):
+    return sell_price * (1 - sell_fee) / (buy_price * (1 + buy_fee)) - 1
+
+
+# Groups consecutive times where `spread` > `min_spread` into windows. A window ends at the tick that
+# closes it (or the last tick). Returns (start, end, max spread, ticks) arrays.
+def opportunity_windows(times, spread, min_spread=0.0):
+    is_open = np.nan_to_num(spread, nan=-np.inf) > min_spread
+    edges = np.diff(np.r_[0, is_open.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return starts, starts, np.empty(0), starts
+    # reduceat over [start, next start) also covers the closed ticks in between, so those are masked out.
+    max_spread = np.maximum.reduceat(np.where(is_open, spread, -np.inf), starts)
+    end = times[np.minimum(stops, len(times) - 1)]
+    return times[starts], end, max_spread, stops - starts
+
+
+@instrumented(rows_in='ticks_a')
+def find_opportunities(pair, ticks_a, ticks_b, exchange_a, exchange_b, fees=FEES, tolerance_ms=1000, min_spread=0.0):
+    import pandas as pd
+
+    # `ticks_a` and `ticks_b` are DataFrames or {column: array} (e.g. TickStore reads) with time and price.
+    times, price_a, price_b = align(
+        np.asarray(ticks_a['time']), np.asarray(ticks_a['price']), np.asarray(ticks_b['time']), np.asarray(ticks_b['price']),
+        tolerance_ms,
+    )
+    windows = []
+    for buy, sell, buy_price, sell_price in [
+        (exchange_a, exchange_b, price_a, price_b), (exchange_b, exchange_a, price_b, price_a)
+    ]:
+        spread = net_spread(buy_price, sell_price, fees[buy], fees[sell])
+        start, end, max_spread, ticks = opportunity_windows(times, spread, min_spread)
+        windows.append(pd.DataFrame({
+            'pair': pair, 'buy_exchange': buy, 'sell_exchange': sell, 'start': start, 'end': end,
+            'duration_ms': end - start, 'max_spread': max_spread, 'ticks': ticks,
+        }, columns=WINDOW_COLUMNS))
+    return pd.concat(windows, ignore_index=True).sort_values('start', ignore_index=True)
+
+
+# Gets the (int64 epoch ms) time and price of a pair's ticks with start <= time < end from the store.
+def load_ticks(store, exchange, pair, start=None, end=None):
+    return store.read(exchange, pair, start, end, ('time', 'price'))
+
+
+@instrumented(rows_in='pairs')
+def scan_pairs(pairs, data_dir='data', exchange_a='binance', exchange_b='poloniex', fees=FEES, tolerance_ms=1000,
+               min_spread=0.0, start=None, end=None, store=None):
+    import pandas as pd
+
+    store = store if store is not None else TickStore(os.path.join(data_dir, '.store'))
+    start, end = _to_ms(start), _to_ms(end)
+    windows = []
+    for pair in pairs:
+        for exchange in (exchange_a, exchange_b):
+            sync_csv(store, data_dir, exchange, pair)
+        windows.append(find_opportunities(pair, load_ticks(store, exchange_a, pair, start, end),
+                                          load_ticks(store, exchange_b, pair, start, end),
+                                          exchange_a, exchange_b, fees, tolerance_ms, min_spread))
+    if not windows:
+        return pd.DataFrame(columns=WINDOW_COLUMNS)
+    return pd.concat(windows, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs', nargs='+', default=['dot-usdt', 'ltc-usdt', 'trx-usdt'])
+    parser.add_argument('--data', default='data')
+    parser.add_argument('--exchanges', nargs=2, default=['binance', 'poloniex'])
+    parser.add_argument('--tolerance-ms', type=float, default=1000)
+    parser.add_argument('--min-spread', type=float, default=0.0)
+    parser.add_argument('--start', help='first tick time, e.g. 2024-03-01 (UTC), all ticks by default')
+    parser.add_argument('--end', help='only ticks before this time')
+    parser.add_argument('--store', help='data/.store by default')
+    parser.add_argument('--out', help='csv file to write the windows to')
+    args = parser.parse_args(argv)
+
+    store = TickStore(args.store or os.path.join(args.data, '.store'))
+    windows = scan_pairs(args.pairs, args.data, *args.exchanges, FEES, args.tolerance_ms, args.min_spread,
+                         args.start, args.end, store)
+    print(windows.groupby(['pair', 'buy_exchange', 'sell_exchange']).agg(
+        windows=('start', 'size'), max_spread=('max_spread', 'max'), total_ms=('duration_ms', 'sum')
+    ))
+    if args.out:
+        windows.to_csv(args.out, index=False)
+    report()
+
+
+if __name__ == "__main__":
+    main()
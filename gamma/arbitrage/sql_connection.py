@@ -1,29 +1,15 @@
+# The connection pool and SQLConnection are theta's: theta/sql_connection.py is loaded from its file, since gamma
+# and theta are each run from their own folder. Its tests are theta/test_sql_connection.py.
+import importlib.util
 import os
-import mysql.connector
-import pandas as pd
-import rollbar
-from dotenv import load_dotenv
+import sys
 
-load_dotenv()
+_NAME = 'theta_sql_connection'
+_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'theta', 'sql_connection.py')
 
-class SQLConnection:
-    def __init__(self):
-        self.__user = os.environ.get('USERNAME')
-        self.__password = os.environ.get('PASSWORD')
-        self.__host = os.environ.get('HOST')
-        self.__database = os.environ.get('DATABASE')
+if _NAME not in sys.modules:
+    _spec = importlib.util.spec_from_file_location(_NAME, os.path.normpath(_PATH))
+    sys.modules[_NAME] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules[_NAME])
 
-    def create_connection(self):
-        config = {
-            'user': self.__user,
-            'password': self.__password,
-            'host': self.__host,
-            'database': self.__database,
-            'raise_on_warnings': True
-        }
-        try:
-            return mysql.connector.connect(**config)
-        except mysql.connector.Error as err:
-            print(err)
-            rollbar.report_exc_info()
-            exit()
+from theta_sql_connection import ConnectionPool, SQLConnection, load_env
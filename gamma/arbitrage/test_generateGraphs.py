@@ -0,0 +1,107 @@
+# Tests of the M4 decimation of the charts against a brute force bucketing (matplotlib is not needed):
+#     python -m unittest test_generateGraphs
+import unittest
+
+import numpy as np
+
+from generateGraphs import m4
+
+
+# For each of `width` equal time buckets between `start` and `end` that has ticks, the index of its first and last
+# tick and of the first tick at its min and max value. NaN values are skipped, but the first NaN of a run of them
+# between two valid ticks in different buckets (or any two valid ticks, when every tick is kept) is kept.
+def brute_force_m4(time, value, width, start=None, end=None):
+    valid = [i for i in range(len(value)) if not np.isnan(value[i])]
+    gaps = [i for i in range(valid[0] + 1, valid[-1]) if np.isnan(value[i]) and not np.isnan(value[i - 1])] if valid else []
+    if len(valid) <= 4 * width:
+        return sorted(valid + gaps)
+    start = time[valid[0]] if start is None else start
+    end = time[valid[-1]] + 1 if end is None else end
+    edges = [start + (end - start) * k / width for k in range(1, width)]
+    buckets = {}
+    for i in valid:
+        buckets.setdefault(sum(edge <= time[i] for edge in edges), []).append(i)
+    keep = set()
+    for bucket in buckets.values():
+        values = [value[i] for i in bucket]
+        keep |= {bucket[0], bucket[-1], bucket[values.index(min(values))], bucket[values.index(max(values))]}
+    bucket_of = {i: b for b, bucket in buckets.items() for i in bucket}
+    for gap in gaps:
+        before, after = max(i for i in valid if i < gap), min(i for i in valid if i > gap)
+        if bucket_of[before] != bucket_of[after]:
+            keep.add(gap)
+    return sorted(keep)
+
+
+class TestM4(unittest.TestCase):
+    def assert_m4(self, time, value, width, start=None, end=None):
+        time, value = np.asarray(time), np.asarray(value, dtype=np.float64)
+        keep = m4(time, value, width, start, end)
+        self.assertEqual(list(keep), brute_force_m4(list(time), list(value), width, start, end))
+        return keep
+
+    def test_m4_valid_input(self):
+        rng = np.random.default_rng(0)
+        time = np.sort(rng.integers(0, 100_000, 5000))
+        value = np.cumsum(rng.normal(0, 1, 5000))
+        keep = self.assert_m4(time, value, 50)
+        self.assertLessEqual(len(keep), 4 * 50)
+        # The line keeps the extremes and both ends of the series.
+        self.assertIn(np.argmin(value), keep)
+        self.assertIn(np.argmax(value), keep)
+        self.assertEqual((keep[0], keep[-1]), (0, 4999))
+
+    def test_m4_empty_buckets(self):
+        # Gaps in the ticks longer than a bucket, and a range wider than the ticks on both sides.
+        rng = np.random.default_rng(1)
+        time = np.r_[np.arange(0, 1000), np.arange(5000, 5500), np.arange(9000, 9900, 3)]
+        value = rng.normal(0, 1, len(time))
+        self.assert_m4(time, value, 20)
+        self.assert_m4(time, value, 20, start=-5000, end=20_000)
+        self.assert_m4(time, value, 7, start=-3, end=9900)
+        # 3 runs of ticks over 20 buckets of 500 ms: 2 + 1 + 2 buckets with ticks, 4 ticks each.
+        keep = self.assert_m4(time, value, 20, start=0, end=10_000)
+        self.assertEqual(len(keep), 4 * 5)
+
+    def test_m4_random(self):
+        rng = np.random.default_rng(2)
+        for _ in range(50):
+            n = int(rng.integers(0, 400))
+            time = np.sort(rng.integers(0, int(rng.integers(1, 2000)), n))
+            # Few distinct values, so that buckets have several ticks at their min and max.
+            value = rng.integers(0, 5, n).astype(np.float64)
+            value[rng.random(n) < 0.1] = np.nan
+            self.assert_m4(time, value, int(rng.integers(1, 30)))
+
+    def test_m4_short_series(self):
+        # At most 4 ticks per bucket already: every tick is kept, but only the first of a run of NaNs, and none at
+        # either end, where there is no line to break.
+        time = np.arange(10)
+        value = np.r_[np.arange(9.0), np.nan]
+        self.assertEqual(list(m4(time, value, 3)), list(range(9)))
+        self.assertEqual(list(m4(time[:8], value[:8], 2)), list(range(8)))
+        value = np.array([np.nan, 1, 2, np.nan, np.nan, 5, 6, np.nan, 8, np.nan])
+        self.assertEqual(list(m4(time, value, 2)), [1, 2, 3, 5, 6, 7, 8])
+        self.assertEqual(list(m4([], [], 10)), [])
+        self.assertEqual(list(m4(time, np.full(10, np.nan), 1)), [])
+
+    def test_m4_gaps(self):
+        # 4 buckets of 100 ticks. NaNs inside a bucket with valid ticks on both sides do not break its line, a
+        # bucket of only NaNs and NaNs at the edge of two buckets do.
+        time = np.arange(400)
+        value = np.sin(time / 10.0)
+        value[[10, 11, 50]] = np.nan
+        value[200:300] = np.nan
+        value[99] = value[100] = np.nan
+        keep = self.assert_m4(time, value, 4)
+        self.assertEqual([i for i in keep if np.isnan(value[i])], [99, 200])
+
+    def test_m4_ties(self):
+        # The first of equal mins and maxes is kept.
+        time = np.arange(12)
+        value = np.array([5, 1, 9, 1, 9, 5, 3, 0, 7, 0, 7, 3], dtype=np.float64)
+        self.assertEqual(list(m4(time, value, 2)), [0, 1, 2, 5, 6, 7, 8, 11])
+
+
+if __name__ == '__main__':
+    unittest.main()
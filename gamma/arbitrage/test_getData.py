@@ -0,0 +1,103 @@
+# Tests of the cached schema of Database, against SQLite with an information_schema stand-in:
+#     python -m unittest test_getData
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from getData import Database
+from sql_connection import SQLConnection
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, 'schema.json')
+        self.queries = []
+        self.environ = mock.patch.dict(os.environ, {'USERNAME': 'user', 'HOST': 'db1', 'DATABASE': 'prices'})
+        self.environ.start()
+        self.connect = self.connector({'trades': ['time', 'price'], 'orders': ['time', 'side', 'amount']})
+        self.sql = SQLConnection(connect=self.connect)
+
+    def tearDown(self):
+        self.environ.stop()
+        for pool in SQLConnection._pools.values():
+            pool.close()
+        SQLConnection._pools.clear()
+        self.tmp_dir.cleanup()
+
+    # Connects to a SQLite database whose information_schema.columns lists `tables`, and which records the queries
+    # run on it.
+    def connector(self, tables):
+        path = os.path.join(self.tmp_dir.name, f'{len(os.listdir(self.tmp_dir.name))}.db')
+        schema = sqlite3.connect(path)
+        schema.execute("CREATE TABLE columns (table_schema TEXT, table_name TEXT, column_name TEXT, "
+                       "ordinal_position INTEGER)")
+        schema.executemany("INSERT INTO columns VALUES ('main', ?, ?, ?)",
+                           [(table, column, i) for table, columns in tables.items() for i, column in enumerate(columns)])
+        schema.commit()
+        schema.close()
+
+        def connect():
+            connection = sqlite3.connect(':memory:', check_same_thread=False)
+            connection.execute("ATTACH DATABASE ? AS information_schema", (path,))
+            connection.create_function('DATABASE', 0, lambda: 'main')
+            connection.set_trace_callback(self.queries.append)
+            return connection
+        return connect
+
+    def schema_queries(self):
+        return [q for q in self.queries if 'information_schema' in q]
+
+    def test_schema(self):
+        database = Database(self.sql)
+        self.assertEqual(self.queries, [])
+        self.assertEqual(sorted(database.getTables()), ['orders', 'trades'])
+        self.assertEqual(database.getTable('orders').cols, ['time', 'side', 'amount'])
+        # The eager dict of every Table is still filled, from the cached schema.
+        self.assertEqual(sorted(database.tables), ['orders', 'trades'])
+        self.assertEqual(database.tables['trades'].cols, ['time', 'price'])
+        self.assertEqual(len(self.schema_queries()), 1)
+
+    def test_cache_file(self):
+        Database(self.sql, cache_path=self.cache_path).getTables()
+        # A new Database (e.g. the next run) reads the file instead of the server.
+        database = Database(self.sql, cache_path=self.cache_path)
+        self.assertEqual(database.tables['trades'].cols, ['time', 'price'])
+        self.assertEqual(len(self.schema_queries()), 1)
+
+        # An expired file is read again.
+        Database(self.sql, cache_path=self.cache_path, ttl=0).getTables()
+        self.assertEqual(len(self.schema_queries()), 2)
+
+    def test_cache_file_other_database(self):
+        Database(self.sql, cache_path=self.cache_path).getTables()
+        with open(self.cache_path) as f:
+            self.assertEqual(json.load(f)['key'][:3], ['user', 'db1', 'prices'])
+
+        # The same file with DATABASE pointing at another database, or HOST at another server, is not used.
+        for i, environ in enumerate([{'DATABASE': 'other'}, {'HOST': 'db2'}]):
+            with mock.patch.dict(os.environ, environ):
+                Database(SQLConnection(connect=self.connect), cache_path=self.cache_path).getTables()
+            self.assertEqual(len(self.schema_queries()), i + 2)
+        # And the file now holds the last one read.
+        Database(self.sql, cache_path=self.cache_path).getTables()
+        self.assertEqual(len(self.schema_queries()), 4)
+        other = SQLConnection(connect=self.connector({'candles': ['time', 'open', 'close']}))
+        database = Database(other, cache_path=self.cache_path)
+        self.assertEqual(database.getTable('candles').cols, ['time', 'open', 'close'])
+
+    def test_cache_file_without_key(self):
+        # A plain cursor does not say which database it reads, so the file is neither read nor written.
+        with self.sql.cursor() as cursor:
+            self.assertEqual(sorted(Database(cursor, cache_path=self.cache_path).getTables()), ['orders', 'trades'])
+        self.assertFalse(os.path.exists(self.cache_path))
+        with self.sql.cursor() as cursor:
+            Database(cursor, cache_path=self.cache_path, cache_key='db1/prices').getTables()
+        self.assertTrue(os.path.exists(self.cache_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# Tests of the parallel scanner, reading the CSVs through the tick store, against a per-row loop over the CSVs:
+#     python -m unittest test_scan
+import csv
+import math
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from scan import find_pairs, scan
+from spread import FEES, load_ticks
+from ticks import TickStore, sync_csv
+
+FIXTURE_FEES = dict(FEES, kraken=0.0026)
+
+
+# Reads a tick CSV into (time, price) rows sorted by time, keeping the file order of equal times.
+def read_ticks(path):
+    with open(path) as f:
+        rows = [(float(row['time']), float(row['price'])) for row in csv.DictReader(f)]
+    return sorted(rows, key=lambda row: row[0])
+
+
+# Walks both streams tick by tick, carrying each exchange's latest price, and opens a window while buying on one
+# exchange and selling on the other nets more than `min_spread`. Returns (buy, sell, start, end, max spread, ticks).
+def per_row_windows(ticks_a, ticks_b, exchange_a, exchange_b, fees, tolerance, min_spread):
+    events = sorted([(t, 0, p) for t, p in ticks_a] + [(t, 1, p) for t, p in ticks_b], key=lambda e: e[0])
+    rows = []
+    latest = [None, None]
+    for i, (t, side, price) in enumerate(events):
+        latest[side] = (t, price)
+        if i + 1 < len(events) and events[i + 1][0] == t:
+            continue
+        prices = [last[1] if last is not None and t - last[0] <= tolerance else math.nan for last in latest]
+        rows.append((t, prices[0], prices[1]))
+
+    windows = []
+    for buy, sell, buy_side in [(exchange_a, exchange_b, 1), (exchange_b, exchange_a, 2)]:
+        current = None
+        for t, price_a, price_b in rows:
+            buy_price, sell_price = (price_a, price_b) if buy_side == 1 else (price_b, price_a)
+            spread = sell_price * (1 - fees[sell]) / (buy_price * (1 + fees[buy])) - 1
+            if spread > min_spread:
+                if current is None:
+                    current = [buy, sell, t, None, spread, 0]
+                current[4] = max(current[4], spread)
+                current[5] += 1
+            elif current is not None:
+                current[3] = t
+                windows.append(tuple(current))
+                current = None
+        if current is not None:
+            current[3] = rows[-1][0]
+            windows.append(tuple(current))
+    return windows
+
+
+class TestScan(unittest.TestCase):
+    EXCHANGES = ['binance', 'poloniex', 'kraken']
+    # kraken does not list trx-usdt.
+    PAIRS = {'dot-usdt': EXCHANGES, 'ltc-usdt': EXCHANGES, 'trx-usdt': ['binance', 'poloniex']}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+        rng = np.random.default_rng(0)
+        for pair, exchanges in self.PAIRS.items():
+            for exchange in exchanges:
+                n = int(rng.integers(100, 300))
+                times = rng.integers(0, 20_000, n)
+                prices = 50 + np.cumsum(rng.normal(0, 0.05, n))
+                # Unsorted, as exchanges' exports sometimes are, with a few repeated times.
+                times[rng.integers(0, n, 5)] = times[0]
+                self.write_csv(exchange, pair, times, prices)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_csv(self, exchange, pair, times, prices):
+        os.makedirs(os.path.join(self.data_dir, exchange), exist_ok=True)
+        with open(os.path.join(self.data_dir, exchange, f'{pair}.csv'), 'w') as f:
+            f.write('time,price,amount\n')
+            for t, p in zip(times, prices):
+                f.write(f'{int(t)},{float(p)!r},1\n')
+
+    def expected_windows(self, tolerance, min_spread, start=-math.inf, end=math.inf):
+        expected = []
+        for pair, exchanges in self.PAIRS.items():
+            for i, exchange_a in enumerate(exchanges):
+                for exchange_b in exchanges[i + 1:]:
+                    ticks_a, ticks_b = [
+                        [row for row in read_ticks(os.path.join(self.data_dir, exchange, f'{pair}.csv')) if start <= row[0] < end]
+                        for exchange in (exchange_a, exchange_b)
+                    ]
+                    expected += [(pair, *window) for window in per_row_windows(
+                        ticks_a, ticks_b, exchange_a, exchange_b, FIXTURE_FEES, tolerance, min_spread)]
+        return expected
+
+    def assert_windows(self, windows, expected):
+        self.assertGreater(len(expected), 0)
+        actual = windows[['pair', 'buy_exchange', 'sell_exchange', 'start', 'end', 'max_spread', 'ticks']]
+        actual = list(actual.itertuples(index=False, name=None))
+        self.assertEqual(len(actual), len(expected))
+        for row, wanted in zip(sorted(actual), sorted(expected)):
+            self.assertEqual(row[:5] + row[6:], wanted[:5] + wanted[6:])
+            self.assertAlmostEqual(row[5], wanted[5], places=12)
+
+    def test_scan_matches_per_row_loop(self):
+        for tolerance, min_spread in [(1000, 0.0), (50, -0.001)]:
+            summary, windows = scan(self.data_dir, self.EXCHANGES, workers=2, fees=FIXTURE_FEES,
+                                    tolerance_ms=tolerance, min_spread=min_spread)
+            expected = self.expected_windows(tolerance, min_spread)
+            self.assert_windows(windows, expected)
+
+            # One summary row per pair and direction with windows, adding up to the windows.
+            self.assertEqual(summary['windows'].sum(), len(expected))
+            self.assertEqual(set(summary['pair']), set(self.PAIRS))
+            self.assertEqual(len(summary[(summary['pair'] == 'trx-usdt') & (summary['buy_exchange'] == 'kraken')]), 0)
+            self.assertEqual(list(summary['max_spread']), sorted(summary['max_spread'], reverse=True))
+
+    def test_scan_selected_pairs(self):
+        summary, windows = scan(self.data_dir, self.EXCHANGES, pairs=['trx-usdt', 'btc-usdt'], workers=1,
+                                fees=FIXTURE_FEES)
+        self.assertEqual(set(windows['pair']), {'trx-usdt'})
+        self.assertEqual(set(zip(windows['buy_exchange'], windows['sell_exchange'])),
+                         {('binance', 'poloniex'), ('poloniex', 'binance')})
+
+    def test_scan_time_range(self):
+        # Only the ticks with start <= time < end are read from the store.
+        _, windows = scan(self.data_dir, self.EXCHANGES, workers=1, fees=FIXTURE_FEES, start=5000, end=15_000)
+        self.assert_windows(windows, self.expected_windows(1000, 0.0, 5000, 15_000))
+        self.assertTrue(((windows['start'] >= 5000) & (windows['end'] < 15_000)).all())
+
+    def test_find_pairs(self):
+        self.assertEqual(find_pairs(self.data_dir, self.EXCHANGES + ['bitfinex']), self.PAIRS)
+        # Pairs that are only in the store count too.
+        store = TickStore(os.path.join(self.data_dir, '.store'))
+        store.write('kraken', 'trx-usdt', [1], [1.0], [1.0])
+        self.assertEqual(find_pairs(self.data_dir, self.EXCHANGES)['trx-usdt'], self.EXCHANGES)
+
+    def test_sync_csv(self):
+        store = TickStore(os.path.join(self.data_dir, '.store'))
+        self.assertTrue(sync_csv(store, self.data_dir, 'binance', 'dot-usdt'))
+        ticks = load_ticks(store, 'binance', 'dot-usdt')
+        self.assertEqual(ticks['time'].dtype, np.int64)
+        expected = np.array(read_ticks(os.path.join(self.data_dir, 'binance', 'dot-usdt.csv')))
+        np.testing.assert_array_equal(ticks['time'], expected[:, 0])
+        # pandas' CSV float parser can be 1 ulp off Python's.
+        np.testing.assert_allclose(ticks['price'], expected[:, 1], rtol=1e-15)
+
+        # Converted again when the CSV changes, and not before.
+        manifest = os.path.join(store.root, 'binance', 'dot-usdt', 'manifest.json')
+        mtime = os.path.getmtime(manifest)
+        self.assertFalse(sync_csv(store, self.data_dir, 'binance', 'dot-usdt'))
+        self.assertEqual(os.path.getmtime(manifest), mtime)
+        self.write_csv('binance', 'dot-usdt', [3, 1, 2], [1.0, 2.0, 3.0])
+        later = time.time() + 10
+        os.utime(os.path.join(self.data_dir, 'binance', 'dot-usdt.csv'), (later, later))
+        self.assertTrue(sync_csv(store, self.data_dir, 'binance', 'dot-usdt'))
+        ticks = load_ticks(store, 'binance', 'dot-usdt')
+        self.assertEqual(list(zip(ticks['time'].tolist(), ticks['price'].tolist())), [(1, 2.0), (2, 3.0), (3, 1.0)])
+        self.assertEqual(load_ticks(store, 'binance', 'dot-usdt', 2, 3)['time'].tolist(), [2])
+        # A pair without a CSV is left as the store has it.
+        self.assertFalse(sync_csv(store, self.data_dir, 'kraken', 'trx-usdt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
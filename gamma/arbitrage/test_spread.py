@@ -0,0 +1,131 @@
+# Tests of the spread engine against brute force versions of the as-of join and the windows:
+#     python -m unittest test_spread
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from spread import FEES, align, find_opportunities, net_spread, opportunity_windows
+
+
+# For every time of either stream, each side's price is the last tick at or before it, if at most `tolerance` older.
+def brute_force_align(time_a, price_a, time_b, price_b, tolerance):
+    times = sorted(set(time_a) | set(time_b))
+    prices = []
+    for tick_time, tick_price in [(time_a, price_a), (time_b, price_b)]:
+        side = []
+        for t in times:
+            before = [i for i in range(len(tick_time)) if tick_time[i] <= t]
+            side.append(tick_price[before[-1]] if before and t - tick_time[before[-1]] <= tolerance else np.nan)
+        prices.append(np.array(side, dtype=np.float64))
+    return np.array(times), prices[0], prices[1]
+
+
+# Runs of ticks with spread > min_spread, each ending at the tick that closes it or the last tick.
+def brute_force_windows(times, spread, min_spread):
+    windows = []
+    current = None
+    for t, s in zip(times, spread):
+        if not np.isnan(s) and s > min_spread:
+            if current is None:
+                current = [t, None, s, 0]
+            current[2] = max(current[2], s)
+            current[3] += 1
+        elif current is not None:
+            current[1] = t
+            windows.append(tuple(current))
+            current = None
+    if current is not None:
+        current[1] = times[-1]
+        windows.append(tuple(current))
+    return windows
+
+
+class TestAlign(unittest.TestCase):
+    def assert_aligned(self, time_a, price_a, time_b, price_b, tolerance):
+        expected = brute_force_align(time_a, price_a, time_b, price_b, tolerance)
+        result = align(np.array(time_a, dtype=np.float64), np.array(price_a), np.array(time_b, dtype=np.float64),
+                       np.array(price_b), tolerance)
+        for actual, wanted in zip(result, expected):
+            np.testing.assert_array_equal(actual, wanted)
+
+    def test_align_valid_input(self):
+        self.assert_aligned([0, 10, 20, 30], [1.0, 2.0, 3.0, 4.0], [5, 15, 25], [10.0, 20.0, 30.0], np.inf)
+
+    def test_align_boundaries(self):
+        # Ticks at the same time on both sides, several ticks at one time on a side (the last one counts), and
+        # the tolerance edge: a tick exactly `tolerance` old is still fresh, one more is stale.
+        time_a, price_a = [0, 10, 10, 20, 35], [1.0, 2.0, 2.5, 3.0, 4.0]
+        time_b, price_b = [10, 20, 20, 30, 41], [10.0, 20.0, 21.0, 30.0, 40.0]
+        for tolerance in [0, 5, 10, 11, np.inf]:
+            self.assert_aligned(time_a, price_a, time_b, price_b, tolerance)
+        times, a, b = align(np.array(time_a), np.array(price_a), np.array(time_b), np.array(price_b), 10)
+        times = list(times)
+        self.assertEqual(a[times.index(10)], 2.5)
+        self.assertEqual(b[times.index(20)], 21.0)
+        self.assertEqual(a[times.index(30)], 3.0)
+        times, a, b = align(np.array(time_a), np.array(price_a), np.array(time_b), np.array(price_b), 9)
+        self.assertTrue(np.isnan(a[list(times).index(30)]))
+
+    def test_align_random(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            time_a = np.sort(rng.integers(0, 200, rng.integers(0, 40)))
+            time_b = np.sort(rng.integers(0, 200, rng.integers(0, 40)))
+            price_a, price_b = rng.random(len(time_a)), rng.random(len(time_b))
+            self.assert_aligned(list(time_a), list(price_a), list(time_b), list(price_b), int(rng.integers(0, 30)))
+
+    def test_align_edge_cases(self):
+        self.assert_aligned([], [], [], [], np.inf)
+        self.assert_aligned([1, 2], [1.0, 2.0], [], [], np.inf)
+        self.assert_aligned([], [], [1, 2], [1.0, 2.0], 0)
+
+
+class TestOpportunityWindows(unittest.TestCase):
+    def assert_windows(self, times, spread, min_spread=0.0):
+        times, spread = np.asarray(times, dtype=np.float64), np.asarray(spread, dtype=np.float64)
+        start, end, max_spread, ticks = opportunity_windows(times, spread, min_spread)
+        self.assertEqual(list(zip(start, end, max_spread, ticks)), brute_force_windows(times, spread, min_spread))
+
+    def test_opportunity_windows_valid_input(self):
+        self.assert_windows([0, 1, 2, 3, 4, 5, 6], [-1, 0.5, 0.7, -1, 0.2, np.nan, 0.3])
+
+    def test_opportunity_windows_edge_cases(self):
+        # Open from the first tick to the last, spreads equal to min_spread (closed), and no ticks at all.
+        self.assert_windows([0, 1, 2], [0.1, 0.3, 0.2])
+        self.assert_windows([0, 1, 2, 3], [0.1, 0.1, 0.2, 0.1], min_spread=0.1)
+        self.assert_windows([], [])
+        self.assert_windows([0, 1], [np.nan, np.nan])
+
+    def test_opportunity_windows_random(self):
+        rng = np.random.default_rng(1)
+        for _ in range(50):
+            n = int(rng.integers(1, 60))
+            spread = rng.normal(0, 1, n)
+            spread[rng.random(n) < 0.1] = np.nan
+            self.assert_windows(np.cumsum(rng.integers(1, 5, n)), spread, min_spread=float(rng.normal(0, 0.5)))
+
+
+class TestFindOpportunities(unittest.TestCase):
+    def test_find_opportunities(self):
+        rng = np.random.default_rng(2)
+        ticks_a = pd.DataFrame({'time': np.sort(rng.integers(0, 10_000, 300)), 'price': 100 + rng.normal(0, 1, 300)})
+        ticks_b = pd.DataFrame({'time': np.sort(rng.integers(0, 10_000, 300)), 'price': 100 + rng.normal(0, 1, 300)})
+        windows = find_opportunities('ltc-usdt', ticks_a, ticks_b, 'binance', 'poloniex', tolerance_ms=100)
+
+        times, price_a, price_b = brute_force_align(list(ticks_a['time']), list(ticks_a['price']),
+                                                    list(ticks_b['time']), list(ticks_b['price']), 100)
+        expected = []
+        for buy, sell, buy_price, sell_price in [('binance', 'poloniex', price_a, price_b),
+                                                 ('poloniex', 'binance', price_b, price_a)]:
+            spread = net_spread(buy_price, sell_price, FEES[buy], FEES[sell])
+            expected += [(buy, sell, *window) for window in brute_force_windows(times, spread, 0.0)]
+        self.assertGreater(len(expected), 0)
+        actual = list(windows[['buy_exchange', 'sell_exchange', 'start', 'end', 'max_spread', 'ticks']]
+                      .itertuples(index=False, name=None))
+        self.assertEqual(sorted(actual), sorted(expected))
+        self.assertTrue((windows['duration_ms'] == windows['end'] - windows['start']).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
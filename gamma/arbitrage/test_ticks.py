@@ -0,0 +1,147 @@
+# Tests of the tick store against a brute force filter of the ticks written:
+#     python -m unittest test_ticks
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import ticks
+from ticks import DAY_MS, TICK_COLUMNS, TickStore, _to_ms
+
+START = 1709251200000  # 2024-03-01T00:00Z
+
+
+# Random ticks over `days` days, with runs of equal times, in random order.
+def random_ticks(rng, n, days=3, start=START):
+    time = start + rng.integers(0, days * DAY_MS, n)
+    time[rng.integers(0, n, n // 10)] = time[0]
+    time[rng.integers(0, n, n // 10)] = start + DAY_MS  # on a day boundary
+    return {'time': time, 'price': rng.random(n), 'size': rng.random(n)}
+
+
+# The ticks with start <= time < end, in time order, ticks at equal times in the order they were written.
+def brute_force_read(written, start=None, end=None):
+    rows = []
+    for chunk in written:
+        rows += zip(chunk['time'].tolist(), chunk['price'].tolist(), chunk['size'].tolist())
+    rows = sorted(rows, key=lambda row: row[0])
+    rows = [row for row in rows if (start is None or row[0] >= start) and (end is None or row[0] < end)]
+    return {col: np.array([row[i] for row in rows], dtype=dtype) for i, (col, dtype) in enumerate(TICK_COLUMNS.items())}
+
+
+class TestTickStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = TickStore(self.tmp_dir.name)
+        # Small blocks, so that the sparse index has many entries per day.
+        self.stride = mock.patch.object(ticks, 'INDEX_STRIDE', 8)
+        self.stride.start()
+
+    def tearDown(self):
+        self.stride.stop()
+        self.tmp_dir.cleanup()
+
+    def assert_ticks(self, actual, expected):
+        self.assertEqual(list(actual), list(expected))
+        for col in expected:
+            self.assertEqual(actual[col].dtype, expected[col].dtype)
+            np.testing.assert_array_equal(actual[col], expected[col])
+
+    def test_read_multi_day(self):
+        written = [random_ticks(np.random.default_rng(0), 500)]
+        self.store.write('binance', 'ltc-usdt', **written[0])
+        self.assertEqual(list(self.store.days('binance', 'ltc-usdt')), ['2024-03-01', '2024-03-02', '2024-03-03'])
+
+        for start, end in [(None, None), (START + 1000, START + 2 * DAY_MS + 1000), (START + DAY_MS, None),
+                           (None, START + DAY_MS), (START + DAY_MS, START + DAY_MS + 1), (START - DAY_MS, START),
+                           (START + 5 * DAY_MS, None)]:
+            self.assert_ticks(self.store.read('binance', 'ltc-usdt', start, end),
+                              brute_force_read(written, start, end))
+
+        # Within one day, read-only views of the files.
+        one_day = self.store.read('binance', 'ltc-usdt', START + 1000, START + DAY_MS // 2)
+        self.assertGreater(len(one_day['price']), 0)
+        self.assertFalse(one_day['price'].flags.writeable)
+        # Time strings and datetimes, naive ones in UTC, and a subset of the columns.
+        self.assert_ticks(self.store.read('binance', 'ltc-usdt', '2024-03-01T12:00', pd.Timestamp('2024-03-02'),
+                                          columns=('time', 'size')),
+                          {col: values for col, values in brute_force_read(written, START + DAY_MS // 2,
+                                                                          START + DAY_MS).items() if col != 'price'})
+        frame = self.store.read_frame('binance', 'ltc-usdt', START, START + DAY_MS)
+        self.assertEqual(frame['time'].dtype, np.dtype('datetime64[ms]'))
+        self.assertTrue((frame['time'] < pd.Timestamp('2024-03-02')).all())
+
+    def test_write_merge(self):
+        rng = np.random.default_rng(1)
+        written = [random_ticks(rng, 300, days=2)]
+        self.store.write('binance', 'ltc-usdt', **written[0])
+
+        # New ticks for the second day, some at times it already has, and for a new third day: the first day is
+        # not rewritten.
+        written.append(random_ticks(rng, 200, days=2, start=START + DAY_MS))
+        written[1]['time'][:20] = written[0]['time'][:20] + DAY_MS * (written[0]['time'][:20] < START + DAY_MS)
+        with mock.patch.object(TickStore, '_write_day', autospec=True, side_effect=TickStore._write_day) as write_day:
+            self.store.write('binance', 'ltc-usdt', **written[1])
+        self.assertEqual([call.args[3] for call in write_day.call_args_list], ['2024-03-02', '2024-03-03'])
+
+        self.assert_ticks(self.store.read('binance', 'ltc-usdt'), brute_force_read(written))
+        expected = brute_force_read(written)
+        for day, meta in self.store.days('binance', 'ltc-usdt').items():
+            day_start = pd.Timestamp(day).value // 1_000_000
+            in_day = expected['time'][(expected['time'] >= day_start) & (expected['time'] < day_start + DAY_MS)]
+            self.assertEqual(meta, {'rows': len(in_day), 'first': int(in_day[0]), 'last': int(in_day[-1])})
+        self.assertEqual(self.store.span('binance', 'ltc-usdt'), (int(expected['time'][0]), int(expected['time'][-1])))
+
+    def test_sparse_index(self):
+        rng = np.random.default_rng(2)
+        written = [random_ticks(rng, 2000), random_ticks(rng, 500)]
+        for chunk in written:
+            self.store.write('binance', 'ltc-usdt', **chunk)
+        times = np.concatenate([chunk['time'] for chunk in written])
+        day = self.store.days('binance', 'ltc-usdt')['2024-03-02']
+        index = np.load(os.path.join(self.tmp_dir.name, 'binance', 'ltc-usdt', '2024-03-02', 'index.npy'))
+        self.assertEqual(len(index), -(-day['rows'] // 8))
+
+        # Bounds at tick times (including runs of equal times and the first and last ticks), between them, and
+        # outside the data.
+        bounds = list(rng.choice(times, 100)) + list(START + rng.integers(-DAY_MS, 4 * DAY_MS, 100)) + \
+            [times.min(), times.max(), times.max() + 1, None]
+        for _ in range(300):
+            start, end = rng.choice(len(bounds), 2)
+            start, end = bounds[start], bounds[end]
+            self.assert_ticks(self.store.read('binance', 'ltc-usdt', start, end),
+                              brute_force_read(written, start, end))
+
+    def test_write_float_times(self):
+        self.store.write('binance', 'ltc-usdt', [START + 2.6, START + 0.2], [2.0, 1.0], [1.0, 1.0])
+        self.assertEqual(self.store.read('binance', 'ltc-usdt')['time'].tolist(), [START, START + 3])
+        # Float bounds are epoch ms too.
+        self.assertEqual(self.store.read('binance', 'ltc-usdt', float(START + 1), np.float64(START + 4))['price']
+                         .tolist(), [2.0])
+
+    def test_edge_cases(self):
+        empty = self.store.read('binance', 'ltc-usdt')
+        self.assert_ticks(empty, {col: np.empty(0, dtype) for col, dtype in TICK_COLUMNS.items()})
+        self.assertIsNone(self.store.span('binance', 'ltc-usdt'))
+        self.assertEqual(self.store.pairs(), [])
+        self.store.write('binance', 'ltc-usdt', [START], [1.0], [1.0])
+        self.store.write('kraken', 'dot-usdt', [START], [1.0], [1.0])
+        self.assertEqual(self.store.pairs(), [('binance', 'ltc-usdt'), ('kraken', 'dot-usdt')])
+        self.store.delete('binance', 'ltc-usdt')
+        self.assertEqual(self.store.pairs('binance'), [])
+
+    def test_to_ms(self):
+        for value in [1660557600000, np.int64(1660557600000), 1660557600000.0, np.float64(1660557600000),
+                      np.float32(2 ** 40), '2022-08-15T10:00', pd.Timestamp('2022-08-15T10:00Z'),
+                      np.datetime64('2022-08-15T10:00')]:
+            expected = 2 ** 40 if isinstance(value, np.float32) else 1660557600000
+            self.assertEqual(_to_ms(value), expected)
+            self.assertIsInstance(_to_ms(value), (int, np.integer))
+        self.assertIsNone(_to_ms(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+# Time-partitioned store of exchange tick data, in place of re-parsing data/{exchange}/{pair}.csv on every run.
+#
+# Each pair is stored under {root}/{exchange}/{pair}/ as one folder per UTC day, holding a binary .npy file per
+# column (int64 epoch-ms time, float64 price and size) sorted by time, and index.npy, the time of every
+# INDEX_STRIDE-th tick. manifest.json lists the days with their first and last tick time and row count. A range
+# query reads the manifest, memory-maps the columns of the days it overlaps, and finds its first and last row
+# with the sparse index, so only the pages of the ticks it returns (and of one index block at each end) are read.
+#
+#     python ticks.py convert --data data
+#     python ticks.py query binance ltc-usdt 2024-03-01T10:00 2024-03-01T11:00
+#
+# Reads and writes only need numpy; pandas is imported for time strings, DataFrames and the CSV conversion.
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+
+from utility.instrumentation import instrumented, report
+
+TICK_COLUMNS = {'time': np.int64, 'price': np.float64, 'size': np.float64}
+DAY_MS = 86_400_000
+INDEX_STRIDE = 4096
+# Column of the tick size in the CSV layout of data/{exchange}/{pair}.csv
+CSV_COLUMNS = {'time': 'time', 'price': 'price', 'size': 'amount'}
+
+
+class TickStore:
+    def __init__(self, root=os.path.join('data', '.store')):
+        self.root = root
+
+    # Gets the (exchange, pair) combinations in the store, of one exchange if given.
+    def pairs(self, exchange=None):
+        exchanges = [exchange] if exchange is not None else sorted(_folders(self.root))
+        return [(e, pair) for e in exchanges for pair in sorted(_folders(os.path.join(self.root, e)))]
+
+    # Gets {day: {'rows', 'first', 'last'}} of a pair, ordered by day.
+    def days(self, exchange, pair):
+        path = os.path.join(self.root, exchange, pair, 'manifest.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)['days']
+
+    # Gets the first and last tick time (epoch ms) of a pair, or None if it has no ticks.
+    def span(self, exchange, pair):
+        days = self.days(exchange, pair)
+        if not days:
+            return None
+        return min(day['first'] for day in days.values()), max(day['last'] for day in days.values())
+
+    # Adds ticks to a pair. Days that already have ticks are merged with the new ones and rewritten, others are
+    # only written, so appending the latest ticks rewrites at most the current day.
+    @instrumented(rows_in='time', rows_out=False)
+    def write(self, exchange, pair, time, price, size):
+        time = np.asarray(time)
+        if time.dtype.kind == 'f':
+            time = np.round(time)
+        time = time.astype(np.int64)
+        order = np.argsort(time, kind='stable')
+        columns = {
+            'time': time[order],
+            'price': np.asarray(price, dtype=np.float64)[order],
+            'size': np.asarray(size, dtype=np.float64)[order],
+        }
+        days = self.days(exchange, pair)
+        day_numbers = columns['time'] // DAY_MS
+        bounds = np.flatnonzero(np.r_[True, day_numbers[1:] != day_numbers[:-1], True])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            day = str(np.datetime64(int(day_numbers[lo]), 'D'))
+            chunk = {col: values[lo:hi] for col, values in columns.items()}
+            if day in days:
+                chunk = _merge(self._read_day(exchange, pair, day, 0, days[day]['rows']), chunk)
+            days[day] = self._write_day(exchange, pair, day, chunk)
+        self._write_manifest(exchange, pair, days)
+
+    # Removes a pair from the store.
+    def delete(self, exchange, pair):
+        shutil.rmtree(os.path.join(self.root, exchange, pair), ignore_errors=True)
+
+    # Gets the ticks of a pair with start <= time < end, as {column: array}. Bounds are epoch ms, or anything
+    # pd.Timestamp takes (naive times are UTC), and either can be None. Ticks inside a single day are read-only
+    # views of the memory-mapped files, ticks across days are copied into one array.
+    @instrumented(rows_out=False)
+    def read(self, exchange, pair, start=None, end=None, columns=tuple(TICK_COLUMNS)):
+        start, end = _to_ms(start), _to_ms(end)
+        parts = {col: [] for col in columns}
+        for day, meta in self.days(exchange, pair).items():
+            if (start is not None and meta['last'] < start) or (end is not None and meta['first'] >= end):
+                continue
+            lo, hi = self._locate(exchange, pair, day, meta, start, end)
+            if hi > lo:
+                for col, values in self._read_day(exchange, pair, day, lo, hi, columns).items():
+                    parts[col].append(values)
+        return {
+            col: values[0] if len(values) == 1 else np.concatenate(values) if values else np.empty(0, TICK_COLUMNS[col])
+            for col, values in parts.items()
+        }
+
+    # Same as read, as a DataFrame with the time as datetime64[ms].
+    def read_frame(self, exchange, pair, start=None, end=None, columns=tuple(TICK_COLUMNS)):
+        import pandas as pd
+
+        ticks = self.read(exchange, pair, start, end, columns)
+        if 'time' in ticks:
+            ticks['time'] = ticks['time'].view('datetime64[ms]')
+        return pd.DataFrame(ticks, columns=list(columns))
+
+    def _day_path(self, exchange, pair, day):
+        return os.path.join(self.root, exchange, pair, day)
+
+    # Finds the rows of a day with start <= time < end: the sparse index narrows each bound to one block of
+    # INDEX_STRIDE ticks, which is then searched.
+    def _locate(self, exchange, pair, day, meta, start, end):
+        if (start is None or start <= meta['first']) and (end is None or end > meta['last']):
+            return 0, meta['rows']
+        path = self._day_path(exchange, pair, day)
+        index = np.load(os.path.join(path, 'index.npy'))
+        time = np.load(os.path.join(path, 'time.npy'), mmap_mode='r')
+
+        def bound(value):
+            block = max(int(np.searchsorted(index, value, side='left')) - 1, 0)
+            lo = block * INDEX_STRIDE
+            return lo + int(np.searchsorted(time[lo:lo + INDEX_STRIDE + 1], value, side='left'))
+
+        lo = 0 if start is None else bound(start)
+        hi = meta['rows'] if end is None else bound(end)
+        return lo, hi
+
+    def _read_day(self, exchange, pair, day, lo, hi, columns=tuple(TICK_COLUMNS)):
+        path = self._day_path(exchange, pair, day)
+        return {col: np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r')[lo:hi] for col in columns}
+
+    # Writes a day under a temporary name and swaps it in, so that readers never see a partly written day.
+    def _write_day(self, exchange, pair, day, chunk):
+        path = self._day_path(exchange, pair, day)
+        tmp_path = f'{path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for col, dtype in TICK_COLUMNS.items():
+            np.save(os.path.join(tmp_path, f'{col}.npy'), np.ascontiguousarray(chunk[col], dtype=dtype))
+        np.save(os.path.join(tmp_path, 'index.npy'), np.ascontiguousarray(chunk['time'][::INDEX_STRIDE]))
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return {'rows': len(chunk['time']), 'first': int(chunk['time'][0]), 'last': int(chunk['time'][-1])}
+
+    def _write_manifest(self, exchange, pair, days):
+        path = os.path.join(self.root, exchange, pair, 'manifest.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'days': dict(sorted(days.items()))}, f)
+        os.replace(f'{path}.tmp', path)
+
+
+# Merges two chunks sorted by time, keeping the order of equal times (existing ticks first).
+def _merge(existing, new):
+    order = np.argsort(np.concatenate([existing['time'], new['time']]), kind='stable')
+    return {col: np.concatenate([existing[col], new[col]])[order] for col in TICK_COLUMNS}
+
+
+def _folders(path):
+    if not os.path.isdir(path):
+        return []
+    return [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)) and not name.startswith('.')]
+
+
+# Epoch ms as an int, from epoch ms (int or float) or anything pd.Timestamp takes. pd.Timestamp would read a number
+# as epoch ns, so numbers are only rounded.
+def _to_ms(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, (float, np.floating)):
+        return int(round(value))
+    import pandas as pd
+
+    return pd.Timestamp(value).value // 1_000_000
+
+
+# Converts every data/{exchange}/{pair}.csv (time in epoch ms, price, amount) into the store, replacing what the
+# store had for the pair. The CSVs are read in chunks of `chunksize` rows, so they need not fit in memory.
+def convert_csv(data_dir='data', store=None, exchanges=None, chunksize=1_000_000):
+    store = store if store is not None else TickStore(os.path.join(data_dir, '.store'))
+    exchanges = exchanges if exchanges is not None else sorted(_folders(data_dir))
+    converted = []
+    for exchange in exchanges:
+        folder = os.path.join(data_dir, exchange)
+        for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+            if name.endswith('.csv'):
+                pair = name[:-len('.csv')]
+                converted.append((exchange, pair, _convert_pair(store, data_dir, exchange, pair, chunksize)))
+    return converted
+
+
+# Converts data/{exchange}/{pair}.csv into the store, unless the store already has the pair from a conversion
+# newer than the CSV. Returns whether it converted the CSV. A pair without a CSV is left as the store has it.
+def sync_csv(store, data_dir, exchange, pair, chunksize=1_000_000):
+    csv_path = os.path.join(data_dir, exchange, f'{pair}.csv')
+    manifest = os.path.join(store.root, exchange, pair, 'manifest.json')
+    if not os.path.exists(csv_path) or (os.path.exists(manifest) and os.path.getmtime(manifest) >= os.path.getmtime(csv_path)):
+        return False
+    _convert_pair(store, data_dir, exchange, pair, chunksize)
+    return True
+
+
+def _convert_pair(store, data_dir, exchange, pair, chunksize):
+    import pandas as pd
+
+    store.delete(exchange, pair)
+    rows = 0
+    for chunk in pd.read_csv(os.path.join(data_dir, exchange, f'{pair}.csv'), usecols=list(CSV_COLUMNS.values()),
+                             dtype=np.float64, chunksize=chunksize):
+        store.write(exchange, pair, *(chunk[CSV_COLUMNS[col]].to_numpy() for col in TICK_COLUMNS))
+        rows += len(chunk)
+    # A CSV with only a header still marks the pair as converted.
+    if rows == 0:
+        store._write_manifest(exchange, pair, {})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', help='data/.store by default')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='convert data/{exchange}/{pair}.csv into the store')
+    convert.add_argument('--data', default='data')
+    convert.add_argument('--exchanges', nargs='+', help='every exchange folder by default')
+    query = commands.add_parser('query', help='print the ticks of a pair between two times')
+    query.add_argument('exchange')
+    query.add_argument('pair')
+    query.add_argument('start', nargs='?')
+    query.add_argument('end', nargs='?')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        store = TickStore(args.store or os.path.join(args.data, '.store'))
+        for exchange, pair, rows in convert_csv(args.data, store, args.exchanges):
+            print(f'{exchange}/{pair}: {rows} ticks')
+    else:
+        ticks = TickStore(args.store or os.path.join('data', '.store')).read_frame(
+            args.exchange, args.pair, args.start, args.end
+        )
+        print(ticks)
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+# The opt-in cache of query results (see `query`) is theta's QueryCache: theta/utility/cache.py is loaded from its
+# file, since gamma and theta are each run from their own folder. It only needs the standard library (pyarrow for
+# its disk tier), so loading it pulls in nothing else of theta.
+import importlib.util
+import os
+import sys
+
+_NAME = 'theta_utility_cache'
+_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'theta', 'utility', 'cache.py')
+
+if _NAME not in sys.modules:
+    _spec = importlib.util.spec_from_file_location(_NAME, os.path.normpath(_PATH))
+    sys.modules[_NAME] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules[_NAME])
+
+from theta_utility_cache import QueryCache
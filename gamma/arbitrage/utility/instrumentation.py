@@ -0,0 +1,17 @@
+# Timing and memory instrumentation (INSTRUMENT=1, see `instrumented`, `timed` and `report`) is delta's:
+# delta/data_ingestion/instrumentation.py is loaded from its file, since gamma and delta are each run from their
+# own folder. It only needs the standard library.
+import importlib.util
+import os
+import sys
+
+_NAME = 'data_ingestion_instrumentation'
+_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'delta', 'data_ingestion',
+                     'instrumentation.py')
+
+if _NAME not in sys.modules:
+    _spec = importlib.util.spec_from_file_location(_NAME, os.path.normpath(_PATH))
+    sys.modules[_NAME] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules[_NAME])
+
+from data_ingestion_instrumentation import ENV_VAR, OUT_ENV_VAR, REGISTRY, Registry, instrumented, report, timed
@@ -1,3 +1,17 @@
-def query(sql_stmt, cursor):
-    cursor.execute(sql_stmt)
-    return cursor.fetchall()
+from utility.instrumentation import timed
+
+
+# `cursor` is an open cursor, or a SQLConnection to borrow a pooled one from for the query.
+# With a `cache` (a utility.cache.QueryCache), a query that was run before returns its cached rows, which expire
+# after `ttl` seconds (the cache's ttl by default).
+def query(sql_stmt, cursor, cache=None, ttl=None):
+    if cache is not None:
+        return cache.fetch(cursor, sql_stmt, 'rows', lambda: query(sql_stmt, cursor), ttl)
+    if not hasattr(cursor, 'execute'):
+        with cursor.cursor() as borrowed:
+            return query(sql_stmt, borrowed)
+    with timed('query') as operation:
+        cursor.execute(sql_stmt)
+        rows = cursor.fetchall()
+        operation.rows_out = len(rows)
+    return rows
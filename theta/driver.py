@@ -1,10 +1,26 @@
-# driver to connect to SQL server and store csv data per exchange and per asset in ExchangeData folder 
+# driver to connect to SQL server and store csv data per exchange and per asset in ExchangeData folder
+# Data is stored as compressed Parquet parts (ExchangeData/{exchange}/{asset}/part-*.parquet) and each run
+# only appends rows newer than what is already exported:
+#     python driver.py --table trades --workers 8
+# With INSTRUMENT=1, the time spent in each query and export is printed at the end (see utility/instrumentation.py).
+import argparse
 from sql_connection import SQLConnection
-from utility import query, segregateExchangeAndAssets
+from utility import query, report, segregateExchangeAndAssets
 
-if __name__ == "__main__":
-    SQLObject = SQLConnection()
-    connection = SQLObject.create_connection()
-    cursor = connection.cursor()
 
-    # connection successful (add operations to read data here)
\ No newline at end of file
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--table', default='trades', help='table with the exchange trades')
+    parser.add_argument('--out', default='ExchangeData', help='folder to export to')
+    parser.add_argument('--workers', type=int, default=4, help='number of partitions exported at once')
+    args = parser.parse_args(argv)
+
+    SQLObject = SQLConnection(pool_size=args.workers)
+    exported = segregateExchangeAndAssets(SQLObject, args.table, args.out, args.workers)
+    for (exchange, asset), n_rows in sorted(exported.items()):
+        print(f"{exchange} {asset}: {n_rows} new rows")
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,224 @@
 import os
-import mysql.connector
-import pandas as pd
-import rollbar
-from dotenv import load_dotenv
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# mysql.connector, rollbar and dotenv are imported on first use rather than here: importing them takes longer
+# than a short script's work, and a script that connects to SQLite or never fails does not need all of them.
+_env_loaded = False
+
+# MySQL errors of a server that is unreachable, restarting or out of connections, which a later attempt can get
+# past: too many connections, shutdown in progress, can't connect (socket / TCP), server gone away, lost connection.
+_TRANSIENT_MYSQL_ERRORS = {1040, 1053, 2002, 2003, 2006, 2013}
+
+
+def load_env():
+    """Loads .env into the environment, once per process. It is looked up from the working directory rather than
+    from this file, since gamma loads this module from theta's folder (see gamma/arbitrage/sql_connection.py)."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import find_dotenv, load_dotenv
+
+        load_dotenv(find_dotenv(usecwd=True))
+        _env_loaded = True
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of open database connections.
+
+    `connect` opens a new connection. Connections are opened lazily, up to `pool_size` at once, and
+    connections that sat idle for longer than `health_check_interval` seconds are checked with a
+    `SELECT 1` before being handed out again (and replaced if the check fails).
+
+    Connecting is retried `max_retries` times on transient errors (see `_is_transient`), sleeping `backoff`
+    seconds doubled on every attempt, up to `max_backoff`. Other errors, such as bad credentials or an unknown
+    database, are raised at once.
+    """
+
+    def __init__(self, connect, pool_size=5, max_retries=3, backoff=0.5, health_check_interval=30.0,
+                 max_backoff=8.0):
+        assert pool_size > 0
+        assert max_retries >= 0
+        self.connect = connect
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def get(self, timeout=None):
+        """Checks out a connection, waiting up to `timeout` seconds for one to be returned if the pool is full."""
+        if not self._slots.acquire(timeout=-1 if timeout is None else timeout):
+            raise TimeoutError(f"no connection available in the pool after {timeout}s")
+        try:
+            while True:
+                try:
+                    connection, returned_at = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._open()
+                if time.monotonic() - returned_at < self.health_check_interval or self._is_healthy(connection):
+                    return connection
+                self._close(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def put(self, connection, discard=False):
+        """Returns a checked out connection to the pool, or closes it if `discard`."""
+        if discard or not self._reset(connection):
+            self._close(connection)
+        else:
+            self._idle.put((connection, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrows a connection for the duration of a `with` block. The connection is discarded instead of
+        returned if the block raises, since its state is then unknown."""
+        connection = self.get(timeout)
+        discard = False
+        try:
+            yield connection
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.put(connection, discard)
+
+    def close(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+    def _open(self):
+        """Opens a new connection, retrying transient errors with exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.connect()
+            except Exception as err:
+                if attempt == self.max_retries or not self._is_transient(err):
+                    print(err)
+                    import rollbar
+
+                    rollbar.report_exc_info()
+                    raise
+                time.sleep(min(self.backoff * 2 ** attempt, self.max_backoff))
+
+    @staticmethod
+    def _is_transient(err):
+        """Whether connecting again can succeed: a DB-API OperationalError (e.g. a lost connection, or a locked
+        SQLite file), a network error, or a MySQL error of a server that is unreachable or busy."""
+        if any(cls.__name__ == 'OperationalError' for cls in type(err).__mro__):
+            return True
+        if isinstance(err, (ConnectionError, TimeoutError)):
+            return True
+        return getattr(err, 'errno', None) in _TRANSIENT_MYSQL_ERRORS
+
+    @staticmethod
+    def _is_healthy(connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(connection):
+        """Ends any open transaction, so that the next borrower does not read from a stale snapshot."""
+        try:
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
 
-load_dotenv()
 
 class SQLConnection:
-    def __init__(self):
+    """
+    Connection settings for our MySQL server, read from the environment (.env).
+
+    Every SQLConnection with the same settings (credentials, database, `connect` and pool settings) shares one
+    ConnectionPool, so scripts borrow an open connection instead of connecting for every query:
+    ```
+    sql = SQLConnection()
+    with sql.cursor() as cursor:
+        cursor.execute(...)
+    ```
+    `connect` replaces mysql.connector.connect, e.g. with `lambda: sqlite3.connect(path)` in tests.
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, pool_size=5, max_retries=3, backoff=0.5, connect=None):
+        load_env()
         self.__user = os.environ.get('USERNAME')
         self.__password = os.environ.get('PASSWORD')
         self.__host = os.environ.get('HOST')
         self.__database = os.environ.get('DATABASE')
-        
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.__connect = connect
+
+    @property
+    def pool(self):
+        key = (self.__user, self.__password, self.__host, self.__database, self.__connect,
+               self.pool_size, self.max_retries, self.backoff)
+        with SQLConnection._pools_lock:
+            if key not in SQLConnection._pools:
+                SQLConnection._pools[key] = ConnectionPool(
+                    self.__connect or self.__connect_mysql, self.pool_size, self.max_retries, self.backoff
+                )
+            return SQLConnection._pools[key]
+
+    @property
+    def cache_key(self):
+        """Identifies the database for query result caches (see utility.cache.QueryCache)."""
+        if self.__connect is not None:
+            return (self.__user, self.__host, self.__database, repr(self.__connect))
+        return (self.__user, self.__host, self.__database)
+
     def create_connection(self):
+        """Opens a new connection that is not part of the pool. The caller closes it."""
+        return ConnectionPool(self.__connect or self.__connect_mysql, 1, self.max_retries, self.backoff)._open()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrows a pooled connection for the duration of a `with` block."""
+        with self.pool.connection(timeout) as connection:
+            yield connection
+
+    @contextmanager
+    def cursor(self, timeout=None):
+        """Borrows a pooled connection and opens a cursor on it for the duration of a `with` block."""
+        with self.pool.connection(timeout) as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def __connect_mysql(self):
+        import mysql.connector
+
         config = {
             'user': self.__user,
             'password': self.__password,
@@ -21,9 +226,4 @@ class SQLConnection:
             'database': self.__database,
             'raise_on_warnings': True
         }
-        try:
-            return mysql.connector.connect(**config)
-        except mysql.connector.Error as err:
-            print(err)
-            rollbar.report_exc_info()
-            exit()
\ No newline at end of file
+        return mysql.connector.connect(**config)
@@ -0,0 +1,179 @@
+# Tests of the connection pool against SQLite-backed connections:
+#     python -m unittest test_sql_connection
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import sql_connection
+from sql_connection import ConnectionPool, SQLConnection
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'test.db')
+        self.opened = []
+
+    def tearDown(self):
+        for connection in self.opened:
+            connection.close()
+        self.tmp_dir.cleanup()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.opened.append(connection)
+        return connection
+
+    # Connects after failing `failures` times with `error`.
+    def flaky_connect(self, failures, error):
+        calls = []
+
+        def connect():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise error
+            return self.connect()
+        return connect, calls
+
+    def test_checkout_and_return(self):
+        pool = ConnectionPool(self.connect, pool_size=2)
+        first = pool.get()
+        second = pool.get()
+        self.assertIsNot(first, second)
+        # The pool is full until a connection is returned.
+        with self.assertRaises(TimeoutError):
+            pool.get(timeout=0.01)
+
+        pool.put(first)
+        self.assertIs(pool.get(timeout=0.01), first)
+        pool.put(first)
+        pool.put(second)
+        self.assertEqual(len(self.opened), 2)
+
+        # A waiting borrower gets the connection returned by another thread.
+        held = [pool.get(), pool.get()]
+        threading.Timer(0.05, pool.put, args=(held[0],)).start()
+        self.assertIs(pool.get(timeout=5), held[0])
+
+    def test_return_rolls_back(self):
+        pool = ConnectionPool(self.connect, pool_size=1)
+        with pool.connection() as connection:
+            connection.execute("CREATE TABLE t (x INTEGER)")
+            connection.commit()
+            connection.execute("INSERT INTO t VALUES (1)")
+        with pool.connection() as connection:
+            self.assertEqual(connection.execute("SELECT COUNT(*) FROM t").fetchone(), (0,))
+
+    def test_health_check_replaces_broken_connections(self):
+        pool = ConnectionPool(self.connect, pool_size=1, health_check_interval=0.0)
+        connection = pool.get()
+        pool.put(connection)
+        # Checked, and healthy.
+        self.assertIs(pool.get(), connection)
+        pool.put(connection)
+
+        connection.close()
+        replacement = pool.get()
+        self.assertIsNot(replacement, connection)
+        self.assertEqual(replacement.execute("SELECT 1").fetchone(), (1,))
+        pool.put(replacement)
+
+        # Connections returned recently are not checked.
+        pool = ConnectionPool(self.connect, pool_size=1, health_check_interval=60.0)
+        connection = pool.get()
+        pool.put(connection)
+        with mock.patch.object(ConnectionPool, '_is_healthy') as is_healthy:
+            self.assertIs(pool.get(), connection)
+        is_healthy.assert_not_called()
+
+    def test_discard_on_exception(self):
+        pool = ConnectionPool(self.connect, pool_size=1)
+        with self.assertRaises(ValueError):
+            with pool.connection() as connection:
+                raise ValueError()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+        # The slot was released, and a new connection is opened in its place.
+        with pool.connection(timeout=0.01) as replacement:
+            self.assertIsNot(replacement, connection)
+
+    def test_retry_with_capped_backoff(self):
+        connect, calls = self.flaky_connect(2, sqlite3.OperationalError('database is locked'))
+        pool = ConnectionPool(connect, pool_size=1, max_retries=3, backoff=0.5)
+        with mock.patch.object(sql_connection.time, 'sleep') as sleep:
+            pool.put(pool.get())
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.5, 1.0])
+
+        # Gives up after max_retries, and every sleep is at most max_backoff.
+        connect, calls = self.flaky_connect(10, sqlite3.OperationalError('unable to open database file'))
+        pool = ConnectionPool(connect, pool_size=1, max_retries=4, backoff=1.0, max_backoff=2.5)
+        with mock.patch.object(sql_connection.time, 'sleep') as sleep, mock.patch('rollbar.report_exc_info'):
+            with self.assertRaises(sqlite3.OperationalError):
+                pool.get()
+        self.assertEqual(len(calls), 5)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1.0, 2.0, 2.5, 2.5])
+        # The failed checkout released its slot.
+        pool.connect = self.connect
+        pool.put(pool.get(timeout=0.01))
+
+    def test_no_retry_on_permanent_errors(self):
+        class DatabaseError(Exception):
+            def __init__(self, errno):
+                super().__init__(errno)
+                self.errno = errno
+
+        for error in [sqlite3.ProgrammingError('bad'), DatabaseError(1045), DatabaseError(1049)]:
+            connect, calls = self.flaky_connect(1, error)
+            pool = ConnectionPool(connect, pool_size=1, max_retries=3)
+            with mock.patch.object(sql_connection.time, 'sleep') as sleep, mock.patch('rollbar.report_exc_info'):
+                with self.assertRaises(type(error)):
+                    pool.get()
+            self.assertEqual(len(calls), 1)
+            sleep.assert_not_called()
+
+        # A MySQL server that refused the connection is retried.
+        connect, calls = self.flaky_connect(1, DatabaseError(2003))
+        pool = ConnectionPool(connect, pool_size=1, max_retries=3)
+        with mock.patch.object(sql_connection.time, 'sleep'):
+            pool.put(pool.get())
+        self.assertEqual(len(calls), 2)
+
+
+class TestSQLConnection(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, 'test.db')
+        self.connect = lambda: sqlite3.connect(path, check_same_thread=False)
+
+    def tearDown(self):
+        for pool in SQLConnection._pools.values():
+            pool.close()
+        SQLConnection._pools.clear()
+        self.tmp_dir.cleanup()
+
+    def test_shared_pools(self):
+        sql = SQLConnection(pool_size=2, connect=self.connect)
+        self.assertIs(SQLConnection(pool_size=2, connect=self.connect).pool, sql.pool)
+        with sql.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            self.assertEqual(cursor.fetchall(), [(1,)])
+
+        # Other pool settings get their own pool, with those settings.
+        for other in [SQLConnection(pool_size=8, connect=self.connect),
+                      SQLConnection(pool_size=2, max_retries=0, connect=self.connect),
+                      SQLConnection(pool_size=2, backoff=2.0, connect=self.connect)]:
+            self.assertIsNot(other.pool, sql.pool)
+            self.assertEqual((other.pool.pool_size, other.pool.max_retries, other.pool.backoff),
+                             (other.pool_size, other.max_retries, other.backoff))
+
+        # So do other credentials.
+        with mock.patch.dict(os.environ, {'PASSWORD': 'other'}):
+            self.assertIsNot(SQLConnection(pool_size=2, connect=self.connect).pool, sql.pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
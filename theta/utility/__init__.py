@@ -0,0 +1,4 @@
+from utility.cache import QueryCache
+from utility.instrumentation import REGISTRY, instrumented, report, timed
+from utility.query import query, query_df, query_df_chunks
+from utility.export import segregateExchangeAndAssets
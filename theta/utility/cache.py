@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Opt-in cache of query results (see `query` and `query_df`), for notebooks and scripts that run the same
+# historical queries over and over:
+#     cache = QueryCache(max_bytes=512 * 2**20, disk_dir='.query_cache', ttl=3600)
+#     rows = query("SELECT * FROM trades WHERE exchange = 'binance'", sql, cache=cache)
+#     cache.invalidate('trades')  # after trades changed
+#     print(cache.stats)
+#
+# Results are keyed on the SQL (whitespace collapsed outside of quoted literals), its parameters, the kind of
+# result (rows or DataFrame) and the database: `cache_key` of a SQLConnection (user, host and database), or the
+# cache's `namespace` for a plain cursor. They are kept in memory in LRU order up to `max_bytes`, and if
+# `disk_dir` is given also written there as zstd compressed Arrow files, which outlive the process and are read
+# back on a memory miss. Entries expire after `ttl` seconds (None: never), which `query` can override per query.
+# `invalidate(table)` drops every entry whose query reads the table. Results are copied on the way out, so
+# callers can modify them.
+#
+# gamma/arbitrage/utility/cache.py loads this file, so that theta and gamma share one QueryCache.
+class QueryCache:
+    def __init__(self, max_bytes=256 * 2**20, ttl=None, disk_dir=None, disk_max_bytes=None, namespace=None):
+        assert max_bytes >= 0
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = dict(memory_hits=0, disk_hits=0, misses=0, evictions=0, fetch_seconds=0.0, saved_seconds=0.0)
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # Gets the cached result of `sql_query` on `source`, or runs `run()` and caches its result. `kind` is 'rows'
+    # (a list of tuples) or 'frame' (a DataFrame).
+    def fetch(self, source, sql_query: str, kind: str, run, ttl=None, params=None):
+        assert kind in ('rows', 'frame')
+        key = self._key(source, sql_query, kind, params)
+        entry = self._get(key)
+        if entry is not None:
+            return _copy(entry['result'])
+
+        start = time.perf_counter()
+        result = run()
+        seconds = time.perf_counter() - start
+        ttl = self.ttl if ttl is None else ttl
+        entry = {
+            'result': result, 'kind': kind, 'tables': _tables(sql_query), 'seconds': seconds,
+            'expires_at': None if ttl is None else time.time() + ttl, 'bytes': _sizeof(result),
+        }
+        with self._lock:
+            self._stats['misses'] += 1
+            self._stats['fetch_seconds'] += seconds
+            self._remember(key, entry)
+        if self.disk_dir is not None:
+            self._write_disk(key, entry)
+        return _copy(result)
+
+    # Drops every entry whose query reads `table` (matched on its name without schema, case insensitively).
+    # Returns the number of entries dropped from memory and disk.
+    def invalidate(self, table: str) -> int:
+        table = _table_name(table)
+        dropped = 0
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if table in entry['tables']]:
+                self._forget(key)
+                dropped += 1
+        for path, entry in self._disk_entries():
+            if table in entry.get('tables', []):
+                _remove(path)
+                dropped += 1
+        return dropped
+
+    # Drops every entry, from memory and disk.
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        for path, _ in self._disk_entries():
+            _remove(path)
+
+    # Hit, miss and size counters. `saved_seconds` adds up the time the cached queries took when they were run,
+    # once per hit, which is the round-trip time the cache saved.
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        stats['disk_bytes'] = sum(os.path.getsize(path) for path, _ in self._disk_entries(metadata=False))
+        return stats
+
+    def _key(self, source, sql_query, kind, params):
+        namespace = getattr(source, 'cache_key', None)
+        if namespace is None:
+            namespace = self.namespace
+        assert namespace is not None, "a plain cursor is only cached with a QueryCache namespace naming its database"
+        return repr((namespace, kind, _normalize(sql_query), None if params is None else tuple(params)))
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['expires_at'] is None or entry['expires_at'] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    self._stats['saved_seconds'] += entry['seconds']
+                    return entry
+                self._forget(key)
+        if self.disk_dir is None:
+            return None
+        entry = self._read_disk(key, now)
+        if entry is not None:
+            with self._lock:
+                self._stats['disk_hits'] += 1
+                self._stats['saved_seconds'] += entry['seconds']
+                self._remember(key, entry)
+        return entry
+
+    # Adds an entry in memory, evicting the least recently used ones to stay under `max_bytes`. Results larger
+    # than `max_bytes` are not kept in memory.
+    def _remember(self, key, entry):
+        if key in self._entries:
+            self._forget(key)
+        if entry['bytes'] > self.max_bytes:
+            return
+        while self._bytes + entry['bytes'] > self.max_bytes:
+            self._forget(next(iter(self._entries)))
+            self._stats['evictions'] += 1
+        self._entries[key] = entry
+        self._bytes += entry['bytes']
+
+    def _forget(self, key):
+        self._bytes -= self._entries.pop(key)['bytes']
+
+    ############################################
+    # Disk tier
+    ############################################
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.arrow")
+
+    # Writes an entry as a zstd compressed Arrow IPC file, with the entry's details in the schema metadata.
+    # Results Arrow cannot hold (e.g. columns of mixed types) are only cached in memory.
+    def _write_disk(self, key, entry):
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        try:
+            if entry['kind'] == 'frame':
+                table = pa.Table.from_pandas(entry['result'])
+            else:
+                columns = list(zip(*entry['result']))
+                table = pa.table({f'c{i}': pa.array(column) for i, column in enumerate(columns)})
+        except (pa.ArrowException, TypeError, ValueError):
+            return
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'query_cache'] = json.dumps({
+            'key': key, 'kind': entry['kind'], 'tables': entry['tables'], 'seconds': entry['seconds'],
+            'expires_at': entry['expires_at'], 'rows': len(entry['result']),
+        }).encode()
+        path = self._disk_path(key)
+        feather.write_feather(table.replace_schema_metadata(metadata), f'{path}.tmp', compression='zstd')
+        os.replace(f'{path}.tmp', path)
+        if self.disk_max_bytes is not None:
+            self._evict_disk()
+
+    def _read_disk(self, key, now):
+        import pyarrow as pa
+
+        path = self._disk_path(key)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pa.ArrowException):
+            return None
+        entry = _disk_metadata(table.schema)
+        if entry.get('key') != key or (entry['expires_at'] is not None and entry['expires_at'] <= now):
+            _remove(path)
+            return None
+        # Marks the file as recently used for the disk's LRU eviction.
+        os.utime(path)
+        if entry['kind'] == 'frame':
+            entry['result'] = table.to_pandas()
+        elif table.num_columns:
+            entry['result'] = list(zip(*(column.to_pylist() for column in table.columns)))
+        else:
+            entry['result'] = [()] * entry['rows']
+        entry['bytes'] = _sizeof(entry['result'])
+        return entry
+
+    # Gets (path, entry details) of every file of the disk tier.
+    def _disk_entries(self, metadata=True):
+        import pyarrow as pa
+
+        if self.disk_dir is None:
+            return []
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.arrow'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            if not metadata:
+                entries.append((path, None))
+                continue
+            try:
+                with pa.memory_map(path) as source:
+                    entries.append((path, _disk_metadata(pa.ipc.open_file(source).schema)))
+            except (FileNotFoundError, pa.ArrowException):
+                continue
+        return entries
+
+    # Removes the least recently used files until the disk tier fits in `disk_max_bytes`.
+    def _evict_disk(self):
+        files = []
+        for path, _ in self._disk_entries(metadata=False):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def _disk_metadata(schema) -> dict:
+    return json.loads((schema.metadata or {}).get(b'query_cache', b'{}'))
+
+
+_LITERAL = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)""")
+_TABLE_LIST = re.compile(
+    r'\b(?:from|join)\s+([\w`".$]+(?:\s+(?:as\s+)?\w+)?(?:\s*,\s*[\w`".$]+(?:\s+(?:as\s+)?\w+)?)*)',
+    re.IGNORECASE,
+)
+
+
+# Collapses whitespace outside of quoted literals and drops a trailing semicolon, so that the same query
+# written over several lines or with different indentation shares one entry.
+def _normalize(sql_query: str) -> str:
+    parts = _LITERAL.split(sql_query)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i])
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+# Gets the tables a query reads (names without schema, lowercased), from its FROM and JOIN clauses.
+def _tables(sql_query: str) -> list:
+    tables = set()
+    without_strings = _LITERAL.sub(lambda literal: literal.group(0) if literal.group(0)[0] == '`' else "''", sql_query)
+    for match in _TABLE_LIST.finditer(without_strings):
+        for item in match.group(1).split(','):
+            tables.add(_table_name(item.split()[0]))
+    return sorted(tables)
+
+
+def _table_name(table: str) -> str:
+    return table.split('.')[-1].strip('`"').lower()
+
+
+# Estimates the memory a result holds. Rows are sampled, since measuring every value would cost about as much
+# as converting them.
+def _sizeof(result) -> int:
+    if _is_frame(result):
+        return int(result.memory_usage(index=True, deep=True).sum())
+    sample = result[:1000]
+    sample_bytes = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample)
+    return sys.getsizeof(result) + int(sample_bytes / max(len(sample), 1) * len(result))
+
+
+def _copy(result):
+    return result.copy() if _is_frame(result) else list(result)
+
+
+# A DataFrame can only exist once pandas was imported, so caching rows never imports it.
+def _is_frame(result) -> bool:
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(result, pd.DataFrame)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,178 @@
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utility.instrumentation import instrumented
+from utility.query import query, query_df_chunks
+
+# util for exporting exchange data to ExchangeData/{exchange}/{asset}/part-*.parquet
+# Every run appends one zstd compressed Parquet part per (exchange, asset) with the rows whose `time` is
+# newer than the newest row already exported, so re-running only fetches new data. Rows with the same `time` as
+# the newest exported row are fetched again too, and the ones already exported dropped, so rows inserted after an
+# export with that time are not lost.
+# Every part of a table is written with one Arrow schema: the schema of the parts already exported to `out_dir`,
+# or else inferred from a sample of the table, so parts never disagree on a column's type.
+# pyarrow is imported by the functions that write and read the parts, when the export starts.
+
+TIME_COL = 'time'
+EXCHANGE_COL = 'exchange'
+ASSET_COL = 'instrmnt'
+
+# Discovers every (exchange, asset) partition of `table_name` and exports them concurrently over at most
+# `workers` pooled connections of `sql` (a SQLConnection). `placeholder` is the driver's query parameter
+# placeholder ("%s" for mysql.connector, "?" for sqlite3). Returns the number of new rows per partition.
+@instrumented(rows_out=False)
+def segregateExchangeAndAssets(sql, table_name: str, out_dir: str = 'ExchangeData', workers: int = 4,
+                               batch_size: int = 100_000, placeholder: str = '%s') -> dict:
+    partitions = query(f"SELECT DISTINCT {EXCHANGE_COL}, {ASSET_COL} FROM {table_name}", sql)
+    schema = getExportSchema(sql, table_name, out_dir, batch_size) if partitions else None
+    exported = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(exportPartition, sql, table_name, exchange, asset, out_dir, batch_size, placeholder,
+                            schema): (exchange, asset)
+            for exchange, asset in partitions
+        }
+        for future in as_completed(futures):
+            exported[futures[future]] = future.result()
+    return exported
+
+# Appends the new rows of one (exchange, asset) partition to its folder and returns how many there were.
+# `schema` is the Arrow schema of the parts (see getExportSchema); by default the schema of the parts already in
+# the folder, or else the one inferred from the first rows fetched.
+@instrumented()
+def exportPartition(sql, table_name: str, exchange: str, asset: str, out_dir: str = 'ExchangeData',
+                    batch_size: int = 100_000, placeholder: str = '%s', schema=None) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    folder = os.path.join(out_dir, exchange, asset)
+    last_time = getLastExportedTime(folder)
+    if schema is None:
+        schema = getExportedSchema(folder)
+
+    sql_query = f"SELECT * FROM {table_name} WHERE {EXCHANGE_COL} = {placeholder} AND {ASSET_COL} = {placeholder}"
+    params = [exchange, asset]
+    exported = Counter()
+    if last_time is not None:
+        # `>=`: rows inserted since the last export with the time of its newest row are new too, and the rows
+        # that were exported at that time are dropped from the result.
+        sql_query += f" AND {TIME_COL} >= {placeholder}"
+        params.append(last_time)
+        exported = getExportedRowsAt(folder, last_time)
+    sql_query += f" ORDER BY {TIME_COL}"
+
+    os.makedirs(folder, exist_ok=True)
+    n_parts = len([f for f in os.listdir(folder) if f.endswith('.parquet')])
+    path = os.path.join(folder, f"part-{n_parts:05d}.parquet")
+    # Written under a temporary name so that an interrupted export never leaves a partial part behind.
+    tmp_path = f"{path}.tmp"
+
+    n_rows = 0
+    writer = None
+    try:
+        for chunk in query_df_chunks(sql_query, sql, batch_size, params):
+            if len(chunk) == 0:
+                continue
+            if schema is None:
+                schema = inferSchema(chunk)
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if exported:
+                table = dropExportedRows(table, last_time, exported)
+                if table.num_rows == 0:
+                    continue
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, schema, compression='zstd')
+            writer.write_table(table)
+            n_rows += table.num_rows
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    if writer is not None:
+        writer.close()
+
+    if n_rows:
+        os.replace(tmp_path, path)
+    return n_rows
+
+# Gets the newest `time` already exported to a partition folder from the Parquet column statistics,
+# without reading any rows. None if nothing was exported yet.
+def getLastExportedTime(folder: str):
+    import pyarrow.parquet as pq
+
+    last_time = None
+    for path in getParts(folder):
+        metadata = pq.ParquetFile(path).metadata
+        column = metadata.schema.names.index(TIME_COL)
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(column).statistics
+            if statistics is not None and statistics.has_min_max:
+                last_time = statistics.max if last_time is None else max(last_time, statistics.max)
+    return last_time
+
+# Gets the Arrow schema every part of `table_name` is written with: the schema of a part already exported to
+# `out_dir`, so that new parts match the old ones, or else the one inferred from its first `sample_size` rows.
+def getExportSchema(sql, table_name: str, out_dir: str = 'ExchangeData', sample_size: int = 100_000):
+    import pyarrow.parquet as pq
+
+    for root, _, names in os.walk(out_dir):
+        for name in sorted(names):
+            if name.endswith('.parquet'):
+                return pq.read_schema(os.path.join(root, name))
+    sample = next(query_df_chunks(f"SELECT * FROM {table_name} LIMIT {sample_size}", sql, sample_size))
+    return inferSchema(sample)
+
+# Gets the schema of the parts exported to a partition folder, or None if there are none yet.
+def getExportedSchema(folder: str):
+    import pyarrow.parquet as pq
+
+    parts = getParts(folder)
+    return pq.read_schema(parts[0]) if parts else None
+
+# Infers the Arrow schema of a DataFrame of query results. Columns that are NULL in every row have no type to
+# infer, and are written as strings.
+def inferSchema(frame):
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(frame, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+# Counts the rows exported to a partition folder with `time` equal to `last_time`, as tuples of their values.
+def getExportedRowsAt(folder: str, last_time) -> Counter:
+    import pyarrow.parquet as pq
+
+    exported = Counter()
+    for path in getParts(folder):
+        table = pq.read_table(path, filters=[(TIME_COL, '==', last_time)])
+        exported.update(tuple(row.values()) for row in table.to_pylist())
+    return exported
+
+# Drops the rows of `table` (a chunk fetched from `last_time` on) that were already exported: every row at
+# `last_time` found in `exported` is dropped and uncounted, so rows that are exact duplicates are kept as many
+# times as they were not exported yet.
+def dropExportedRows(table, last_time, exported: Counter):
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    at_last_time = pc.equal(table[TIME_COL], pa.scalar(last_time, table.schema.field(TIME_COL).type))
+    positions = np.flatnonzero(at_last_time.to_numpy(zero_copy_only=False))
+    if len(positions) == 0:
+        return table
+    keep = np.ones(table.num_rows, dtype=bool)
+    for position, row in zip(positions, table.take(positions).to_pylist()):
+        key = tuple(row.values())
+        if exported[key] > 0:
+            exported[key] -= 1
+            keep[position] = False
+    return table.filter(pa.array(keep))
+
+def getParts(folder: str) -> list:
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith('.parquet')]
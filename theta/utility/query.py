@@ -1,12 +1,68 @@
-import pandas as pd
+from utility.instrumentation import timed
 
 # util for querying data
-def query(sql_query: str, cursor) -> list[str]:
-    cursor.execute(sql_query)
-    return cursor.fetchall()
-
-def query_df(sql_query: str, table_name: str, cursor) -> list[str]:
-    cols = [r[0] for r in query(f"SHOW COLUMNS FROM {table_name}", cursor)]
-    df = pd.DataFrame(query(sql_query, cursor))
-    df.columns = cols
-    return df
\ No newline at end of file
+# pandas is imported by the functions that return DataFrames, so that importing `query` alone stays fast.
+# `cursor` is an open cursor, or a SQLConnection to borrow a pooled one from for the query.
+# With a `cache` (a QueryCache), a query that was run before returns its cached rows, which expire after `ttl`
+# seconds (the cache's ttl by default).
+def query(sql_query: str, cursor, cache=None, ttl=None) -> list[str]:
+    if cache is not None:
+        return cache.fetch(cursor, sql_query, 'rows', lambda: query(sql_query, cursor), ttl)
+    if not hasattr(cursor, 'execute'):
+        with cursor.cursor() as borrowed:
+            return query(sql_query, borrowed)
+    with timed('query') as operation:
+        cursor.execute(sql_query)
+        rows = cursor.fetchall()
+        operation.rows_out = len(rows)
+    return rows
+
+# `table_name` is no longer needed (column names come from the cursor) and is kept for existing callers.
+# `cache` and `ttl` are the same as for `query`.
+def query_df(sql_query: str, table_name: str = None, cursor=None, batch_size: int = 50_000, cache=None,
+             ttl=None) -> 'pandas.DataFrame':
+    import pandas as pd
+
+    if cache is not None:
+        run = lambda: query_df(sql_query, cursor=cursor, batch_size=batch_size)
+        return cache.fetch(cursor, sql_query, 'frame', run, ttl)
+    with timed('query_df') as operation:
+        chunks = list(query_df_chunks(sql_query, cursor, batch_size))
+        result = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+        operation.rows_out = len(result)
+    return result
+
+# Streams the result of a query as DataFrames of at most `batch_size` rows, so that large exports run in
+# bounded memory. Rows are read with fetchmany, so with an unbuffered cursor (the mysql.connector default,
+# and what a SQLConnection hands out) the result is never held in full on the client.
+# Column names come from the cursor metadata. `params` are passed to the driver for the query's placeholders.
+def query_df_chunks(sql_query: str, cursor, batch_size: int = 50_000, params=None):
+    import pandas as pd
+
+    assert batch_size > 0
+    if not hasattr(cursor, 'execute'):
+        with cursor.cursor() as borrowed:
+            yield from query_df_chunks(sql_query, borrowed, batch_size, params)
+        return
+
+    # Timed per batch, so that the time the caller spends on each chunk is not counted.
+    with timed('query_df_chunks.execute'):
+        if params is None:
+            cursor.execute(sql_query)
+        else:
+            cursor.execute(sql_query, params)
+    cols = [d[0] for d in cursor.description]
+    empty = True
+    while True:
+        with timed('query_df_chunks.fetch') as operation:
+            rows = cursor.fetchmany(batch_size)
+            # Each batch is converted to typed columns straight away, so no more than one batch of row tuples
+            # exists.
+            chunk = pd.DataFrame.from_records(rows, columns=cols, coerce_float=True) if rows else None
+            operation.rows_out = len(rows)
+        if chunk is None:
+            break
+        empty = False
+        yield chunk
+    if empty:
+        yield pd.DataFrame(columns=cols)
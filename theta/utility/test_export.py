@@ -0,0 +1,94 @@
+# Tests of the incremental Parquet export against a SQLite trades table:
+#     python -m unittest utility.test_export
+import os
+import sqlite3
+import tempfile
+import unittest
+from collections import Counter
+
+import pyarrow.parquet as pq
+
+from sql_connection import SQLConnection
+from utility.export import getParts, segregateExchangeAndAssets
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, 'trades.db')
+        self.out_dir = os.path.join(self.tmp_dir.name, 'ExchangeData')
+        self.sql = SQLConnection(connect=lambda: sqlite3.connect(path, check_same_thread=False))
+        with self.sql.connection() as connection:
+            connection.execute("CREATE TABLE trades (time INTEGER, exchange TEXT, instrmnt TEXT, price REAL, "
+                               "amount REAL, note TEXT)")
+            connection.commit()
+
+    def tearDown(self):
+        for pool in SQLConnection._pools.values():
+            pool.close()
+        SQLConnection._pools.clear()
+        self.tmp_dir.cleanup()
+
+    def insert(self, rows):
+        with self.sql.connection() as connection:
+            connection.executemany("INSERT INTO trades VALUES (?, ?, ?, ?, ?, ?)", rows)
+            connection.commit()
+
+    def export(self):
+        return segregateExchangeAndAssets(self.sql, 'trades', self.out_dir, workers=2, batch_size=3, placeholder='?')
+
+    def exported(self, exchange, asset):
+        parts = getParts(os.path.join(self.out_dir, exchange, asset))
+        return [pq.read_table(part) for part in parts]
+
+    def assert_exported_everything(self):
+        with self.sql.cursor() as cursor:
+            cursor.execute("SELECT * FROM trades")
+            rows = cursor.fetchall()
+        for exchange, asset in {(row[1], row[2]) for row in rows}:
+            exported = Counter(tuple(row.values()) for table in self.exported(exchange, asset) for row in table.to_pylist())
+            self.assertEqual(exported, Counter(row for row in rows if row[1:3] == (exchange, asset)))
+
+    def test_export_and_resume(self):
+        self.insert([
+            (1, 'binance', 'BTC', 100.0, 1.0, None), (2, 'binance', 'BTC', 101.0, 2.0, None),
+            (2, 'binance', 'BTC', 102.0, 3.0, None), (3, 'binance', 'BTC', 103.0, 4.0, None),
+            (1, 'kraken', 'ETH', 10.0, 1.0, None),
+        ])
+        self.assertEqual(self.export(), {('binance', 'BTC'): 4, ('kraken', 'ETH'): 1})
+        self.assert_exported_everything()
+
+        # Nothing new, so no part is written.
+        self.assertEqual(self.export(), {('binance', 'BTC'): 0, ('kraken', 'ETH'): 0})
+        self.assertEqual(len(self.exported('binance', 'BTC')), 1)
+
+        # Rows inserted later with the newest exported time, one of them an exact duplicate of an exported row,
+        # and newer rows, now with a note.
+        self.insert([
+            (3, 'binance', 'BTC', 103.5, 1.0, 'late'), (3, 'binance', 'BTC', 103.0, 4.0, None),
+            (4, 'binance', 'BTC', 104.0, 1.0, 'new'), (1, 'kraken', 'ETH', 10.5, 2.0, None),
+            (2, 'kraken', 'ETH', 11.0, 1.0, None),
+        ])
+        self.assertEqual(self.export(), {('binance', 'BTC'): 3, ('kraken', 'ETH'): 2})
+        self.assert_exported_everything()
+        self.assertEqual(len(self.exported('binance', 'BTC')), 2)
+
+        # Every part has the same schema, although the notes were all NULL in the first export.
+        schemas = {table.schema.remove_metadata() for exchange, asset in [('binance', 'BTC'), ('kraken', 'ETH')]
+                   for table in self.exported(exchange, asset)}
+        self.assertEqual(len(schemas), 1)
+        self.assertEqual(str(schemas.pop().field('note').type), 'string')
+
+    def test_export_new_partition(self):
+        self.insert([(1, 'binance', 'BTC', 100.0, 1.0, 'a')])
+        self.export()
+        # A partition that appears after the first export uses the schema of the parts already exported.
+        self.insert([(5, 'kraken', 'ETH', 10.0, 1.0, None)])
+        self.assertEqual(self.export(), {('binance', 'BTC'): 0, ('kraken', 'ETH'): 1})
+        self.assertEqual(self.exported('kraken', 'ETH')[0].schema.remove_metadata(),
+                         self.exported('binance', 'BTC')[0].schema.remove_metadata())
+        self.assert_exported_everything()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+# Tests of the query result cache, through `query` and `query_df` on a SQLite database:
+#     python -m unittest utility.test_query_cache
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from sql_connection import SQLConnection
+from utility.cache import QueryCache
+from utility.query import query, query_df
+
+TRADES = "SELECT time, exchange, price FROM trades WHERE exchange = '{}' ORDER BY time"
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.disk_dir = os.path.join(self.tmp_dir.name, 'query_cache')
+        path = os.path.join(self.tmp_dir.name, 'trades.db')
+        self.queries = []
+
+        def connect():
+            connection = sqlite3.connect(path, check_same_thread=False)
+            connection.set_trace_callback(self.queries.append)
+            return connection
+        self.sql = SQLConnection(connect=connect)
+        with self.sql.connection() as connection:
+            connection.execute("CREATE TABLE trades (time INTEGER, exchange TEXT, price REAL)")
+            connection.execute("CREATE TABLE orders (time INTEGER, exchange TEXT, side TEXT)")
+            connection.executemany("INSERT INTO trades VALUES (?, ?, ?)",
+                                   [(t, exchange, 100.0 + t) for exchange in ['binance', 'kraken', 'poloniex']
+                                    for t in range(50)])
+            connection.executemany("INSERT INTO orders VALUES (?, 'binance', 'buy')", [(t,) for t in range(10)])
+            connection.commit()
+        self.queries.clear()
+
+    def tearDown(self):
+        for pool in SQLConnection._pools.values():
+            pool.close()
+        SQLConnection._pools.clear()
+        self.tmp_dir.cleanup()
+
+    def runs(self):
+        return len([q for q in self.queries if q.lstrip().upper().startswith('SELECT')])
+
+    def test_cache_hits(self):
+        cache = QueryCache()
+        rows = query(TRADES.format('binance'), self.sql, cache=cache)
+        # The same query written differently, and through a plain cursor of the same database, is a hit.
+        self.assertEqual(query(f"  {TRADES.format('binance')}\n ;", self.sql, cache=cache), rows)
+        self.assertEqual(self.runs(), 1)
+        # Literals are not normalized, and rows and DataFrames are cached apart.
+        query(TRADES.format('binance').replace("'binance'", "'binance '"), self.sql, cache=cache)
+        frame = query_df(TRADES.format('binance'), cursor=self.sql, cache=cache)
+        self.assertEqual(self.runs(), 3)
+        self.assertEqual(list(frame.itertuples(index=False, name=None)), rows)
+
+        stats = cache.stats
+        self.assertEqual((stats['memory_hits'], stats['misses'], stats['entries']), (1, 3, 3))
+        self.assertAlmostEqual(stats['hit_rate'], 0.25)
+        self.assertGreater(stats['bytes'], 0)
+
+    def test_lru_byte_bound(self):
+        probe = QueryCache()
+        query(TRADES.format('binance'), self.sql, cache=probe)
+        size = probe.stats['bytes']
+
+        # Room for two results of the same size.
+        cache = QueryCache(max_bytes=int(size * 2.5))
+        for exchange in ['binance', 'kraken', 'binance', 'poloniex']:
+            query(TRADES.format(exchange), self.sql, cache=cache)
+        # poloniex evicted kraken, the least recently used.
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertLessEqual(cache.stats['bytes'], cache.max_bytes)
+        runs = self.runs()
+        query(TRADES.format('binance'), self.sql, cache=cache)
+        query(TRADES.format('poloniex'), self.sql, cache=cache)
+        self.assertEqual(self.runs(), runs)
+        query(TRADES.format('kraken'), self.sql, cache=cache)
+        self.assertEqual(self.runs(), runs + 1)
+
+        # A result larger than the bound is returned but not kept.
+        small = QueryCache(max_bytes=size // 2)
+        self.assertEqual(len(query(TRADES.format('binance'), self.sql, cache=small)), 50)
+        self.assertEqual((small.stats['entries'], small.stats['bytes']), (0, 0))
+
+    def test_ttl(self):
+        now = [1000.0]
+        cache = QueryCache(ttl=60, disk_dir=self.disk_dir)
+        with mock.patch('time.time', lambda: now[0]):
+            query(TRADES.format('binance'), self.sql, cache=cache)
+            query(TRADES.format('kraken'), self.sql, cache=cache, ttl=5)
+            now[0] += 30
+            query(TRADES.format('binance'), self.sql, cache=cache)
+            self.assertEqual(self.runs(), 2)
+            # Past its own TTL, in memory and on disk.
+            query(TRADES.format('kraken'), self.sql, cache=cache)
+            self.assertEqual(self.runs(), 3)
+            now[0] += 31
+            query(TRADES.format('binance'), self.sql, cache=cache)
+            self.assertEqual(self.runs(), 4)
+            # Expired files are not read back either.
+            now[0] += 3600
+            query(TRADES.format('binance'), self.sql, cache=QueryCache(disk_dir=self.disk_dir))
+            self.assertEqual(self.runs(), 5)
+
+    def test_invalidate(self):
+        cache = QueryCache(disk_dir=self.disk_dir)
+        join = "SELECT o.time, t.price FROM main.orders o JOIN `trades` AS t ON t.time = o.time"
+        for sql_query in [TRADES.format('binance'), join, "SELECT * FROM orders"]:
+            query(sql_query, self.sql, cache=cache)
+        # A string naming a table is not a read of it.
+        query("SELECT 'FROM trades' AS note FROM orders LIMIT 1", self.sql, cache=cache)
+
+        # Both queries reading trades, from memory and disk.
+        self.assertEqual(cache.invalidate('TRADES'), 4)
+        self.assertEqual(cache.stats['entries'], 2)
+        runs = self.runs()
+        query("SELECT * FROM orders", self.sql, cache=QueryCache(disk_dir=self.disk_dir))
+        query(join, self.sql, cache=QueryCache(disk_dir=self.disk_dir))
+        self.assertEqual(self.runs(), runs + 1)
+        self.assertEqual(cache.invalidate('candles'), 0)
+
+        cache.clear()
+        self.assertEqual((cache.stats['entries'], cache.stats['disk_bytes']), (0, 0))
+
+    def test_copies(self):
+        cache = QueryCache()
+        frame = query_df(TRADES.format('binance'), cursor=self.sql, cache=cache)
+        frame['price'] = 0.0
+        frame.drop(columns='exchange', inplace=True)
+        again = query_df(TRADES.format('binance'), cursor=self.sql, cache=cache)
+        self.assertEqual(list(again.columns), ['time', 'exchange', 'price'])
+        self.assertEqual(again['price'].iloc[0], 100.0)
+        again.iloc[0, 2] = -1.0
+        self.assertEqual(query_df(TRADES.format('binance'), cursor=self.sql, cache=cache)['price'].iloc[0], 100.0)
+
+        rows = query(TRADES.format('binance'), self.sql, cache=cache)
+        rows.clear()
+        self.assertEqual(len(query(TRADES.format('binance'), self.sql, cache=cache)), 50)
+        self.assertEqual(self.runs(), 2)
+
+    def test_disk_tier(self):
+        cache = QueryCache(disk_dir=self.disk_dir)
+        frame = query_df(TRADES.format('binance'), cursor=self.sql, cache=cache)
+        rows = query(TRADES.format('kraken'), self.sql, cache=cache)
+        empty = query("SELECT * FROM trades WHERE exchange = 'none'", self.sql, cache=cache)
+
+        # A new cache (e.g. the next run) reads them back from disk, as they were.
+        cache = QueryCache(disk_dir=self.disk_dir)
+        pd.testing.assert_frame_equal(query_df(TRADES.format('binance'), cursor=self.sql, cache=cache), frame)
+        self.assertEqual(query(TRADES.format('kraken'), self.sql, cache=cache), rows)
+        self.assertEqual(query("SELECT * FROM trades WHERE exchange = 'none'", self.sql, cache=cache), empty)
+        self.assertEqual(self.runs(), 3)
+        self.assertEqual((cache.stats['disk_hits'], cache.stats['entries']), (3, 3))
+
+        # zstd compressed Arrow files: smaller than the same table uncompressed.
+        files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir)]
+        self.assertEqual(len(files), 3)
+        for path in files:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+            if table.num_rows == 50:
+                uncompressed = os.path.join(self.tmp_dir.name, 'uncompressed.arrow')
+                feather.write_feather(table, uncompressed, compression='uncompressed')
+                self.assertLess(os.path.getsize(path), os.path.getsize(uncompressed))
+
+        # Files over `disk_max_bytes` are evicted, least recently used first.
+        bounded = QueryCache(disk_dir=self.disk_dir, disk_max_bytes=max(map(os.path.getsize, files)))
+        query(TRADES.format('poloniex'), self.sql, cache=bounded)
+        self.assertLessEqual(bounded.stats['disk_bytes'], bounded.disk_max_bytes)
+
+    def test_rows_without_pandas(self):
+        # Caching rows does not import pandas.
+        script = (
+            "import sys\n"
+            "from utility.cache import QueryCache\n"
+            "class Source:\n"
+            "    cache_key = 'db'\n"
+            "cache = QueryCache()\n"
+            "for _ in range(2):\n"
+            "    assert cache.fetch(Source(), 'SELECT 1', 'rows', lambda: [(1,)]) == [(1,)]\n"
+            "assert cache.stats['hits'] == 1\n"
+            "assert 'pandas' not in sys.modules, 'pandas was imported'\n"
+        )
+        theta = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, '-c', script], cwd=theta, check=True)
+
+    def test_invalid_input(self):
+        with self.assertRaises(AssertionError):
+            QueryCache(max_bytes=-1)
+        with self.sql.cursor() as cursor:
+            # A plain cursor does not say which database it reads.
+            with self.assertRaises(AssertionError):
+                query(TRADES.format('binance'), cursor, cache=QueryCache())
+            self.assertEqual(len(query(TRADES.format('binance'), cursor, cache=QueryCache(namespace='trades.db'))),
+                             50)
+
+
+if __name__ == '__main__':
+    unittest.main()